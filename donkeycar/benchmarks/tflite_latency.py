@@ -0,0 +1,76 @@
+"""
+Measures the per frame latency of a tflite pilot when the normalised image
+is copied into the interpreter, compared to writing it straight into the
+interpreter's input tensor as KerasPilot.run does, for different numbers of
+interpreter threads.
+
+Usage:
+    python tflite_latency.py [--type=<model>] [--runs=<n>] [--threads=<list>]
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from donkeycar.config import Config
+from donkeycar.parts.interpreter import keras_to_tflite, TfLite
+from donkeycar.utils import get_model_by_type, get_test_img
+
+
+def latencies(func: Callable, runs: int) -> np.ndarray:
+    """ Per call times in ms of func after a few warm up calls """
+    for _ in range(10):
+        func()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return 1000 * np.array(times)
+
+
+def benchmark(model_type: str, runs: int, threads: List[int]) -> List[Dict]:
+    cfg = Config()
+    cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH = 120, 160, 3
+    cfg.HAVE_ODOM = False
+    cfg.MODEL_CATEGORICAL_MAX_THROTTLE_RANGE = 0.8
+    km = get_model_by_type(model_type, cfg)
+    img = get_test_img(km)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tflite_path = os.path.join(tmp, 'model.tflite')
+        keras_to_tflite(km.interpreter.model, tflite_path)
+        for num_threads in threads:
+            kl = get_model_by_type(model_type, cfg)
+            kl.interpreter = TfLite(num_threads=num_threads)
+            kl.load(tflite_path)
+            paths = {
+                'copy': lambda: kl.inference(kl.normalize(img), None),
+                'zero-copy': lambda: kl.run(img)
+            }
+            for name, func in paths.items():
+                t = latencies(func, runs)
+                result = {'threads': num_threads, 'path': name,
+                          'mean_ms': float(t.mean()),
+                          'p50_ms': float(np.percentile(t, 50)),
+                          'p99_ms': float(np.percentile(t, 99))}
+                results.append(result)
+                print(f'threads {num_threads:<4}{name:<12}'
+                      f'mean {result["mean_ms"]:7.3f}ms  '
+                      f'p50 {result["p50_ms"]:7.3f}ms  '
+                      f'p99 {result["p99_ms"]:7.3f}ms')
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--type', default='linear')
+    parser.add_argument('--runs', type=int, default=500)
+    parser.add_argument('--threads', default='1,2,4',
+                        help='comma separated numbers of threads')
+    args = parser.parse_args()
+    benchmark(args.type, args.runs,
+              [int(n) for n in args.threads.split(',')])
@@ -0,0 +1,99 @@
+"""
+Compares epoch time and final loss of KerasPilot.train for the linear,
+categorical and 3d models with the different precision and compilation
+options on random data, so the fastest settings for a training machine can
+be picked.
+
+Usage:
+    python train_precision.py [--epochs=<n>] [--steps=<n>] [--batch=<n>]
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+import tensorflow as tf
+
+from donkeycar.config import Config
+from donkeycar.parts.keras import KerasPilot
+from donkeycar.utils import get_model_by_type
+
+SETTINGS = {
+    'float32': {},
+    'jit': {'jit_compile': True},
+    'steps_per_execution=8': {'steps_per_execution': 8},
+    'mixed_bfloat16': {'mixed_precision': 'mixed_bfloat16'},
+    'mixed_float16': {'mixed_precision': 'mixed_float16'},
+}
+
+
+def random_dataset(kl: KerasPilot, num: int, batch_size: int) \
+        -> tf.data.Dataset:
+    """ Random inputs and targets in the shapes of the model """
+    def random(shapes: Dict[str, tf.TensorShape]) -> Dict[str, np.ndarray]:
+        return {k: np.random.uniform(size=(num,) + tuple(s)).astype(np.float32)
+                for k, s in shapes.items()}
+    x_shapes, y_shapes = kl.output_shapes()
+    data = tf.data.Dataset.from_tensor_slices((random(x_shapes),
+                                               random(y_shapes)))
+    return data.repeat().batch(batch_size)
+
+
+def benchmark(model_types: List[str], epochs: int, steps: int,
+              batch_size: int) -> List[Dict]:
+    cfg = Config()
+    cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH = 120, 160, 3
+    cfg.SEQUENCE_LENGTH = 3
+    cfg.HAVE_ODOM = False
+    cfg.MODEL_CATEGORICAL_MAX_THROTTLE_RANGE = 0.8
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for model_type in model_types:
+            for name, options in SETTINGS.items():
+                np.random.seed(0)
+                tf.random.set_seed(0)
+                kl = get_model_by_type(model_type, cfg)
+                data = random_dataset(kl, steps * batch_size, batch_size)
+                epoch_times = []
+
+                class Timer(tf.keras.callbacks.Callback):
+                    def on_epoch_begin(self, epoch, logs=None):
+                        self.start = time.perf_counter()
+
+                    def on_epoch_end(self, epoch, logs=None):
+                        epoch_times.append(time.perf_counter() - self.start)
+
+                try:
+                    history = kl.train(
+                        model_path=os.path.join(tmp, f'{model_type}.h5'),
+                        train_data=data, train_steps=steps,
+                        batch_size=batch_size, validation_data=data,
+                        validation_steps=1, epochs=epochs, verbose=0,
+                        patience=epochs, callbacks=[Timer()], **options)
+                except Exception as e:
+                    print(f'{model_type:<12}{name:<24} failed: {e}')
+                    continue
+                # first epoch includes tracing and compilation
+                result = {'model': model_type, 'setting': name,
+                          'first_epoch_s': epoch_times[0],
+                          'epoch_s': float(np.mean(epoch_times[1:]
+                                                   or epoch_times)),
+                          'loss': history['loss'][-1]}
+                results.append(result)
+                print(f'{model_type:<12}{name:<24}'
+                      f'first epoch {result["first_epoch_s"]:7.2f}s  '
+                      f'epoch {result["epoch_s"]:7.2f}s  '
+                      f'loss {result["loss"]:.4f}')
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=64)
+    args = parser.parse_args()
+    benchmark(['linear', 'categorical', '3d'], args.epochs, args.steps,
+              args.batch)
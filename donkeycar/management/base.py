@@ -1,4 +1,5 @@
 import argparse
+import json
 import os
 import shutil
 import socket
@@ -290,6 +291,8 @@ class MakeMovieShell(BaseCommand):
         parser.add_argument('--start', type=int, default=0, help='first frame to process')
         parser.add_argument('--end', type=int, default=-1, help='last frame to process')
         parser.add_argument('--scale', type=int, default=2, help='make image frame output larger by X mult')
+        parser.add_argument('--batch', type=int, default=64,
+                            help='number of frames the model runs on at once')
         parser.add_argument(
             '--draw-user-input',
             default=True, action='store_false',
@@ -439,10 +442,12 @@ class ShowCnnActivations(BaseCommand):
 class ShowPredictionPlots(BaseCommand):
 
     def plot_predictions(self, cfg, tub_paths, model_path, limit, model_type,
-                         noshow):
+                         noshow, batch_size=64):
         """
         Plot model predictions for angle and throttle against data from tubs.
+        The model runs on batch_size records at once.
         """
+        import numpy as np
         import matplotlib.pyplot as plt
         import pandas as pd
         from pathlib import Path
@@ -467,19 +472,20 @@ class ShowPredictionPlots(BaseCommand):
         bar = IncrementalBar('Inferencing', max=len(records))
 
         output_names = list(model.output_shapes()[1].keys())
-        for tub_record in records:
-            input_dict = model.x_transform(
-                tub_record, lambda x: normalize_image(x))
-            pilot_angle, pilot_throttle = \
-                model.inference_from_dict(input_dict)
-            y_dict = model.y_transform(tub_record)
-            user_angle, user_throttle \
-                = y_dict[output_names[0]], y_dict[output_names[1]]
-            user_angles.append(user_angle)
-            user_throttles.append(user_throttle)
-            pilot_angles.append(pilot_angle)
-            pilot_throttles.append(pilot_throttle)
-            bar.next()
+        for i in range(0, len(records), batch_size):
+            chunk = records[i:i + batch_size]
+            xs = [model.x_transform(tub_record, lambda x: normalize_image(x))
+                  for tub_record in chunk]
+            input_dict = {k: np.stack([np.asarray(x[k]) for x in xs])
+                          for k in xs[0]}
+            pilot_outputs = model.inference_batch(input_dict)
+            y_dict = model.y_transform_batch(chunk)
+            user_angles.extend(y_dict[output_names[0]])
+            user_throttles.extend(y_dict[output_names[1]])
+            for pilot_angle, pilot_throttle in pilot_outputs:
+                pilot_angles.append(pilot_angle)
+                pilot_throttles.append(pilot_throttle)
+            bar.next(len(chunk))
         print()  # to break the line after progress bar finishes.
 
         angles_df = pd.DataFrame({'user_angle': user_angles,
@@ -510,6 +516,8 @@ class ShowPredictionPlots(BaseCommand):
         parser.add_argument('--type', default=None, help='model type')
         parser.add_argument('--noshow', default=False, action="store_true",
                             help='if plot is shown in window')
+        parser.add_argument('--batch', type=int, default=64,
+                            help='number of records the model runs on at once')
         parser.add_argument('--config', default='./config.py', help=HELP_CONFIG)
 
         parsed_args = parser.parse_args(args)
@@ -520,7 +528,7 @@ class ShowPredictionPlots(BaseCommand):
         args.tub = ','.join(args.tub)
         cfg = load_config(args.config)
         self.plot_predictions(cfg, args.tub, args.model, args.limit,
-                              args.type, args.noshow)
+                              args.type, args.noshow, args.batch)
 
 
 class Train(BaseCommand):
@@ -543,6 +551,14 @@ class Train(BaseCommand):
         parser.add_argument('--checkpoint', type=str,
                             help='location of checkpoint to resume training from')
         parser.add_argument('--transfer', type=str, help='transfer model')
+        parser.add_argument('--shards', type=str, default=None,
+                            help='train from the shards exported by '
+                                 'tubexport in this directory instead of the '
+                                 'tubs')
+        parser.add_argument('--incremental', action='store_true',
+                            help='fine-tune the transfer model, or the latest '
+                                 'model in the database, only on the tub '
+                                 'sessions it has not been trained on')
         parser.add_argument('--comment', type=str,
                             help='comment added to model database - use '
                                  'double quotes for multiple words')
@@ -551,16 +567,24 @@ class Train(BaseCommand):
 
     def run(self, args):
         args = self.parse_args(args)
-        args.tub = ','.join(args.tub)
+        args.tub = ','.join(args.tub) if args.tub else None
         my_cfg = args.myconfig
         cfg = load_config(args.config, my_cfg)
         framework = args.framework if args.framework \
             else getattr(cfg, 'DEFAULT_AI_FRAMEWORK', 'tensorflow')
 
-        if framework == 'tensorflow':
+        if args.incremental:
+            if framework != 'tensorflow':
+                logger.error('Incremental training is only supported with '
+                             'tensorflow')
+                return
+            from donkeycar.pipeline.training import train_incremental
+            train_incremental(cfg, args.tub, args.transfer, args.model,
+                              args.type, args.comment)
+        elif framework == 'tensorflow':
             from donkeycar.pipeline.training import train
             train(cfg, args.tub, args.model, args.type, args.transfer,
-                  args.comment)
+                  args.comment, shards=args.shards)
         elif framework == 'pytorch':
             from donkeycar.parts.pytorch.torch_train import train
             train(cfg, args.tub, args.model, args.type,
@@ -570,6 +594,141 @@ class Train(BaseCommand):
                          f"one of 'tensorflow' or 'pytorch'")
 
 
+class Sweep(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='sweep',
+                                         usage='%(prog)s [options]')
+        parser.add_argument('--tub', nargs='+', help='tub data for training')
+        parser.add_argument('--sweep', required=True,
+                            help='json file with a list of runs, each a '
+                                 'dictionary of config overrides and the '
+                                 'optional keys type, transfer and comment')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='number of runs training concurrently')
+        parser.add_argument('--cache', default=None,
+                            help='directory for the decoded frame cache, '
+                                 'which is reused by later sweeps of the '
+                                 'same tubs, defaults to a temporary '
+                                 'directory')
+        parser.add_argument('--config', default='./config.py', help=HELP_CONFIG)
+        parser.add_argument('--myconfig', default='./myconfig.py',
+                            help='file name of myconfig file, defaults to '
+                                 'myconfig.py')
+        parser.add_argument('--comment', type=str,
+                            help='comment added to model database - use '
+                                 'double quotes for multiple words')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        from donkeycar.pipeline.sweep import sweep
+        args = self.parse_args(args)
+        with open(args.sweep, 'r') as f:
+            runs = json.load(f)
+        entries = sweep(args.config, args.myconfig, ','.join(args.tub), runs,
+                        processes=args.processes, cache_dir=args.cache,
+                        comment=args.comment)
+        for entry in entries:
+            print(f"{entry['Name']}: {entry['Type']} final loss "
+                  f"{entry['History']['loss'][-1]:.4f}")
+
+
+class TubExport(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='tubexport',
+                                         usage='%(prog)s [options]')
+        parser.add_argument('--tub', nargs='+', required=True,
+                            help='tub data to export')
+        parser.add_argument('--out', required=True,
+                            help='output directory of the shards')
+        parser.add_argument('--type', default=None,
+                            help='model type the shards are made for')
+        parser.add_argument('--shard-size', type=int, default=1000,
+                            help='number of records per shard')
+        parser.add_argument('--compress', action='store_true',
+                            help='compress the shards')
+        parser.add_argument('--config', default='./config.py', help=HELP_CONFIG)
+        parser.add_argument('--myconfig', default='./myconfig.py',
+                            help='file name of myconfig file, defaults to '
+                                 'myconfig.py')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        from donkeycar.pipeline.shards import export_shards
+        args = self.parse_args(args)
+        cfg = load_config(args.config, args.myconfig)
+        export_shards(cfg, ','.join(args.tub), args.out, args.type,
+                      args.shard_size, args.compress)
+
+
+class BenchmarkPipeline(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='benchmark-pipeline',
+                                         usage='%(prog)s [options]')
+        parser.add_argument('--tub', nargs='+', help='tub data for training')
+        parser.add_argument('--type', default=None, help='model type')
+        parser.add_argument('--batches', type=int, default=100,
+                            help='number of batches to pull, defaults to 100')
+        parser.add_argument('--no-aug', action='store_true',
+                            help='run the validation pipeline without '
+                                 'augmentations')
+        parser.add_argument('--config', default='./config.py', help=HELP_CONFIG)
+        parser.add_argument('--myconfig', default='./myconfig.py',
+                            help='file name of myconfig file, defaults to '
+                                 'myconfig.py')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        from donkeycar.pipeline.training import benchmark_pipeline
+        args = self.parse_args(args)
+        cfg = load_config(args.config, args.myconfig)
+        benchmark_pipeline(cfg, ','.join(args.tub), args.type, args.batches,
+                           is_train=not args.no_aug)
+
+
+class BenchmarkPilot(BaseCommand):
+
+    def parse_args(self, args):
+        from donkeycar.management.pilot_benchmark import MODEL_TYPES, FORMATS
+        parser = argparse.ArgumentParser(prog='benchmark-pilot',
+                                         usage='%(prog)s [options]')
+        parser.add_argument('--type', nargs='+', choices=MODEL_TYPES,
+                            help='model types, defaults to all')
+        parser.add_argument('--format', nargs='+', choices=list(FORMATS),
+                            help='model formats, defaults to all')
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='number of timed inferences per model, '
+                                 'defaults to 200')
+        parser.add_argument('--out', default=None,
+                            help='json file for the results, printed if not '
+                                 'given')
+        parser.add_argument('--config', default='./config.py', help=HELP_CONFIG)
+        parser.add_argument('--myconfig', default='./myconfig.py',
+                            help='file name of myconfig file, defaults to '
+                                 'myconfig.py')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        from donkeycar.management.pilot_benchmark import benchmark_pilots
+        args = self.parse_args(args)
+        cfg = load_config(args.config, args.myconfig)
+        results = benchmark_pilots(cfg, args.type, args.format,
+                                   args.iterations)
+        text = json.dumps(results, indent=2)
+        if args.out:
+            with open(args.out, 'w') as f:
+                f.write(text)
+            print(f'Written benchmark results to {args.out}')
+        else:
+            print(text)
+
+
 class ModelDatabase(BaseCommand):
 
     def parse_args(self, args):
@@ -614,6 +773,10 @@ def execute_from_command_line():
         'cnnactivations': ShowCnnActivations,
         'update': UpdateCar,
         'train': Train,
+        'sweep': Sweep,
+        'tubexport': TubExport,
+        'benchmark-pipeline': BenchmarkPipeline,
+        'benchmark-pilot': BenchmarkPilot,
         'models': ModelDatabase,
         'ui': Gui,
     }
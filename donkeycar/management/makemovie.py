@@ -1,15 +1,11 @@
 import moviepy.editor as mpy
-from tensorflow.python.keras import activations
-from tensorflow.python.keras import backend as K
-import tensorflow as tf
 import cv2
-from matplotlib import cm
-try:
-    from vis.utils import utils
-except:
-    raise Exception("Please install keras-vis: pip install git+https://github.com/autorope/keras-vis.git")
+
+from collections import deque
 
 import donkeycar as dk
+from donkeycar.parts.interpreter import split_batch
+from donkeycar.parts.salient import VisualBackProp, overlay
 from donkeycar.parts.tub_v2 import Tub
 from donkeycar.utils import *
 
@@ -46,10 +42,6 @@ class MakeMovie(object):
             if args.model is None:
                 print("ERR>> salient visualization requires a model. Pass with the --model arg.")
                 parser.print_help()
-
-            if args.type not in ['linear', 'categorical']:
-                print("Model type {} is not supported. Only linear or categorical is supported for salient visualization".format(args.type))
-                parser.print_help()
                 return
 
         self.model_type = args.type
@@ -67,14 +59,18 @@ class MakeMovie(object):
             self.current += 1
 
         self.scale = args.scale
+        self.batch_size = args.batch
+        # upcoming frames as tuples of record, image, model output and
+        # salient mask
+        self.frames = deque()
         self.keras_part = None
-        self.do_salient = False
+        self.salient = None
         self.user = args.draw_user_input
         if args.model is not None:
             self.keras_part = get_model_by_type(args.type, cfg=self.cfg)
             self.keras_part.load(args.model)
             if args.salient:
-                self.do_salient = self.init_salient(self.keras_part.interpreter.model)
+                self.salient = self.init_salient()
 
         print('making movie', args.out, 'from', num_frames, 'images')
         clip = mpy.VideoClip(self.make_frame, duration=((num_frames - 1) / self.cfg.DRIVE_LOOP_HZ))
@@ -105,44 +101,73 @@ class MakeMovie(object):
         green = (0, 255, 0)
         self.draw_line_into_image(user_angle, user_throttle, False, img_drawon, green)
 
-    def draw_model_prediction(self, img, img_drawon):
+    def model_inputs(self, imgs):
         """
-        query the model for it's prediction, draw the predictions
-        as a blue line on the image
+        normalize a list of images into a batch of model inputs, returns
+        None if the images don't match the model input
         """
-        if self.keras_part is None:
-            return
-
         expected = tuple(self.keras_part.get_input_shapes()[0][1:])
-        actual = img.shape
-
-        # if model expects grey-scale but got rgb, covert
-        if expected[2] == 1 and actual[2] == 3:
-            # normalize image before grey conversion
-            grey_img = rgb2gray(img)
-            actual = grey_img.shape
-            img = grey_img.reshape(grey_img.shape + (1,))
-
-        if expected != actual:
-            print(f"expected input dim {expected} didn't match actual dim "
-                  f"{actual}")
+        batch = []
+        for img in imgs:
+            # if model expects grey-scale but got rgb, covert
+            if expected[2] == 1 and img.shape[2] == 3:
+                # normalize image before grey conversion
+                grey_img = rgb2gray(img)
+                img = grey_img.reshape(grey_img.shape + (1,))
+
+            if expected != img.shape:
+                print(f"expected input dim {expected} didn't match actual dim "
+                      f"{img.shape}")
+                return None
+            batch.append(self.keras_part.normalize(img))
+        return np.stack(batch)
+
+    def next_frame(self):
+        """
+        return the next record, its image, the model output and the salient
+        mask, the model and the salient masks run on batches of the
+        upcoming frames
+        """
+        if not self.frames:
+            num = min(self.batch_size, self.end_index - self.current)
+            recs = [self.iterator.next() for _ in range(num)]
+            imgs = [img_to_arr(Image.open(
+                os.path.join(self.tub.images_base_path,
+                             rec['cam/image_array']))) for rec in recs]
+            outputs = masks = [None] * num
+            batch = self.model_inputs(imgs) if self.keras_part is not None \
+                else None
+            if batch is not None:
+                outputs = split_batch(
+                    self.keras_part.interpreter.predict_batch(
+                        {'img_in': batch}))
+                if self.salient is not None:
+                    masks = self.salient.masks(batch)
+            self.frames.extend(zip(recs, imgs, outputs, masks))
+        return self.frames.popleft()
+
+    def draw_model_prediction(self, output, img_drawon):
+        """
+        draw the model prediction as a blue line on the image
+        """
+        if output is None:
             return
 
         blue = (0, 0, 255)
-        pilot_angle, pilot_throttle = self.keras_part.run(img)
+        pilot_angle, pilot_throttle = \
+            self.keras_part.interpreter_to_output(output)
         self.draw_line_into_image(pilot_angle, pilot_throttle, True, img_drawon, blue)
 
-    def draw_steering_distribution(self, img, img_drawon):
+    def draw_steering_distribution(self, output, img_drawon):
         """
-        query the model for it's prediction, draw the distribution of
-        steering choices, only for model type of Keras Categorical
+        draw the distribution of steering choices of the model output, only
+        for model type of Keras Categorical
         """
         from donkeycar.parts.keras import KerasCategorical
 
-        if self.keras_part is None or type(self.keras_part) is not KerasCategorical:
-            return        
-        pred_img = normalize_image(img)
-        angle_binned, _ = self.keras_part.interpreter.predict(pred_img, other_arr=None)
+        if output is None or type(self.keras_part) is not KerasCategorical:
+            return
+        angle_binned, _ = output
 
         x = 4
         dx = 4
@@ -157,78 +182,17 @@ class MakeMovie(object):
                 cv2.line(img_drawon, p1, p2, (200, 200, 200), 2)
             x += dx
 
-    def init_salient(self, model):
-        # Utility to search for layer index by name. 
-        # Alternatively we can specify this as -1 since it corresponds to the last layer.
-        output_name = []
-        layer_idx = []
-        for i, layer in enumerate(model.layers):
-            if "dropout" not in layer.name.lower() and "out" in layer.name.lower():
-                output_name.append(layer.name)
-                layer_idx.append(i)
-
-        if output_name is []:
-            print("Failed to find the model layer named with 'out'. Skipping salient.")
-            return False
-
-        print("####################")
-        print("Visualizing activations on layer:", output_name)
-        print("####################")
-        
-        # ensure we have linear activation
-        for li in layer_idx:
-            model.layers[li].activation = activations.linear
-        # build salient model and optimizer
-        sal_model = utils.apply_modifications(model)
-        self.sal_model = sal_model
-        return True
-
-    def compute_visualisation_mask(self, img):
-        img = img.reshape((1,) + img.shape)
-        images = tf.Variable(img, dtype=float)
-
-        if self.model_type == 'linear':
-            with tf.GradientTape(persistent=True) as tape:
-                tape.watch(images)
-                pred_list = self.sal_model(images, training=False)
-        elif self.model_type == 'categorical':
-            with tf.GradientTape(persistent=True) as tape:
-                tape.watch(images)
-                pred = self.sal_model(images, training=False)
-                pred_list = []
-                for p in pred:
-                    maxindex = tf.math.argmax(p[0])
-                    pred_list.append(p[0][maxindex])
-                    
-        grads = 0
-        for p in pred_list:
-            grad = tape.gradient(p, images)
-            grads += tf.math.square(grad)
-        grads = tf.math.sqrt(grads)
-
-        channel_idx = 1 if K.image_data_format() == 'channels_first' else -1
-        grads = np.sum(grads, axis=channel_idx)
-        res = utils.normalize(grads)[0]
-        return res
-
-    def draw_salient(self, img):
-
-        alpha = 0.004
-        beta = 1.0 - alpha
-        expected = self.keras_part.interpreter.model.inputs[0].shape[1:]
-        actual = img.shape
-
-        # check input depth and convert to grey to match expected model input
-        if expected[2] == 1 and actual[2] == 3:
-            grey_img = rgb2gray(img)
-            img = grey_img.reshape(grey_img.shape + (1,))
-
-        norm_img = normalize_image(img)
-        salient_mask = self.compute_visualisation_mask(norm_img)
-        salient_mask_stacked = cm.inferno(salient_mask)[:,:,0:3]
-        salient_mask_stacked = cv2.GaussianBlur(salient_mask_stacked,(3,3),cv2.BORDER_DEFAULT)
-        blend = cv2.addWeighted(img.astype('float32'), alpha, salient_mask_stacked.astype('float32'), beta, 0)
-        return blend
+    def init_salient(self):
+        """
+        create the salient mask computation of the model, returns None if
+        the model has no chain of convolutions to visualise
+        """
+        try:
+            return VisualBackProp(self.keras_part.interpreter.model)
+        except (ValueError, AttributeError) as e:
+            print(f"Model type {self.model_type} is not supported for "
+                  f"salient visualization, skipping salient: {e}")
+            return None
 
     def make_frame(self, t):
         '''
@@ -241,19 +205,16 @@ class MakeMovie(object):
         if self.current >= self.end_index:
             return None
 
-        rec = self.iterator.next()
-        img_path = os.path.join(self.tub.images_base_path, rec['cam/image_array'])
-        image_input = img_to_arr(Image.open(img_path))
+        rec, image_input, output, mask = self.next_frame()
         image = image_input
         
-        if self.do_salient:
-            image = self.draw_salient(image_input)
-            image = cv2.normalize(src=image, dst=None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        if mask is not None:
+            image = overlay(image_input, mask)
         
         if self.user: self.draw_user_input(rec, image_input, image)
         if self.keras_part is not None:
-            self.draw_model_prediction(image_input, image)
-            self.draw_steering_distribution(image_input, image)
+            self.draw_model_prediction(output, image)
+            self.draw_steering_distribution(output, image)
 
         if self.scale != 1:
             h, w, d = image.shape
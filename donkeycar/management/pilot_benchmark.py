@@ -0,0 +1,156 @@
+"""
+Inference benchmark of the pilots. Every model type is built with random
+weights, exported into each model format and driven through its interpreter
+for a fixed number of frames, measuring cold start, latency, throughput and
+memory. The results are returned as a json serialisable dictionary, so runs
+on different code versions or machines can be compared.
+"""
+import logging
+import os
+import platform
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import psutil
+import tensorflow as tf
+
+from donkeycar.config import Config
+from donkeycar.parts.interpreter import keras_to_tflite
+from donkeycar.parts.keras import KerasPilot
+from donkeycar.utils import get_model_by_type, get_test_img
+
+logger = logging.getLogger(__name__)
+
+MODEL_TYPES = ['linear', 'categorical', 'inferred', 'imu', 'memory',
+               'behavior', 'localizer', 'multihead', 'rnn', '3d']
+# model format, its file extension and the model type prefix selecting the
+# interpreter, savedmodels are run by the TensorRT interpreter which takes
+# any savedmodel
+FORMATS = {
+    'keras': ('.h5', ''),
+    'tflite': ('.tflite', 'tflite_'),
+    'tflite_int8': ('.int8.tflite', 'tflite_'),
+    'savedmodel': ('.savedmodel', 'tensorrt_'),
+}
+
+
+def export(kl: KerasPilot, model_format: str, path: str) -> None:
+    """ Saves the keras model of the pilot in the given format """
+    model = kl.interpreter.model
+    if model_format in ('keras', 'savedmodel'):
+        model.save(path)
+    elif model_format == 'tflite':
+        keras_to_tflite(model, path)
+    elif model_format == 'tflite_int8':
+        def data_gen():
+            for _ in range(20):
+                yield {inp.name.split(':')[0]: np.random.rand(
+                    1, *inp.shape[1:]).astype(np.float32)
+                    for inp in model.inputs}
+        keras_to_tflite(model, path, data_gen)
+    else:
+        raise ValueError(f'Unknown model format {model_format}')
+
+
+def pilot_inputs(kl: KerasPilot, model_type: str) -> tuple:
+    """ Random camera image and other input as passed by the drive loop """
+    img = get_test_img(kl)
+    if model_type in ('imu', 'behavior'):
+        size = int(kl.get_input_shapes()[1][-1])
+        return img, np.random.rand(size).tolist()
+    return img, None
+
+
+def rss_mb() -> float:
+    return psutil.Process().memory_info().rss / 2 ** 20
+
+
+def benchmark_pilot(cfg: Config, model_type: str, model_format: str,
+                    model_path: str, iterations: int) -> Dict[str, Any]:
+    """
+    Loads the model and runs it for the given number of frames.
+
+    :return:    dictionary of cold start time, i.e. creating the pilot,
+                loading the model and the first inference, latency
+                percentiles, throughput and resident memory
+    """
+    prefix = FORMATS[model_format][1]
+    rss_start = rss_mb()
+    start = time.perf_counter()
+    kl = get_model_by_type(prefix + model_type, cfg)
+    kl.load(model_path)
+    img, other = pilot_inputs(kl, model_type)
+    kl.run(img, other)
+    cold_start = time.perf_counter() - start
+    times = []
+    for _ in range(iterations):
+        t = time.perf_counter()
+        kl.run(img, other)
+        times.append(time.perf_counter() - t)
+    times = 1000 * np.array(times)
+    return {
+        'cold_start_s': cold_start,
+        'latency_p50_ms': float(np.percentile(times, 50)),
+        'latency_p99_ms': float(np.percentile(times, 99)),
+        'latency_mean_ms': float(times.mean()),
+        'throughput_fps': float(1000 * len(times) / times.sum()),
+        'rss_mb': rss_mb(),
+        'rss_delta_mb': rss_mb() - rss_start
+    }
+
+
+def benchmark_pilots(cfg: Config, model_types: Optional[List[str]] = None,
+                     formats: Optional[List[str]] = None,
+                     iterations: int = 200) -> Dict[str, Any]:
+    """
+    Benchmarks each model type in each format. Combinations which can't be
+    exported or run, like the rnn model in int8 tflite, are reported with their
+    error.
+
+    :param cfg:         donkey config, the image size is taken from it
+    :param model_types: model types, defaults to all
+    :param formats:     model formats, defaults to all
+    :param iterations:  number of timed frames per model
+    :return:            json serialisable results
+    """
+    model_types = model_types or MODEL_TYPES
+    formats = formats or list(FORMATS)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for model_type in model_types:
+            np.random.seed(0)
+            tf.random.set_seed(0)
+            kl = get_model_by_type(model_type, cfg)
+            for model_format in formats:
+                result = {'model_type': model_type, 'format': model_format}
+                path = os.path.join(tmp, model_type + FORMATS[model_format][0])
+                try:
+                    export(kl, model_format, path)
+                    result.update(benchmark_pilot(cfg, model_type,
+                                                  model_format, path,
+                                                  iterations))
+                    logger.info(
+                        f'{model_type:<12}{model_format:<14}'
+                        f'p50 {result["latency_p50_ms"]:8.2f}ms  '
+                        f'p99 {result["latency_p99_ms"]:8.2f}ms  '
+                        f'cold start {result["cold_start_s"]:6.2f}s')
+                except Exception as e:
+                    logger.warning(f'{model_type} as {model_format} failed: '
+                                   f'{e}')
+                    result['error'] = str(e)
+                results.append(result)
+    return {
+        'setup': {
+            'image_shape': [cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH],
+            'iterations': iterations,
+            'tensorflow': tf.__version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'results': results
+    }
@@ -0,0 +1,142 @@
+"""
+Asynchronous pilot part. The wrapped pilot runs on its own inference thread,
+so the inference of a frame overlaps with the camera, the tub writer, the
+web server and the other parts of the drive loop.
+"""
+import logging
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# wait for the result of the current frame, up to the timeout
+LATENCY = 'latency'
+# never wait, return the latest finished result, usually of the last frame
+THROUGHPUT = 'throughput'
+
+
+class AsyncPilot(object):
+    """
+    Threaded part which submits each frame to the inference thread and
+    returns the latest available pilot outputs. Frames arriving while the
+    inference thread is busy replace the waiting frame, so the pilot always
+    works on the newest one.
+
+    With the 'latency' policy run_threaded waits up to the timeout for the
+    result of the submitted frame. If the result is late, the latest older
+    result is returned. With the 'throughput' policy it never waits and
+    returns the result of the previous frame, so a model which takes most of
+    the loop period still keeps up with the loop frequency.
+
+    The outputs of the pilot are followed by the time the frame was
+    submitted, so downstream parts know the age of the command. Until the
+    first result is available all outputs are None.
+    """
+    def __init__(self, pilot: Any, policy: str = LATENCY,
+                 timeout: float = 0.05, num_outputs: int = 2) -> None:
+        """
+        :param pilot:       the pilot part, like a KerasPilot
+        :param policy:      'latency' or 'throughput'
+        :param timeout:     longest time in seconds to wait for the current
+                            frame with the latency policy
+        :param num_outputs: number of outputs of the pilot
+        """
+        assert policy in (LATENCY, THROUGHPUT), \
+            f'Unknown policy {policy}, use {LATENCY} or {THROUGHPUT}'
+        self.pilot = pilot
+        self.policy = policy
+        self.timeout = timeout
+        self.num_outputs = num_outputs
+        # guards the pilot against running and loading at the same time
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        # tuples of (frame number, timestamp, inputs / outputs)
+        self.pending: Optional[Tuple[int, float, tuple]] = None
+        self.result: Optional[Tuple[int, float, tuple]] = None
+        self.frame = 0
+        self.dropped = 0
+        self.stale = 0
+        self.inference_time = 0.0
+        self.inferences = 0
+        self.on = True
+
+    def load(self, model_path: str) -> None:
+        """ Loads a model into the pilot once the running inference has
+            finished. """
+        with self.lock:
+            self.pilot.load(model_path)
+
+    def warm_up(self, num_runs: int = 3) -> List[float]:
+        """ Warms up the pilot once the running inference has finished,
+            see KerasPilot.warm_up. """
+        if not hasattr(self.pilot, 'warm_up'):
+            return []
+        with self.lock:
+            return self.pilot.warm_up(num_runs)
+
+    def infer(self, inputs: tuple) -> tuple:
+        start = time.perf_counter()
+        with self.lock:
+            outputs = self.pilot.run(*inputs)
+        self.inference_time += time.perf_counter() - start
+        self.inferences += 1
+        return outputs if isinstance(outputs, tuple) else (outputs, )
+
+    def update(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.pending is not None or not self.on)
+                if not self.on:
+                    return
+                frame, timestamp, inputs = self.pending
+                self.pending = None
+            try:
+                outputs = self.infer(inputs)
+            except Exception as e:
+                logger.error(f'Inference of frame {frame} failed: {e}')
+                continue
+            with self.condition:
+                self.result = frame, timestamp, outputs
+                self.condition.notify_all()
+
+    def run_threaded(self, *inputs) -> tuple:
+        timestamp = time.time()
+        with self.condition:
+            self.frame += 1
+            frame = self.frame
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = frame, timestamp, inputs
+            self.condition.notify_all()
+            if self.policy == LATENCY:
+                self.condition.wait_for(
+                    lambda: self.result is not None
+                    and self.result[0] == frame or not self.on,
+                    timeout=self.timeout)
+            result = self.result
+        if result is None:
+            return (None, ) * self.num_outputs + (None, )
+        result_frame, result_timestamp, outputs = result
+        if result_frame != frame:
+            self.stale += 1
+        return outputs + (result_timestamp, )
+
+    def run(self, *inputs) -> tuple:
+        """ Runs the pilot synchronously, when not added as threaded part """
+        timestamp = time.time()
+        return self.infer(inputs) + (timestamp, )
+
+    def shutdown(self) -> None:
+        with self.condition:
+            self.on = False
+            self.condition.notify_all()
+        if self.inferences:
+            logger.info(f'AsyncPilot ran {self.inferences} inferences in '
+                        f'{1000 * self.inference_time / self.inferences:.1f}'
+                        f'ms on average, {self.dropped} of {self.frame} '
+                        f'frames were dropped and {self.stale} commands came '
+                        f'from an older frame')
+        if hasattr(self.pilot, 'shutdown'):
+            self.pilot.shutdown()
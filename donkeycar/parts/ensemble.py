@@ -0,0 +1,174 @@
+"""
+Ensemble of keras pilots which share one preprocessed input image. In
+cascade mode the cheap pilots run every frame and the expensive pilot only
+runs when the cheap pilots are not confident.
+"""
+import logging
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from donkeycar.parts.keras import KerasCategorical, KerasPilot
+
+logger = logging.getLogger(__name__)
+
+# run all pilots and average their outputs
+AVERAGE = 'average'
+# run the cheap pilots and the last pilot only if they are not confident
+CASCADE = 'cascade'
+# confidence from the normalised entropy of categorical outputs
+ENTROPY = 'entropy'
+# confidence from the spread of the outputs of the cheap pilots
+DISAGREEMENT = 'disagreement'
+
+
+def normalized_entropy(distribution: np.ndarray) -> float:
+    """
+    :param distribution:    probabilities of the bins
+    :return:                entropy divided by the entropy of the uniform
+                            distribution, between 0 for a single certain bin
+                            and 1 for the uniform distribution
+    """
+    p = np.clip(np.ravel(distribution), 1e-12, None)
+    p = p / p.sum()
+    return float(-np.sum(p * np.log(p)) / np.log(len(p)))
+
+
+def average_outputs(outputs: Sequence[tuple]) -> tuple:
+    """ Averages the outputs of several pilots element-wise """
+    if len(outputs) == 1:
+        return outputs[0]
+    averaged = tuple(np.mean([np.asarray(out[i], dtype=np.float64) for out
+                              in outputs], axis=0)
+                     for i in range(len(outputs[0])))
+    return tuple(float(a) if a.ndim == 0 else a for a in averaged)
+
+
+class EnsemblePilot(object):
+    """
+    Part which runs several single frame keras pilots of the same input
+    shape on one camera image. The image is normalised once into a shared
+    buffer which feeds all interpreters, and the other input is shared, too.
+
+    In 'average' mode all pilots run and their outputs are averaged. In
+    'cascade' mode the pilots are ordered from cheap to expensive: all but
+    the last pilot run every frame and their averaged outputs are returned
+    if their confidence is at least the threshold. Otherwise the last pilot
+    runs and its outputs are returned. The confidence is either one minus
+    the largest normalised entropy of the angle and throttle distributions
+    of the cheap categorical pilots ('entropy'), or one minus the largest
+    difference of the outputs of the cheap pilots ('disagreement').
+    """
+    def __init__(self, pilots: List[KerasPilot], mode: str = CASCADE,
+                 confidence: str = ENTROPY, threshold: float = 0.5) -> None:
+        """
+        :param pilots:      keras pilots, in cascade mode ordered from the
+                            cheapest to the most expensive one
+        :param mode:        'average' or 'cascade'
+        :param confidence:  'entropy' or 'disagreement', used in cascade mode
+        :param threshold:   confidence between 0 and 1 below which the last
+                            pilot runs in cascade mode
+        """
+        assert mode in (AVERAGE, CASCADE), \
+            f'Unknown mode {mode}, use {AVERAGE} or {CASCADE}'
+        assert confidence in (ENTROPY, DISAGREEMENT), \
+            f'Unknown confidence {confidence}, use {ENTROPY} or ' \
+            f'{DISAGREEMENT}'
+        assert pilots, 'Ensemble needs at least one pilot'
+        for pilot in pilots:
+            assert pilot.input_shape == pilots[0].input_shape, \
+                f'{pilot} has input shape {pilot.input_shape} but ' \
+                f'{pilots[0]} has {pilots[0].input_shape}'
+            assert type(pilot).run is KerasPilot.run, \
+                f'{pilot} is a sequence pilot which can not be ensembled'
+        if mode == CASCADE:
+            assert len(pilots) > 1, 'Cascade needs at least two pilots'
+            cheap = pilots[:-1]
+            if confidence == ENTROPY:
+                assert all(isinstance(p, KerasCategorical) for p in cheap), \
+                    'Entropy confidence needs categorical cheap pilots'
+            else:
+                assert len(cheap) > 1, \
+                    'Disagreement confidence needs two cheap pilots'
+        self.pilots = pilots
+        self.mode = mode
+        self.confidence = confidence
+        self.threshold = threshold
+        self.img_buffer = np.empty(pilots[0].input_shape, dtype=np.float32)
+        self.frames = 0
+        self.expensive_runs = 0
+
+    @property
+    def transformation(self):
+        return self.pilots[0].transformation
+
+    def set_image_transformation(self, transformation) -> None:
+        for pilot in self.pilots:
+            pilot.set_image_transformation(transformation)
+
+    def load(self, model_path: str) -> None:
+        """ Loads the model of the first, in cascade mode the cheapest,
+            pilot. The other pilots need to be loaded and warmed up before,
+            they can be shared with the ensemble of a reloaded model. """
+        self.pilots[0].load(model_path)
+
+    def warm_up(self, num_runs: int = 3) -> List[float]:
+        """ Warms up the first pilot, see KerasPilot.warm_up. It may run in
+            the background while a previous ensemble sharing the other
+            pilots drives, hence those are not touched. """
+        return self.pilots[0].warm_up(num_runs)
+
+    def test_inference(self) -> Tuple[Union[float, np.ndarray], ...]:
+        """ Runs the first pilot on its test inputs, the other pilots are
+            not touched like in warm_up. """
+        return self.pilots[0].test_inference()
+
+    def cheap_confidence(self, raw_outputs: List[tuple],
+                         outputs: List[tuple]) -> float:
+        if self.confidence == ENTROPY:
+            return 1.0 - max(normalized_entropy(dist) for raw in raw_outputs
+                             for dist in raw)
+        spread = max(float(np.max(np.abs(np.asarray(a, dtype=np.float64)
+                                         - np.asarray(b, dtype=np.float64))))
+                     for out in outputs[1:] for a, b in zip(outputs[0], out))
+        return 1.0 - spread
+
+    def infer(self, img_arr: np.ndarray, other_arr: Optional[np.ndarray]) \
+            -> Tuple[tuple, bool]:
+        """
+        :param img_arr:     normalised float32 image
+        :param other_arr:   other input or None
+        :return:            ensemble outputs and if the expensive pilot ran
+        """
+        run_all = self.mode == AVERAGE
+        cheap = self.pilots if run_all else self.pilots[:-1]
+        raw_outputs = [p.predict_normalized(img_arr, other_arr) for p in cheap]
+        outputs = [p.interpreter_to_output(raw)
+                   for p, raw in zip(cheap, raw_outputs)]
+        if run_all or self.cheap_confidence(raw_outputs, outputs) \
+                >= self.threshold:
+            return average_outputs(outputs), False
+        expensive = self.pilots[-1]
+        raw = expensive.predict_normalized(img_arr, other_arr)
+        return expensive.interpreter_to_output(raw), True
+
+    def run(self, img_arr: np.ndarray, other_arr: List[float] = None) \
+            -> Tuple[Union[float, np.ndarray], ...]:
+        """
+        :param img_arr:     uint8 [0,255] numpy array with image data
+        :param other_arr:   additional input shared by all pilots
+        :return:            tuple of the pilot outputs, like (angle, throttle)
+        """
+        np_other_array = np.array(other_arr) if other_arr else None
+        normalized = self.pilots[0].normalize(img_arr, out=self.img_buffer)
+        outputs, expensive = self.infer(normalized, np_other_array)
+        self.frames += 1
+        self.expensive_runs += expensive
+        return outputs
+
+    def shutdown(self) -> None:
+        if self.mode == CASCADE and self.frames:
+            logger.info(f'Cascade ran the expensive pilot {self.pilots[-1]} '
+                        f'on {self.expensive_runs} of {self.frames} frames')
+        for pilot in self.pilots:
+            pilot.shutdown()
@@ -19,8 +19,10 @@ import torch
 from donkeycar.utils import normalize_image, linear_bin
 from donkeycar.pipeline.types import TubRecord, TubDataset
 from donkeycar.pipeline.sequence import TubSequence
-from donkeycar.parts.interpreter import FastAIInterpreter, Interpreter, KerasInterpreter
+from donkeycar.parts.interpreter import FastAIInterpreter, Interpreter, KerasInterpreter, \
+    split_batch
 from donkeycar.parts.pytorch.torch_data import TorchTubDataset, get_default_transform
+from donkeycar.parts.pytorch.inference import export_torchscript
 
 from fastai.vision.all import *
 from fastai.data.transforms import *
@@ -101,9 +103,13 @@ class FastAiPilot(ABC):
                             state vector in the Behavioural model
         :return:            tuple of (angle, throttle)
         """
+        if not other_arr:
+            # the normalisation is fused into the traced model
+            out = self.interpreter.predict_image(img_arr)
+            return self.interpreter_to_output(out)
         transform = get_default_transform(resize=False)
         norm_arr = transform(img_arr)
-        tensor_other_array = torch.FloatTensor(other_arr) if other_arr else None
+        tensor_other_array = torch.FloatTensor(other_arr)
         return self.inference(norm_arr, tensor_other_array)
 
     def inference(self, img_arr: torch.tensor, other_arr: Optional[torch.tensor]) \
@@ -128,6 +134,15 @@ class FastAiPilot(ABC):
         output = self.interpreter.predict_from_dict(input_dict)
         return self.interpreter_to_output(output)
 
+    def inference_batch(self, img_arrs: Sequence[np.ndarray]) \
+            -> List[Tuple[Union[float, np.ndarray], ...]]:
+        """ Inferencing of many frames in one interpreter call
+            :param img_arrs:    uint8 [0,255] numpy arrays with image data
+            :return:            list of the outputs of each frame
+        """
+        output = self.interpreter.predict_batch({'img_in': np.stack(img_arrs)})
+        return [self.interpreter_to_output(out) for out in split_batch(output)]
+
     @abstractmethod
     def interpreter_to_output(
             self,
@@ -194,6 +209,11 @@ class FastAiPilot(ABC):
         history = { "loss" : list(map((lambda x: x.item()), self.learner.recorder.losses)) }
         return history
 
+    def export_torchscript(self, path: str) -> None:
+        """ Saves the model with the image normalisation fused in as
+            TorchScript, which FastAIInterpreter loads from a .pt file """
+        export_torchscript(self.interpreter.model, self.input_shape, path)
+
     def __str__(self) -> str:
         """ For printing model initialisation """
         return type(self).__name__
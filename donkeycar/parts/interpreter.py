@@ -2,7 +2,7 @@ import os
 from abc import ABC, abstractmethod
 import logging
 import numpy as np
-from typing import Union, Sequence, List
+from typing import Any, Callable, Dict, Optional, Union, Sequence, List
 
 import tensorflow as tf
 from tensorflow import keras
@@ -65,13 +65,34 @@ def saved_model_to_tensor_rt(saved_path: str, tensor_rt_path: str):
         converter = trt.TrtGraphConverterV2(
             input_saved_model_dir=saved_path,
             conversion_params=params)
-        converter.convert()
+        converted_func = converter.convert()
+
+        def input_fn():
+            yield [tf.zeros([1] + inp.shape.as_list()[1:], dtype=inp.dtype)
+                   for inp in converted_func.inputs]
+
+        # build the engines for batch size one now, so they are saved with
+        # the model and not built on the first inferences when driving
+        try:
+            converter.build(input_fn=input_fn)
+        except Exception as e:
+            logger.warning(f'Could not prebuild TensorRT engines, they will '
+                           f'be built on the first inference: {e}')
         converter.save(tensor_rt_path)
         logger.info(f'TensorRT conversion done.')
     except Exception as e:
         logger.error(f'TensorRT conversion failed because: {e}')
 
 
+def split_batch(outputs: Union[np.ndarray, Sequence[np.ndarray]]) \
+        -> List[Union[np.ndarray, List[np.ndarray]]]:
+    """ Splits the outputs of predict_batch into the outputs of the single
+        frames, in the same structure as returned by predict. """
+    if isinstance(outputs, (list, tuple)):
+        return [list(frame) for frame in zip(*outputs)]
+    return list(outputs)
+
+
 class Interpreter(ABC):
     """ Base class to delegate between Keras, TFLite and TensorRT """
 
@@ -104,6 +125,35 @@ class Interpreter(ABC):
     def predict_from_dict(self, input_dict) -> Sequence[Union[float, np.ndarray]]:
         pass
 
+    def predict_into(self,
+                     write_img: Callable[[Optional[np.ndarray]], np.ndarray],
+                     other_arr: np.ndarray) \
+            -> Sequence[Union[float, np.ndarray]]:
+        """
+        Like predict, but the normalised image is written by the caller
+        directly into the interpreter's input memory where the interpreter
+        supports that.
+
+        :param write_img:   function which writes the image into the given
+                            float32 buffer and returns it, if called with
+                            None it writes into a buffer of its own
+        :param other_arr:   additional model input, like imu data
+        :return:            the model outputs
+        """
+        return self.predict(write_img(None), other_arr)
+
+    def predict_batch(self, input_dict: Dict[str, np.ndarray]) \
+            -> Union[np.ndarray, List[np.ndarray]]:
+        """
+        Runs the model once on a batch of frames.
+
+        :param input_dict:  dictionary of input name and array with the
+                            inputs of all frames stacked along the first axis
+        :return:            the model outputs with the batch dimension kept,
+                            use split_batch to get the outputs per frame
+        """
+        raise NotImplementedError('Requires implementation')
+
     def summary(self) -> str:
         pass
 
@@ -117,6 +167,8 @@ class KerasInterpreter(Interpreter):
     def __init__(self):
         super().__init__()
         self.model: tf.keras.Model = None
+        # additional arguments for model.compile(), like jit_compile
+        self.compile_options: Dict[str, Any] = {}
 
     def set_model(self, pilot: 'KerasPilot') -> None:
         self.model = pilot.create_model()
@@ -130,12 +182,13 @@ class KerasInterpreter(Interpreter):
 
     def compile(self, **kwargs):
         assert self.model, 'Model not set'
-        self.model.compile(**kwargs)
+        self.model.compile(**kwargs, **self.compile_options)
 
     def invoke(self, inputs):
         outputs = self.model(inputs, training=False)
-        # for functional models the output here is a list
-        if type(outputs) is list:
+        # for functional models the output here is a list, or a tuple for
+        # traced models
+        if isinstance(outputs, (list, tuple)):
             # as we invoke the interpreter with a batch size of one we remove
             # the additional dimension here again
             output = [output.numpy().squeeze(axis=0) for output in outputs]
@@ -158,6 +211,12 @@ class KerasInterpreter(Interpreter):
             input_dict[k] = np.expand_dims(v, axis=0)
         return self.invoke(input_dict)
 
+    def predict_batch(self, input_dict):
+        outputs = self.model(input_dict, training=False)
+        if type(outputs) is list:
+            return [output.numpy() for output in outputs]
+        return outputs.numpy()
+
     def load(self, model_path: str) -> None:
         logger.info(f'Loading model {model_path}')
         self.model = keras.models.load_model(model_path, compile=False)
@@ -172,15 +231,31 @@ class KerasInterpreter(Interpreter):
 
 
 class FastAIInterpreter(Interpreter):
+    """
+    This class wraps around torch models. Camera images run through a
+    TorchScript version of the model with the normalisation fused in, fed
+    from a preallocated input tensor in inference mode.
+    """
 
-    def __init__(self):
+    def __init__(self, num_threads: Optional[int] = None):
+        """
+        :param num_threads: number of torch intra-op threads, None leaves the
+                            choice to torch
+        """
         super().__init__()
         self.model: None
-        from fastai import learner as fastai_learner
-        from fastai import optimizer as fastai_optimizer
+        self.input_shape = None
+        # traced model with fused normalisation, taking uint8 images
+        self.fused = None
+        self.img_tensor = None
+        self.device = None
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
 
     def set_model(self, pilot: 'FastAiPilot') -> None:
         self.model = pilot.create_model()
+        self.input_shape = pilot.input_shape
 
     def set_optimizer(self, optimizer: 'fastai_optimizer') -> None:
         self.model.optimizer = optimizer
@@ -192,17 +267,54 @@ class FastAIInterpreter(Interpreter):
     def compile(self, **kwargs):
         pass
 
-    def invoke(self, inputs):
-        outputs = self.model(inputs)
-        # for functional models the output here is a list
-        if type(outputs) is list:
+    @staticmethod
+    def to_numpy(outputs) -> Union[np.ndarray, List[np.ndarray]]:
+        # for functional models the output here is a list, or a tuple for
+        # traced models
+        if isinstance(outputs, (list, tuple)):
             # as we invoke the interpreter with a batch size of one we remove
             # the additional dimension here again
-            output = [output.numpy().squeeze(axis=0) for output in outputs]
-            return output
+            return [output.detach().cpu().numpy().squeeze(axis=0)
+                    for output in outputs]
         # for sequential models the output shape is (1, n) with n = output dim
-        else:
-            return outputs.detach().numpy().squeeze(axis=0)
+        return outputs.detach().cpu().numpy().squeeze(axis=0)
+
+    def invoke(self, inputs):
+        import torch
+        with torch.inference_mode():
+            outputs = self.model(inputs)
+        return self.to_numpy(outputs)
+
+    def fuse(self) -> None:
+        """ Traces the model with the fused normalisation and allocates the
+            input tensor, pinned if the model runs on the gpu. """
+        import torch
+        from donkeycar.parts.pytorch.inference import model_device, \
+            trace_normalized
+        if self.fused is None:
+            self.fused = trace_normalized(self.model, self.input_shape)
+        self.device = model_device(self.model)
+        self.img_tensor = torch.empty((1, *self.input_shape),
+                                      dtype=torch.uint8)
+        if self.device.type == 'cuda':
+            self.img_tensor = self.img_tensor.pin_memory()
+
+    def predict_image(self, img_arr: np.ndarray) \
+            -> Sequence[Union[float, np.ndarray]]:
+        """
+        Inference on the camera image through the fused model.
+
+        :param img_arr: uint8 (H, W, C) camera image
+        :return:        model outputs
+        """
+        import torch
+        if self.img_tensor is None:
+            self.fuse()
+        self.img_tensor[0].copy_(torch.from_numpy(img_arr))
+        with torch.inference_mode():
+            outputs = self.fused(
+                self.img_tensor.to(self.device, non_blocking=True))
+        return self.to_numpy(outputs)
 
     def predict(self, img_arr: np.ndarray, other_arr: np.ndarray) \
             -> Sequence[Union[float, np.ndarray]]:
@@ -213,15 +325,36 @@ class FastAIInterpreter(Interpreter):
             inputs = [img_arr, other_arr]
         return self.invoke(inputs)
 
+    def predict_batch(self, input_dict):
+        import torch
+        if self.img_tensor is None:
+            self.fuse()
+        # uint8 camera images in (N, H, W, C) layout
+        inputs = torch.as_tensor(input_dict['img_in']).to(self.device)
+        with torch.inference_mode():
+            outputs = self.fused(inputs)
+        # models with several heads return a list or tuple of outputs
+        if isinstance(outputs, (list, tuple)):
+            return [output.cpu().numpy() for output in outputs]
+        return outputs.cpu().numpy()
+
     def load(self, model_path: str) -> None:
         import torch
         logger.info(f'Loading model {model_path}')
         if torch.cuda.is_available():
             logger.info("using cuda for torch inference")
-            self.model = torch.load(model_path)
+            map_location = None
         else:
             logger.info("cuda not available for torch inference")
-            self.model = torch.load(model_path, map_location=torch.device('cpu'))
+            map_location = torch.device('cpu')
+        self.img_tensor = None
+        if os.path.splitext(model_path)[1] == '.pt':
+            # TorchScript export with fused normalisation
+            self.fused = torch.jit.load(model_path, map_location=map_location)
+            self.model = self.fused.model
+        else:
+            self.fused = None
+            self.model = torch.load(model_path, map_location=map_location)
 
         logger.info(self.model)
         self.model.eval()
@@ -232,27 +365,58 @@ class FastAIInterpreter(Interpreter):
 
 class TfLite(Interpreter):
     """
-    This class wraps around the TensorFlow Lite interpreter.
+    This class wraps around the TensorFlow Lite interpreter. Integer
+    quantised models are supported, inputs get quantised and outputs
+    dequantised with the tensor's scale and zero point.
     """
 
-    def __init__(self):
+    def __init__(self, num_threads: Optional[int] = None):
+        """
+        :param num_threads: number of threads of the tflite interpreter, None
+                            leaves the choice to tflite
+        """
         super().__init__()
+        self.num_threads = num_threads
         self.interpreter = None
         self.input_shapes = None
         self.input_details = None
         self.output_details = None
-    
+        self.input_names = None
+        self.img_tensor = None
+        self.img_buffer = None
+        self.batch_size = 1
+
+    def create_interpreter(self, model_path: str) -> tf.lite.Interpreter:
+        return tf.lite.Interpreter(model_path=model_path,
+                                   num_threads=self.num_threads)
+
     def load(self, model_path):
         assert os.path.splitext(model_path)[1] == '.tflite', \
             'TFlitePilot should load only .tflite files'
         logger.info(f'Loading model {model_path}')
         # Load TFLite model and allocate tensors.
-        self.interpreter = tf.lite.Interpreter(model_path=model_path)
+        self.interpreter = self.create_interpreter(model_path)
         self.interpreter.allocate_tensors()
-
-        # Get input and output tensors.
-        self.input_details = self.interpreter.get_input_details()
-        self.output_details = self.interpreter.get_output_details()
+        self.batch_size = 1
+
+        # Get input and output tensors. The converter does not keep the
+        # order of the keras model, so the image input goes first and the
+        # outputs are sorted by their output index. That is the position
+        # of the output name in the alphabetical order, which the names of
+        # the output layers of all pilots follow.
+        self.input_details = sorted(
+            self.interpreter.get_input_details(),
+            key=lambda d: self.tensor_name(d) != 'img_in')
+        self.input_names = [self.tensor_name(d) for d in self.input_details]
+        self.output_details = sorted(self.interpreter.get_output_details(),
+                                     key=self.output_index)
+        # Accessor of the image input memory. Only the accessor may be kept,
+        # numpy views into the tensor must be gone before invoke(). Quantised
+        # inputs get the float image through a preallocated buffer.
+        img_detail = self.input_details[0]
+        self.img_tensor = self.interpreter.tensor(img_detail['index'])
+        self.img_buffer = None if img_detail['dtype'] == np.float32 \
+            else np.empty(img_detail['shape'][1:], dtype=np.float32)
 
         # Get Input shape
         self.input_shapes = []
@@ -261,17 +425,77 @@ class TfLite(Interpreter):
             logger.debug(detail)
             self.input_shapes.append(detail['shape'])
 
+    @staticmethod
+    def tensor_name(detail: Dict[str, Any]) -> str:
+        """ Returns the keras layer name of an input tensor, the converter
+            names them like 'serving_default_img_in:0'. """
+        name = detail['name'].split(':')[0]
+        prefix = 'serving_default_'
+        return name[len(prefix):] if name.startswith(prefix) else name
+
+    @staticmethod
+    def output_index(detail: Dict[str, Any]) -> int:
+        """ Returns the position of the output in the keras model, the
+            converter names them like 'StatefulPartitionedCall:1'. """
+        _, _, index = detail['name'].rpartition(':')
+        return int(index) if index.isdigit() else 0
+
+    @staticmethod
+    def quantize(arr: np.ndarray, detail: Dict[str, Any]) -> np.ndarray:
+        """ Converts the float input into the tensor's type """
+        dtype = detail['dtype']
+        if dtype == np.float32:
+            return arr.astype(np.float32)
+        scale, zero_point = detail['quantization']
+        info = np.iinfo(dtype)
+        return np.clip(np.round(arr / scale + zero_point),
+                       info.min, info.max).astype(dtype)
+
+    def quantize_img(self, img_arr: np.ndarray, detail: Dict[str, Any],
+                     out: np.ndarray) -> None:
+        """ Quantises the float image into the input tensor view, in place
+            in the preallocated buffer """
+        scale, zero_point = detail['quantization']
+        info = np.iinfo(out.dtype)
+        buffer = self.img_buffer
+        np.divide(img_arr, scale, out=buffer)
+        np.add(buffer, zero_point, out=buffer)
+        np.rint(buffer, out=buffer)
+        np.clip(buffer, info.min, info.max, out=buffer)
+        out[...] = buffer
+
+    @staticmethod
+    def dequantize(arr: np.ndarray, detail: Dict[str, Any]) -> np.ndarray:
+        """ Converts the tensor's output into float """
+        if detail['dtype'] == np.float32:
+            return arr
+        scale, zero_point = detail['quantization']
+        return (arr.astype(np.float32) - zero_point) * scale
+
     def compile(self, **kwargs):
         pass
 
+    def resize(self, batch_size: int) -> None:
+        """ Resizes the inputs to the batch size, if it has changed """
+        if batch_size == self.batch_size:
+            return
+        for detail in self.input_details:
+            self.interpreter.resize_tensor_input(
+                detail['index'], [batch_size] + list(detail['shape'][1:]))
+        self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+
     def invoke(self) -> Sequence[Union[float, np.ndarray]]:
         self.interpreter.invoke()
         outputs = []
         for tensor in self.output_details:
+            # the outputs are copied, the interpreter refuses to invoke while
+            # a numpy view into its tensors is alive, so views can't be
+            # handed to the caller, the copies are only a few floats
             output_data = self.interpreter.get_tensor(tensor['index'])
             # as we invoke the interpreter with a batch size of one we remove
             # the additional dimension here again
-            outputs.append(output_data[0])
+            outputs.append(self.dequantize(output_data[0], tensor))
         # don't return list if output is 1d
         return outputs if len(outputs) > 1 else outputs[0]
 
@@ -279,33 +503,121 @@ class TfLite(Interpreter):
             -> Sequence[Union[float, np.ndarray]]:
         assert self.input_shapes and self.input_details, \
             "Tflite model not loaded"
+        self.resize(1)
         input_arrays = (img_arr, other_arr)
         for arr, shape, detail \
                 in zip(input_arrays, self.input_shapes, self.input_details):
-            in_data = arr.reshape(shape).astype(np.float32)
+            in_data = self.quantize(np.asarray(arr).reshape(shape), detail)
+            self.interpreter.set_tensor(detail['index'], in_data)
+        return self.invoke()
+
+    def predict_into(self, write_img, other_arr) \
+            -> Sequence[Union[float, np.ndarray]]:
+        assert self.input_shapes and self.input_details, \
+            "Tflite model not loaded"
+        self.resize(1)
+        # the image is written into the input tensor, removing the batch
+        # dimension, the temporary view is released right away
+        img_detail = self.input_details[0]
+        if self.img_buffer is None:
+            write_img(self.img_tensor()[0])
+        else:
+            self.quantize_img(write_img(self.img_buffer), img_detail,
+                              self.img_tensor()[0])
+        if other_arr is not None and len(self.input_details) > 1:
+            detail = self.input_details[1]
+            in_data = self.quantize(
+                np.asarray(other_arr).reshape(detail['shape']), detail)
             self.interpreter.set_tensor(detail['index'], in_data)
         return self.invoke()
 
     def predict_from_dict(self, input_dict):
-        for detail in self.input_details:
-            k = detail['name']
-            inp_k = input_dict[k]
-            inp_k_res = inp_k.reshape(detail['shape']).astype(np.float32)
+        self.resize(1)
+        for k, detail in zip(self.input_names, self.input_details):
+            inp_k = np.asarray(input_dict[k])
+            inp_k_res = self.quantize(inp_k.reshape(detail['shape']), detail)
             self.interpreter.set_tensor(detail['index'], inp_k_res)
         return self.invoke()
 
+    def predict_batch(self, input_dict):
+        assert self.input_details, "Tflite model not loaded"
+        num = len(input_dict[self.input_names[0]])
+        self.resize(num)
+        for k, detail in zip(self.input_names, self.input_details):
+            shape = (num, ) + tuple(detail['shape'][1:])
+            inp_k = np.asarray(input_dict[k]).reshape(shape)
+            self.interpreter.set_tensor(detail['index'],
+                                        self.quantize(inp_k, detail))
+        self.interpreter.invoke()
+        outputs = [self.dequantize(self.interpreter.get_tensor(d['index']), d)
+                   for d in self.output_details]
+        return outputs if len(outputs) > 1 else outputs[0]
+
     def get_input_shapes(self):
         assert self.input_shapes is not None, "Need to load model first"
         return self.input_shapes
 
 
+class Coral(TfLite):
+    """
+    TfLite interpreter running the model on a Coral Edge TPU through the
+    edgetpu delegate. Any KerasPilot runs on it with a model compiled by the
+    edgetpu compiler from an int8 tflite model. Without the delegate, i.e.
+    if the Edge TPU runtime or device are missing, it falls back to the cpu,
+    which runs models not compiled for the Edge TPU, so the pilots can be
+    tested without the device.
+    """
+    # names of the Edge TPU runtime library
+    EDGETPU_LIB = {'Linux': 'libedgetpu.so.1',
+                   'Darwin': 'libedgetpu.1.dylib',
+                   'Windows': 'edgetpu.dll'}
+
+    def __init__(self, num_threads: Optional[int] = None,
+                 device: Optional[str] = None, fallback: bool = True):
+        """
+        :param num_threads: number of threads of the cpu fallback
+        :param device:      Edge TPU device like 'usb' or 'pci:0', None uses
+                            the first one found
+        :param fallback:    run on the cpu if the delegate can't be loaded,
+                            otherwise raise the error
+        """
+        super().__init__(num_threads=num_threads)
+        self.device = device
+        self.fallback = fallback
+        self.on_edge_tpu = False
+
+    def create_interpreter(self, model_path: str) -> tf.lite.Interpreter:
+        import platform
+        options = {'device': self.device} if self.device else {}
+        try:
+            delegates = [tf.lite.experimental.load_delegate(
+                self.EDGETPU_LIB[platform.system()], options)]
+        except (ValueError, OSError, KeyError) as e:
+            if not self.fallback:
+                raise
+            logger.warning(f'Edge TPU delegate not available, running '
+                           f'{model_path} on the cpu: {e}')
+            delegates = []
+        self.on_edge_tpu = bool(delegates)
+        return tf.lite.Interpreter(model_path=model_path,
+                                   num_threads=self.num_threads,
+                                   experimental_delegates=delegates)
+
+
 class TensorRT(Interpreter):
     """
-    Uses TensorRT to do the inference.
+    Uses TensorRT to do the inference. The frozen graph is built once at load
+    time and run in a persistent session, which is fed with numpy arrays and
+    returns numpy arrays, so no tensors, variables or graph state are created
+    per frame.
     """
     def __init__(self):
-        self.frozen_func = None
+        self.session = None
         self.input_shapes = None
+        self.input_names = None
+        self.input_tensors = None
+        self.output_tensors = None
+        self.img_buffer = None
 
     def get_input_shapes(self) -> List[tf.TensorShape]:
         return self.input_shapes
@@ -318,43 +630,59 @@ class TensorRT(Interpreter):
                                                  tags=[tag_constants.SERVING])
         graph_func = saved_model_loaded.signatures[
             signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY]
-        self.frozen_func = convert_var_to_const(graph_func)
+        frozen_func = convert_var_to_const(graph_func)
         self.input_shapes = [inp.shape for inp in graph_func.inputs]
+        self.input_tensors = [inp.name for inp in frozen_func.inputs]
+        self.input_names = [name.split(':')[0] for name in self.input_tensors]
+        self.output_tensors = [out.name for out in frozen_func.outputs]
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.compat.v1.import_graph_def(frozen_func.graph.as_graph_def(),
+                                          name='')
+        self.session = tf.compat.v1.Session(graph=graph)
+        # batch of one image, the pilot writes the normalised frame into it
+        img_shape = self.input_shapes[0]
+        self.img_buffer = np.empty([1] + img_shape.as_list()[1:],
+                                   dtype=np.float32) \
+            if img_shape.rank and img_shape[1:].is_fully_defined() else None
+
+    def run_session(self, arrays: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """ Runs the graph on the input arrays, in the order of the inputs """
+        assert self.session, 'Model not loaded'
+        return self.session.run(self.output_tensors,
+                                feed_dict=dict(zip(self.input_tensors, arrays)))
+
+    def call(self, arrays: Sequence[np.ndarray]) \
+            -> Sequence[Union[float, np.ndarray]]:
+        """ Runs a batch of one and removes the batch dimension again """
+        # because we send a batch of size one, pick first element
+        outputs = [out.squeeze(axis=0) for out in self.run_session(arrays)]
+        # don't return list if output is 1d
+        return outputs if len(outputs) > 1 else outputs[0]
 
     def predict(self, img_arr: np.ndarray, other_arr: np.ndarray) \
             -> Sequence[Union[float, np.ndarray]]:
         # first reshape as usual
-        img_arr = np.expand_dims(img_arr, axis=0).astype(np.float32)
-        img_tensor = self.convert(img_arr)
+        arrays = [np.expand_dims(img_arr, axis=0)]
         if other_arr is not None:
-            other_arr = np.expand_dims(other_arr, axis=0).astype(np.float32)
-            other_tensor = self.convert(other_arr)
-            output_tensors = self.frozen_func(img_tensor, other_tensor)
-        else:
-            output_tensors = self.frozen_func(img_tensor)
+            arrays.append(np.expand_dims(other_arr, axis=0))
+        return self.call(arrays)
 
-        # because we send a batch of size one, pick first element
-        outputs = [out.numpy().squeeze(axis=0) for out in output_tensors]
-        # don't return list if output is 1d
-        return outputs if len(outputs) > 1 else outputs[0]
+    def predict_into(self, write_img, other_arr) \
+            -> Sequence[Union[float, np.ndarray]]:
+        if self.img_buffer is None:
+            return super().predict_into(write_img, other_arr)
+        write_img(self.img_buffer[0])
+        arrays = [self.img_buffer]
+        if other_arr is not None:
+            arrays.append(np.expand_dims(other_arr, axis=0))
+        return self.call(arrays)
 
     def predict_from_dict(self, input_dict):
-        args = []
-        for inp in self.frozen_func.inputs:
-            name = inp.name.split(':')[0]
-            val = input_dict[name]
-            val_res = np.expand_dims(val, axis=0).astype(np.float32)
-            val_conv = self.convert(val_res)
-            args.append(val_conv)
-        output_tensors = self.frozen_func(*args)
-        # because we send a batch of size one, pick first element
-        outputs = [out.numpy().squeeze(axis=0) for out in output_tensors]
-        # don't return list if output is 1d
-        return outputs if len(outputs) > 1 else outputs[0]
+        return self.call([np.expand_dims(input_dict[name], axis=0)
+                          for name in self.input_names])
 
-    @staticmethod
-    def convert(arr):
-        """ Helper function. """
-        value = tf.compat.v1.get_variable("features", dtype=tf.float32,
-                                          initializer=tf.constant(arr))
-        return tf.convert_to_tensor(value=value)
+    def predict_batch(self, input_dict):
+        outputs = self.run_session([input_dict[name]
+                                    for name in self.input_names])
+        return outputs if len(outputs) > 1 else outputs[0]
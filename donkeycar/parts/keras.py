@@ -8,19 +8,24 @@ include one or more models to help direct the vehicles motion.
 
 """
 
+import os
+import time
 from abc import ABC, abstractmethod
-from collections import deque
 
 import numpy as np
-from typing import Dict, Tuple, Optional, Union, List, Sequence, Callable
+from typing import Any, Dict, Tuple, Optional, Union, List, Sequence, \
+    Callable
 from logging import getLogger
 
 from tensorflow.python.data.ops.dataset_ops import DatasetV1, DatasetV2
 
 import donkeycar as dk
-from donkeycar.utils import normalize_image, linear_bin
+from donkeycar.utils import linear_bin, linear_bin_batch, \
+    linear_unbin_batch, get_test_img
 from donkeycar.pipeline.types import TubRecord
-from donkeycar.parts.interpreter import Interpreter, KerasInterpreter
+from donkeycar.pipeline.augmentations import ImageTransformation
+from donkeycar.parts.interpreter import Interpreter, KerasInterpreter, \
+    split_batch
 
 import tensorflow as tf
 from tensorflow import keras
@@ -44,6 +49,58 @@ XY = Union[float, np.ndarray, Tuple[Union[float, np.ndarray], ...]]
 logger = getLogger(__name__)
 
 
+class FrameHistory(object):
+    """
+    Preallocated float32 ring buffer of the last entries, like frames, of a
+    sequence model. Every entry is stored twice, at position i and i + length,
+    so the last length entries, oldest first, are always the contiguous
+    slice starting after the newest entry. Hence adding an entry only writes
+    that entry and the sequence is handed to the model without a copy.
+    """
+    def __init__(self, length: int, shape: Tuple[int, ...],
+                 fill: Optional[Sequence[float]] = None) -> None:
+        """
+        :param length:  number of entries in the sequence
+        :param shape:   shape of a single entry
+        :param fill:    initial value of all entries, if not given the
+                        first added entry fills the whole history
+        """
+        self.length = length
+        self.buffer = np.zeros((2 * length, ) + tuple(shape), dtype=np.float32)
+        self.pos = length - 1
+        self.filled = fill is not None
+        if fill is not None:
+            self.buffer[:] = np.asarray(fill, dtype=np.float32)
+
+    def push(self, write: Callable[[np.ndarray], Any]) -> np.ndarray:
+        """
+        Adds an entry which is written by the given function into its slot.
+
+        :param write:   function writing the new entry into the array passed
+        :return:        the sequence view, oldest entry first
+        """
+        self.pos = (self.pos + 1) % self.length
+        slot = self.buffer[self.pos]
+        write(slot)
+        if self.filled:
+            self.buffer[self.pos + self.length] = slot
+        else:
+            self.buffer[:] = slot
+            self.filled = True
+        return self.sequence()
+
+    def append(self, entry: Union[np.ndarray, Sequence[float]]) -> np.ndarray:
+        """ Adds a copy of the entry, returns the sequence view """
+        def write(slot: np.ndarray) -> None:
+            slot[...] = entry
+        return self.push(write)
+
+    def sequence(self) -> np.ndarray:
+        """ :return: the last entries, oldest first, as a view """
+        start = self.pos + 1
+        return self.buffer[start:start + self.length]
+
+
 class KerasPilot(ABC):
     """
     Base class for Keras models that will provide steering and throttle to
@@ -57,6 +114,8 @@ class KerasPilot(ABC):
         self.optimizer = "adam"
         self.interpreter = interpreter
         self.interpreter.set_model(self)
+        self.transformation: Optional[ImageTransformation] = None
+        self.img_buffer: Optional[np.ndarray] = None
         logger.info(f'Created {self} with interpreter: {interpreter}')
 
     def load(self, model_path: str) -> None:
@@ -94,6 +153,114 @@ class KerasPilot(ABC):
     def seq_size(self) -> int:
         return 0
 
+    def set_image_transformation(
+            self, transformation: Optional[ImageTransformation]) -> None:
+        """
+        Sets the inference time transformation (crop, trapezoidal mask)
+        which is fused with the normalisation of the input image.
+
+        :param transformation:  the transformation or None to remove it
+        """
+        self.transformation = transformation
+
+    def normalize(self, img_arr: np.ndarray,
+                  out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Converts the uint8 camera image into the float32 model input,
+        applying the image transformation if one is set.
+
+        :param img_arr: uint8 [0,255] numpy array with image data
+        :param out:     optional float32 buffer to write the result into
+        :return:        float32 [0,1] numpy array
+        """
+        if self.transformation is not None:
+            return self.transformation.run(img_arr, out=out)
+        if out is None:
+            return np.multiply(img_arr, np.float32(ONE_BYTE_SCALE),
+                               dtype=np.float32)
+        np.multiply(img_arr.reshape(out.shape), np.float32(ONE_BYTE_SCALE),
+                    out=out, casting='unsafe')
+        return out
+
+    def input_buffer(self) -> np.ndarray:
+        """ Returns the preallocated float32 buffer for the image input. """
+        if self.img_buffer is None:
+            self.img_buffer = np.empty(self.input_shape, dtype=np.float32)
+        return self.img_buffer
+
+    def test_inputs(self) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        :return:    normalised test image, or image sequence for sequence
+                    models, and zero valued other input, in the shapes of
+                    the model inputs
+        """
+        shapes = self.get_input_shapes()
+        img_arr = self.normalize(get_test_img(self))
+        if len(shapes[0]) == 5:
+            # image sequence input
+            seq_arr = np.empty(tuple(shapes[0][1:]), dtype=np.float32)
+            seq_arr[:] = img_arr
+            img_arr = seq_arr
+        other_arr = np.zeros(tuple(shapes[1][1:]), dtype=np.float32) \
+            if len(shapes) > 1 else None
+        return img_arr, other_arr
+
+    def test_inference(self) -> Tuple[Union[float, np.ndarray], ...]:
+        """ Runs the model on the test inputs, without touching the state of
+            sequence pilots.
+            :return:    the pilot outputs
+        """
+        return self.interpreter_to_output(
+            self.interpreter.predict(*self.test_inputs()))
+
+    def predict_normalized(self, img_arr: np.ndarray,
+                           other_arr: Optional[np.ndarray]) \
+            -> Sequence[Union[float, np.ndarray]]:
+        """
+        Runs the interpreter on an already normalised image through the same
+        path as run(), the image is copied into the interpreter's input
+        memory if it provides one.
+
+        :param img_arr:     float32 [0,1] normalised image
+        :param other_arr:   other input or None
+        :return:            raw interpreter outputs
+        """
+        def write_img(buffer: Optional[np.ndarray]) -> np.ndarray:
+            if buffer is None:
+                return img_arr
+            buffer[:] = img_arr
+            return buffer
+
+        return self.interpreter.predict_into(write_img, other_arr)
+
+    def warm_up(self, num_runs: int = 3) -> List[float]:
+        """
+        Runs inferences on the test inputs, so the one-off costs of the first
+        inference, like graph tracing and memory allocation, are paid at load
+        time and not on the first frames of the drive loop. The state of
+        sequence pilots is not touched.
+
+        :param num_runs:    number of inferences
+        :return:            duration of each inference in seconds
+        """
+        img_arr, other_arr = self.test_inputs()
+        if img_arr.ndim == 4:
+            def infer():
+                self.interpreter.predict(img_arr, other_arr)
+        else:
+            # same path as run()
+            def infer():
+                self.predict_normalized(img_arr, other_arr)
+
+        times = []
+        for _ in range(num_runs):
+            start = time.perf_counter()
+            infer()
+            times.append(time.perf_counter() - start)
+        logger.info(f'Warmed up {self}, first inference took '
+                    f'{1000 * times[0]:.1f}ms, last {1000 * times[-1]:.1f}ms')
+        return times
+
     def run(self, img_arr: np.ndarray, other_arr: List[float] = None) \
             -> Tuple[Union[float, np.ndarray], ...]:
         """
@@ -105,9 +272,14 @@ class KerasPilot(ABC):
                             state vector in the Behavioural model
         :return:            tuple of (angle, throttle)
         """
-        norm_arr = normalize_image(img_arr)
         np_other_array = np.array(other_arr) if other_arr else None
-        return self.inference(norm_arr, np_other_array)
+
+        def write_img(buffer: Optional[np.ndarray]) -> np.ndarray:
+            return self.normalize(
+                img_arr, out=self.input_buffer() if buffer is None else buffer)
+
+        out = self.interpreter.predict_into(write_img, np_other_array)
+        return self.interpreter_to_output(out)
 
     def inference(self, img_arr: np.ndarray, other_arr: Optional[np.ndarray]) \
             -> Tuple[Union[float, np.ndarray], ...]:
@@ -131,6 +303,31 @@ class KerasPilot(ABC):
         output = self.interpreter.predict_from_dict(input_dict)
         return self.interpreter_to_output(output)
 
+    def inference_batch(self, input_dict: Dict[str, np.ndarray]) \
+            -> List[Tuple[Union[float, np.ndarray], ...]]:
+        """ Inferencing of many frames in one interpreter call
+            :param input_dict:  input dictionary of str and np.ndarray, with
+                                the inputs of all frames stacked along the
+                                first axis
+            :return:            list of the outputs of each frame, as
+                                returned by inference_from_dict
+        """
+        output = self.interpreter.predict_batch(input_dict)
+        return self.interpreter_to_output_batch(output)
+
+    def interpreter_to_output_batch(
+            self,
+            interpreter_out: Union[np.ndarray, Sequence[np.ndarray]]) \
+            -> List[Tuple[Union[float, np.ndarray], ...]]:
+        """ Converts the batched interpreter outputs into the outputs of
+            each frame. Child classes can override this with a vectorised
+            version.
+            :param interpreter_out: outputs of predict_batch
+            :return:                list of the outputs of each frame
+        """
+        return [self.interpreter_to_output(out)
+                for out in split_batch(interpreter_out)]
+
     @abstractmethod
     def interpreter_to_output(
             self,
@@ -153,35 +350,79 @@ class KerasPilot(ABC):
               verbose: int = 1,
               min_delta: float = .0005,
               patience: int = 5,
-              show_plot: bool = False) -> tf.keras.callbacks.History:
+              show_plot: bool = False,
+              callbacks: Optional[List[tf.keras.callbacks.Callback]] = None,
+              mixed_precision: Optional[str] = None,
+              jit_compile: bool = False,
+              steps_per_execution: int = 1) -> tf.keras.callbacks.History:
         """
-        trains the model
+        trains the model, additional keras callbacks can be passed in
+
+        :param mixed_precision:     optional keras dtype policy like
+                                    'mixed_float16' for GPUs or
+                                    'mixed_bfloat16' for CPUs with bfloat16
+                                    support. A copy of the model computing in
+                                    that precision gets trained, the saved
+                                    model stays float32.
+        :param jit_compile:         compile the train step with XLA
+        :param steps_per_execution: number of batches run in each call of
+                                    the compiled train function
         """
         assert isinstance(self.interpreter, KerasInterpreter)
-        model = self.interpreter.model
-        self.compile()
-
-        callbacks = [
-            EarlyStopping(monitor='val_loss',
-                          patience=patience,
-                          min_delta=min_delta),
-            ModelCheckpoint(monitor='val_loss',
-                            filepath=model_path,
-                            save_best_only=True,
-                            verbose=verbose)]
-
-        history: tf.keras.callbacks.History = model.fit(
-            x=train_data,
-            steps_per_epoch=train_steps,
-            batch_size=batch_size,
-            callbacks=callbacks,
-            validation_data=validation_data,
-            validation_steps=validation_steps,
-            epochs=epochs,
-            verbose=verbose,
-            workers=1,
-            use_multiprocessing=False)
-            
+        float_model = self.interpreter.model
+        compile_options = {}
+        if jit_compile:
+            compile_options['jit_compile'] = True
+        if steps_per_execution > 1:
+            compile_options['steps_per_execution'] = steps_per_execution
+        self.interpreter.compile_options = compile_options
+        checkpoint_path = model_path
+        if mixed_precision:
+            model = clone_with_policy(float_model, mixed_precision)
+            self.interpreter.model = model
+            # the checkpoint only holds the weights which are later loaded
+            # into the float32 model
+            base, ext = os.path.splitext(model_path)
+            checkpoint_path = f'{base}.{mixed_precision}{ext or ".h5"}'
+        else:
+            model = float_model
+
+        try:
+            self.compile()
+
+            callbacks = [
+                EarlyStopping(monitor='val_loss',
+                              patience=patience,
+                              min_delta=min_delta),
+                ModelCheckpoint(monitor='val_loss',
+                                filepath=checkpoint_path,
+                                save_best_only=True,
+                                save_weights_only=bool(mixed_precision),
+                                verbose=verbose)] + (callbacks or [])
+
+            history: tf.keras.callbacks.History = model.fit(
+                x=train_data,
+                steps_per_epoch=train_steps,
+                batch_size=batch_size,
+                callbacks=callbacks,
+                validation_data=validation_data,
+                validation_steps=validation_steps,
+                epochs=epochs,
+                verbose=verbose,
+                workers=1,
+                use_multiprocessing=False)
+        finally:
+            self.interpreter.model = float_model
+            self.interpreter.compile_options = {}
+
+        if mixed_precision:
+            if os.path.exists(checkpoint_path):
+                float_model.load_weights(checkpoint_path)
+                os.remove(checkpoint_path)
+            else:
+                float_model.set_weights(model.get_weights())
+            float_model.save(model_path)
+
         if show_plot:
             try:
                 import matplotlib.pyplot as plt
@@ -239,6 +480,15 @@ class KerasPilot(ABC):
         raise NotImplementedError(f'{self} not ready yet for new training '
                                   f'pipeline')
 
+    def y_transform_batch(
+            self, records: Sequence[Union[TubRecord, List[TubRecord]]]) \
+            -> Dict[str, np.ndarray]:
+        """ Transforms many records into the dictionary for y, with the
+        values of all records stacked along the first axis. Child classes
+        can override this with a vectorised version. """
+        ys = [self.y_transform(record) for record in records]
+        return {k: np.stack([np.asarray(y[k]) for y in ys]) for k in ys[0]}
+
     def output_types(self) -> Tuple[Dict[str, np.typename], ...]:
         """ Used in tf.data, assume all types are doubles"""
         shapes = self.output_shapes()
@@ -302,6 +552,25 @@ class KerasCategorical(KerasPilot):
         throttle = linear_bin(throttle, N=20, offset=0.0, R=self.throttle_range)
         return {'angle_out': angle, 'throttle_out': throttle}
 
+    def interpreter_to_output_batch(self, interpreter_out) \
+            -> List[Tuple[float, float]]:
+        angle_binned, throttle_binned = interpreter_out
+        N = throttle_binned.shape[-1]
+        throttles = linear_unbin_batch(throttle_binned, N=N, offset=0.0,
+                                       R=self.throttle_range)
+        angles = linear_unbin_batch(angle_binned)
+        return list(zip(angles.tolist(), throttles.tolist()))
+
+    def y_transform_batch(self, records: Sequence[TubRecord]) \
+            -> Dict[str, np.ndarray]:
+        assert all(isinstance(r, TubRecord) for r in records), \
+            "TubRecords expected"
+        angles = [r.underlying['user/angle'] for r in records]
+        throttles = [r.underlying['user/throttle'] for r in records]
+        return {'angle_out': linear_bin_batch(angles, N=15, offset=1, R=2.0),
+                'throttle_out': linear_bin_batch(throttles, N=20, offset=0.0,
+                                                 R=self.throttle_range)}
+
     def output_shapes(self):
         # need to cut off None from [None, 120, 160, 3] tensor shape
         img_shape = self.get_input_shapes()[0][1:]
@@ -385,7 +654,8 @@ class KerasMemory(KerasLinear):
                  mem_start_speed: float = 0.0):
         self.mem_length = mem_length
         self.mem_start_speed = mem_start_speed
-        self.mem_seq = deque([[0, mem_start_speed]] * mem_length)
+        self.mem_seq = FrameHistory(mem_length, (2, ),
+                                    fill=[0, mem_start_speed])
         self.mem_depth = mem_depth
         super().__init__(interpreter, input_shape)
 
@@ -399,18 +669,17 @@ class KerasMemory(KerasLinear):
     def load(self, model_path: str) -> None:
         super().load(model_path)
         self.mem_length = self.interpreter.get_input_shapes()[1][1] // 2
-        self.mem_seq = deque([[0, self.mem_start_speed]] * self.mem_length)
+        self.mem_seq = FrameHistory(self.mem_length, (2, ),
+                                    fill=[0, self.mem_start_speed])
         logger.info(f'Loaded memory model with mem length {self.mem_length}')
 
     def run(self, img_arr: np.ndarray, other_arr: List[float] = None) -> \
             Tuple[Union[float, np.ndarray], ...]:
-        # Only called at start to fill the previous values
-
-        np_mem_arr = np.array(self.mem_seq).reshape((2 * self.mem_length,))
-        img_arr_norm = normalize_image(img_arr)
+        # the flattened history is a view into the ring buffer
+        np_mem_arr = self.mem_seq.sequence().reshape((2 * self.mem_length,))
+        img_arr_norm = self.normalize(img_arr, out=self.input_buffer())
         angle, throttle = super().inference(img_arr_norm, np_mem_arr)
-        # fill new values into back of history list for next call
-        self.mem_seq.popleft()
+        # fill new values into back of history for next call
         self.mem_seq.append([angle, throttle])
         return angle, throttle
 
@@ -626,6 +895,97 @@ class KerasLocalizer(KerasPilot):
         return shapes
 
 
+class KerasMultiHead(KerasPilot):
+    """
+    A Keras part with one convolutional backbone shared by several heads,
+    so the image runs through the CNN only once per frame. The drive head
+    outputs steering and throttle, the optional behavior and location heads
+    classify the behavior state and the track location. The heads are
+    trained jointly from the tub labels.
+    """
+    def __init__(self,
+                 interpreter: Interpreter = KerasInterpreter(),
+                 input_shape: Tuple[int, ...] = (120, 160, 3),
+                 num_locations: int = 8,
+                 num_behaviors: int = 2):
+        """
+        :param num_locations:   number of location classes, 0 for no
+                                location head
+        :param num_behaviors:   number of behavior states, 0 for no behavior
+                                head
+        """
+        self.num_locations = num_locations
+        self.num_behaviors = num_behaviors
+        super().__init__(interpreter, input_shape)
+
+    def create_model(self):
+        return default_multi_head(num_locations=self.num_locations,
+                                  num_behaviors=self.num_behaviors,
+                                  input_shape=self.input_shape)
+
+    def compile(self):
+        loss = {'angle': 'mse', 'throttle': 'mse'}
+        if self.num_behaviors:
+            loss['zbehavior'] = 'categorical_crossentropy'
+        if self.num_locations:
+            loss['zloc'] = 'categorical_crossentropy'
+        self.interpreter.compile(optimizer=self.optimizer, loss=loss)
+
+    def output_channels(self) -> List[str]:
+        """ :return: vehicle memory keys of the outputs of the heads """
+        channels = ['pilot/angle', 'pilot/throttle']
+        if self.num_behaviors:
+            channels.append('pilot/behavior')
+        if self.num_locations:
+            channels.append('pilot/loc')
+        return channels
+
+    def interpreter_to_output(self, interpreter_out) \
+            -> Tuple[Union[float, np.ndarray], ...]:
+        angle, throttle, *classes = interpreter_out
+        return (angle[0], throttle[0]) + tuple(np.argmax(c) for c in classes)
+
+    def y_transform(self, record: Union[TubRecord, List[TubRecord]]) \
+            -> Dict[str, Union[float, List[float]]]:
+        assert isinstance(record, TubRecord), "TubRecord expected"
+        angle: float = record.underlying['user/angle']
+        throttle: float = record.underlying['user/throttle']
+        y = {'angle': angle, 'throttle': throttle}
+        if self.num_behaviors:
+            y['zbehavior'] = np.array(self.head_label(
+                record, 'behavior/one_hot_state_array', 'MULTI_HEAD_BEHAVIOR'))
+        if self.num_locations:
+            loc_one_hot = np.zeros(self.num_locations)
+            loc_one_hot[self.head_label(
+                record, 'localizer/location', 'MULTI_HEAD_LOCATION')] = 1
+            y['zloc'] = loc_one_hot
+        return y
+
+    @staticmethod
+    def head_label(record: TubRecord, key: str, cfg_key: str) -> Any:
+        """ Returns the label of an optional head, with an error naming
+            the missing key if the tub wasn't recorded with it """
+        try:
+            return record.underlying[key]
+        except KeyError:
+            raise ValueError(f"Record {record.underlying.get('_index')} of "
+                             f"{record.base_path} has no '{key}' label, "
+                             f"record the tub with it or set {cfg_key} = "
+                             f"False") from None
+
+    def output_shapes(self):
+        # need to cut off None from [None, 120, 160, 3] tensor shape
+        img_shape = self.get_input_shapes()[0][1:]
+        # the keys need to match the models input/output layers
+        y_shapes = {'angle': tf.TensorShape([]),
+                    'throttle': tf.TensorShape([])}
+        if self.num_behaviors:
+            y_shapes['zbehavior'] = tf.TensorShape([self.num_behaviors])
+        if self.num_locations:
+            y_shapes['zloc'] = tf.TensorShape([self.num_locations])
+        return {'img_in': tf.TensorShape(img_shape)}, y_shapes
+
+
 class KerasLSTM(KerasPilot):
     def __init__(self,
                  interpreter: Interpreter = KerasInterpreter(),
@@ -635,7 +995,7 @@ class KerasLSTM(KerasPilot):
         self.num_outputs = num_outputs
         self.seq_length = seq_length
         super().__init__(interpreter, input_shape)
-        self.img_seq = deque()
+        self.img_seq = FrameHistory(seq_length, input_shape)
         self.optimizer = "rmsprop"
 
     def seq_size(self) -> int:
@@ -675,15 +1035,11 @@ class KerasLSTM(KerasPilot):
         if img_arr.shape[2] == 3 and self.input_shape[2] == 1:
             img_arr = dk.utils.rgb2gray(img_arr)
 
-        while len(self.img_seq) < self.seq_length:
-            self.img_seq.append(img_arr)
-
-        self.img_seq.popleft()
-        self.img_seq.append(img_arr)
-        new_shape = (self.seq_length, *self.input_shape)
-        img_arr = np.array(self.img_seq).reshape(new_shape)
-        img_arr_norm = normalize_image(img_arr)
-        return self.inference(img_arr_norm, other_arr)
+        # only the newest frame gets normalised into its slot of the ring
+        # buffer, the sequence is a view of the buffer
+        img_seq_norm = self.img_seq.push(
+            lambda slot: self.normalize(img_arr, out=slot))
+        return self.inference(img_seq_norm, other_arr)
 
     def interpreter_to_output(self, interpreter_out) \
             -> Tuple[Union[float, np.ndarray], ...]:
@@ -713,7 +1069,7 @@ class Keras3D_CNN(KerasPilot):
         self.num_outputs = num_outputs
         self.seq_length = seq_length
         super().__init__(interpreter, input_shape)
-        self.img_seq = deque()
+        self.img_seq = FrameHistory(seq_length, input_shape)
 
     def seq_size(self) -> int:
         return self.seq_length
@@ -751,15 +1107,11 @@ class Keras3D_CNN(KerasPilot):
         if img_arr.shape[2] == 3 and self.input_shape[2] == 1:
             img_arr = dk.utils.rgb2gray(img_arr)
 
-        while len(self.img_seq) < self.seq_length:
-            self.img_seq.append(img_arr)
-
-        self.img_seq.popleft()
-        self.img_seq.append(img_arr)
-        new_shape = (self.seq_length, *self.input_shape)
-        img_arr = np.array(self.img_seq).reshape(new_shape)
-        img_arr_norm = normalize_image(img_arr)
-        return self.inference(img_arr_norm, other_arr)
+        # only the newest frame gets normalised into its slot of the ring
+        # buffer, the sequence is a view of the buffer
+        img_seq_norm = self.img_seq.push(
+            lambda slot: self.normalize(img_arr, out=slot))
+        return self.inference(img_seq_norm, other_arr)
 
     def interpreter_to_output(self, interpreter_out) \
             -> Tuple[Union[float, np.ndarray], ...]:
@@ -800,6 +1152,39 @@ class KerasLatent(KerasPilot):
         return steering[0][0], throttle[0][0]
 
 
+def clone_with_policy(model: Model, policy: str) -> Model:
+    """
+    Clones the model with the given keras dtype policy for mixed precision
+    training. The output layers, i.e. the heads like n_outputs0 and
+    n_outputs1 or angle_out and throttle_out, keep computing in float32 so
+    the losses and softmax activations stay numerically stable. The clone
+    starts with the weights of the model. As the variables of mixed
+    precision layers are float32, its weights can be loaded back into the
+    original model.
+
+    :param model:   the float32 model
+    :param policy:  dtype policy, like 'mixed_float16' or 'mixed_bfloat16'
+    :return:        the cloned model
+    """
+    output_names = set(model.output_names)
+
+    def clone_layer(layer):
+        config = layer.get_config()
+        config['dtype'] = 'float32' if layer.name in output_names else policy
+        return layer.__class__.from_config(config)
+
+    # the model's own policy decides if compile() wraps the optimizer for
+    # loss scaling, hence the global policy is set while cloning
+    global_policy = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy(policy)
+    try:
+        clone = tf.keras.models.clone_model(model, clone_function=clone_layer)
+    finally:
+        tf.keras.mixed_precision.set_global_policy(global_policy)
+    clone.set_weights(model.get_weights())
+    return clone
+
+
 def conv2d(filters, kernel, strides, layer_num, activation='relu'):
     """
     Helper function to create a standard valid-padded convolutional layer
@@ -1020,6 +1405,36 @@ def default_loc(num_locations, input_shape):
     return model
 
 
+def default_multi_head(num_locations, num_behaviors, input_shape):
+    drop = 0.2
+    img_in = Input(shape=input_shape, name='img_in')
+
+    # backbone shared by all heads
+    x = core_cnn_layers(img_in, drop)
+    x = Dense(100, activation='relu', name='dense_1')(x)
+    x = Dropout(drop)(x)
+
+    def head(name):
+        z = Dense(50, activation='relu', name=name + '_dense')(x)
+        return Dropout(drop)(z)
+
+    drive = head('drive')
+    angle_out = Dense(1, activation='linear', name='angle')(drive)
+    throttle_out = Dense(1, activation='linear', name='throttle')(drive)
+    outputs = [angle_out, throttle_out]
+    # TF Lite returns the outputs in the alphabetical order of the names of
+    # the layers, so the names need to be sorted in the order of the outputs
+    if num_behaviors:
+        outputs.append(Dense(num_behaviors, activation='softmax',
+                             name='zbehavior')(head('behavior')))
+    if num_locations:
+        outputs.append(Dense(num_locations, activation='softmax',
+                             name='zloc')(head('location')))
+
+    model = Model(inputs=[img_in], outputs=outputs, name='multi_head')
+    return model
+
+
 def rnn_lstm(seq_length=3, num_outputs=2, input_shape=(120, 160, 3)):
     # add sequence length dimensions as keras time-distributed expects shape
     # of (num_samples, seq_length, input_shape)
@@ -0,0 +1,97 @@
+"""
+Double buffered pilot which swaps in a new model without stalling the drive
+loop. The new model is loaded, warmed up and validated on a background
+thread while the current model keeps driving.
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class HotSwapPilot(object):
+    """
+    Part which runs the current pilot and replaces it with a newly loaded
+    one between two runs. request_load returns immediately; the new pilot is
+    created, loaded, warmed up and checked on the test inputs in a loader
+    thread. If any of that fails the current pilot keeps driving. Requests
+    arriving while a model is loading are collapsed into the latest one.
+    """
+    def __init__(self, pilot: Any, create_pilot: Callable[[], Any],
+                 warm_up_runs: int = 3) -> None:
+        """
+        :param pilot:           the pilot which drives initially
+        :param create_pilot:    creates a new, not yet loaded pilot
+        :param warm_up_runs:    number of warm-up inferences of a new pilot
+        """
+        self.pilot = pilot
+        self.create_pilot = create_pilot
+        self.warm_up_runs = warm_up_runs
+        self.lock = threading.Lock()
+        self.next_pilot = None
+        self.requested: Optional[str] = None
+        self.loader: Optional[threading.Thread] = None
+
+    def load(self, model_path: str) -> None:
+        """ Loads the model into the current pilot synchronously """
+        self.pilot.load(model_path)
+
+    def warm_up(self, num_runs: int = 3) -> List[float]:
+        if not hasattr(self.pilot, 'warm_up'):
+            return []
+        return self.pilot.warm_up(num_runs)
+
+    def request_load(self, model_path: str) -> None:
+        """ Starts loading the model in the background """
+        with self.lock:
+            self.requested = model_path
+            if self.loader is None:
+                self.loader = threading.Thread(target=self.load_requested,
+                                               daemon=True)
+                self.loader.start()
+
+    def load_requested(self) -> None:
+        while True:
+            with self.lock:
+                model_path, self.requested = self.requested, None
+                if model_path is None:
+                    self.loader = None
+                    return
+            start = time.time()
+            try:
+                pilot = self.create_pilot()
+                pilot.load(model_path)
+                self.validate(pilot)
+            except Exception as e:
+                logger.error(f'Failed loading {model_path}, keep driving '
+                             f'with the current model: {e}')
+                continue
+            with self.lock:
+                self.next_pilot = pilot
+            logger.info(f'Loaded {model_path} in the background in '
+                        f'{time.time() - start:.2f}s, swapping it in')
+
+    def validate(self, pilot: Any) -> None:
+        """ Warms up the pilot and checks it returns finite outputs on the
+            test inputs. Raises a ValueError otherwise. """
+        if hasattr(pilot, 'warm_up') and self.warm_up_runs:
+            pilot.warm_up(self.warm_up_runs)
+        if hasattr(pilot, 'test_inference'):
+            outputs = pilot.test_inference()
+            if not all(np.all(np.isfinite(np.asarray(out, dtype=np.float64)))
+                       for out in outputs):
+                raise ValueError(f'Non finite test outputs {outputs}')
+
+    def run(self, *inputs):
+        if self.next_pilot is not None:
+            with self.lock:
+                self.pilot, self.next_pilot = self.next_pilot, None
+        return self.pilot.run(*inputs)
+
+    def shutdown(self) -> None:
+        if hasattr(self.pilot, 'shutdown'):
+            self.pilot.shutdown()
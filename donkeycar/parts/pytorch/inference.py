@@ -0,0 +1,68 @@
+"""
+Lean torch inference: the image normalisation of the torchvision transform
+is fused into the model, which is traced into a TorchScript module taking
+the uint8 camera image directly.
+"""
+import logging
+from typing import Sequence, Tuple
+
+import torch
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+# normalisation of get_default_transform
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class NormalizedModel(nn.Module):
+    """
+    Wraps a model taking normalised (N, C, H, W) float images into a module
+    taking (N, H, W, C) uint8 camera images. The scaling to [0, 1] and the
+    normalisation with mean and std, as done by ToTensor and Normalize, are
+    a single multiply-add.
+    """
+    def __init__(self, model: nn.Module,
+                 mean: Sequence[float] = IMAGENET_MEAN,
+                 std: Sequence[float] = IMAGENET_STD) -> None:
+        super().__init__()
+        self.model = model
+        mean = torch.tensor(mean, dtype=torch.float32).view(1, -1, 1, 1)
+        std = torch.tensor(std, dtype=torch.float32).view(1, -1, 1, 1)
+        self.register_buffer('scale', 1.0 / (255.0 * std))
+        self.register_buffer('offset', -mean / std)
+
+    def forward(self, img: torch.Tensor) -> torch.Tensor:
+        x = img.permute(0, 3, 1, 2).float()
+        return self.model(x * self.scale + self.offset)
+
+
+def model_device(model: nn.Module) -> torch.device:
+    """ :return: device of the model parameters, cpu if it has none """
+    param = next(model.parameters(), None)
+    return param.device if param is not None else torch.device('cpu')
+
+
+def trace_normalized(model: nn.Module, input_shape: Tuple[int, ...]) \
+        -> torch.jit.ScriptModule:
+    """
+    Fuses the normalisation into the model and traces it in eval mode.
+
+    :param model:       model taking normalised (N, C, H, W) images
+    :param input_shape: (H, W, C) shape of the camera image
+    :return:            TorchScript module taking (N, H, W, C) uint8 images
+    """
+    fused = NormalizedModel(model).to(model_device(model)).eval()
+    example = torch.zeros((1, *input_shape), dtype=torch.uint8,
+                          device=model_device(model))
+    with torch.no_grad():
+        return torch.jit.trace(fused, example)
+
+
+def export_torchscript(model: nn.Module, input_shape: Tuple[int, ...],
+                       path: str) -> None:
+    """ Saves the model with fused normalisation as TorchScript """
+    traced = trace_normalized(model, input_shape)
+    traced.save(path)
+    logger.info(f'Saved TorchScript model {path}')
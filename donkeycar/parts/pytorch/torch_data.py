@@ -1,12 +1,15 @@
 # PyTorch
+import os
+import sys
 import torch
-from torch.utils.data import IterableDataset, DataLoader
-from donkeycar.utils import train_test_split
+from torch.utils.data import IterableDataset, DataLoader, get_worker_info
 from donkeycar.parts.tub_v2 import Tub
 from torchvision import transforms
-from typing import List, Any
+from typing import List, Any, Dict, Optional
 from donkeycar.pipeline.types import TubRecord, TubDataset
 from donkeycar.pipeline.sequence import TubSequence
+from donkeycar.pipeline.split import split_by_config
+from donkeycar.pipeline.profiler import PipelineProfiler
 import pytorch_lightning as pl
 
 
@@ -43,20 +46,46 @@ def get_default_transform(for_video=False, for_inference=False, resize=True):
     return transforms.Compose(transform_items)
 
 
+def data_loader_kwargs(config: Any) -> Dict[str, Any]:
+    """
+    Data loader settings from the config. TORCH_NUM_WORKERS worker processes
+    decode the records, None uses up to 4 workers on Linux and none on other
+    platforms, where worker processes are spawned and often fail. Workers
+    are kept alive between the epochs and collate their batches directly
+    into shared memory.
+
+    :param config:  the configuration information
+    :return:        keyword arguments of the torch DataLoader
+    """
+    num_workers = getattr(config, 'TORCH_NUM_WORKERS', None)
+    if num_workers is None:
+        num_workers = min(4, os.cpu_count() or 1) \
+            if sys.platform.startswith('linux') else 0
+    return dict(num_workers=num_workers,
+                persistent_workers=num_workers > 0,
+                pin_memory=torch.cuda.is_available())
+
+
 class TorchTubDataset(IterableDataset):
     '''
-    Loads the dataset, and creates a train/test split.
+    Loads the dataset, and creates a train/test split. When iterated by
+    several data loader workers every worker processes its own shard of the
+    records.
     '''
 
-    def __init__(self, config, records: List[TubRecord], transform=None):
+    def __init__(self, config, records: List[TubRecord], transform=None,
+                 profiler: Optional[PipelineProfiler] = None):
         """Create a PyTorch Tub Dataset
 
         Args:
             config (object): the configuration information
             records (List[TubRecord]): a list of tub records
             transform (function, optional): a transform to apply to the data
+            profiler (PipelineProfiler, optional): times the pipeline stages
+                and prints the profile after each pass over the data
         """
         self.config = config
+        self.profiler = profiler
 
         # Handle the transforms
         if transform:
@@ -64,13 +93,15 @@ class TorchTubDataset(IterableDataset):
         else:
             self.transform = get_default_transform()
 
+        self.records = records
         self.sequence = TubSequence(records)
         self.pipeline = self._create_pipeline()
         self.len = len(records)
 
-    def _create_pipeline(self):
+    def _create_pipeline(self, sequence: Optional[TubSequence] = None):
         """ This can be overridden if more complicated pipelines are
             required """
+        sequence = sequence or self.sequence
 
         def y_transform(record: TubRecord):
             angle: float = record.underlying['user/angle']
@@ -87,16 +118,39 @@ class TorchTubDataset(IterableDataset):
             img_arr = record.image(as_nparray=False)
             return self.transform(img_arr)
 
+        if self.profiler:
+            x_transform = self.profiler.wrap('x_transform', x_transform)
+            y_transform = self.profiler.wrap('y_transform', y_transform)
+
         # Build pipeline using the transformations
-        pipeline = self.sequence.build_pipeline(x_transform=x_transform,
-                                                y_transform=y_transform)
+        pipeline = sequence.build_pipeline(x_transform=x_transform,
+                                           y_transform=y_transform)
         return pipeline
 
     def __len__(self):
         return len(self.sequence)
 
+    def _worker_pipeline(self):
+        """ Returns the pipeline over the shard of the current data loader
+            worker, or over all records in the main process """
+        worker = get_worker_info()
+        if worker is None or worker.num_workers == 1:
+            return self.pipeline
+        shard = self.records[worker.id::worker.num_workers]
+        return self._create_pipeline(TubSequence(shard))
+
     def __iter__(self):
-        return iter(self.pipeline)
+        pipeline = self._worker_pipeline()
+        if self.profiler:
+            return self._profiled_iter(pipeline)
+        return iter(pipeline)
+
+    def _profiled_iter(self, pipeline):
+        # with several data loader workers every worker has its own copy of
+        # the profiler and prints its own share of the data
+        self.profiler.reset()
+        yield from self.profiler.iterate(pipeline)
+        print(self.profiler.report())
 
 
 class TorchTubDataModule(pl.LightningDataModule):
@@ -140,8 +194,8 @@ class TorchTubDataModule(pl.LightningDataModule):
                                    underlying=underlying)
                 self.records.append(record)
 
-        train_records, val_records = train_test_split(
-            self.records, test_size=(1. - self.config.TRAIN_TEST_SPLIT))
+        train_records, val_records = split_by_config(self.config,
+                                                     self.records)
 
         assert len(val_records) > 0, "Not enough validation data. Add more data"
 
@@ -151,11 +205,11 @@ class TorchTubDataModule(pl.LightningDataModule):
             self.config, val_records, transform=self.transform)
 
     def train_dataloader(self):
-        # The number of workers are set to 0 to avoid errors on Macs and Windows
+        # Workers default to 0 on Macs and Windows to avoid errors
         # See: https://github.com/rusty1s/pytorch_geometric/issues/366#issuecomment-498022534
-        return DataLoader(self.train_dataset, batch_size=self.config.BATCH_SIZE, num_workers=0)
+        return DataLoader(self.train_dataset, batch_size=self.config.BATCH_SIZE,
+                          **data_loader_kwargs(self.config))
 
     def val_dataloader(self):
-        # The number of workers are set to 0 to avoid errors on Macs and Windows
-        # See: https://github.com/rusty1s/pytorch_geometric/issues/366#issuecomment-498022534
-        return DataLoader(self.val_dataset, batch_size=self.config.BATCH_SIZE, num_workers=0)
+        return DataLoader(self.val_dataset, batch_size=self.config.BATCH_SIZE,
+                          **data_loader_kwargs(self.config))
@@ -1,106 +1,148 @@
-#from https://github.com/ermolenkodev/keras-salient-object-visualisation
-import os
-from keras import backend as K
-import tensorflow as tf
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-from keras.layers import Input, Dense, merge
-from keras.models import Model
-from keras.layers import Convolution2D, MaxPooling2D, Reshape, BatchNormalization
-from keras.layers import Activation, Dropout, Flatten, Dense
+"""
+Saliency masks of the convolutional pilots with VisualBackProp
+(https://arxiv.org/abs/1611.05418). The feature maps of the conv layers are
+averaged over the channels and, starting from the deepest layer, upscaled
+with a transposed convolution of an all ones kernel of the layer's size and
+stride and multiplied into the averaged feature map of the layer before.
+The whole chain runs as one compiled graph function on batches of images,
+so it is fast enough for a live overlay and for making movies of a tub.
+"""
+from typing import List, Optional
+
 import cv2
 import numpy as np
+import tensorflow as tf
+from tensorflow import keras
 
-class SalientVis():
-    '''
-    Note, this part is quite tuned ust for the image dimensions and layers
-    in our standard models. It will not reflect cropping or additional layers
-    that might be in your model.
-    '''
 
-    def __init__(self, kerasPart):
-        self.model = kerasPart.model
-        self.init_salient(self.model)
+def conv_chain(model: keras.Model) -> List[keras.layers.Conv2D]:
+    """
+    :param model:   keras model
+    :return:        the chain of 2d convolutions of the image input, each
+                    one taking the spatial output shape of the previous one
+    :raises ValueError: if the model has no chain of 2d convolutions
+    """
+    convs = [layer for layer in model.layers
+             if isinstance(layer, keras.layers.Conv2D)
+             and not isinstance(layer, keras.layers.Conv2DTranspose)]
+    if not convs:
+        raise ValueError(f'Model {model.name} has no 2d convolution layers '
+                         f'for the saliency mask')
+    for prev, conv in zip(convs, convs[1:]):
+        if tuple(prev.output.shape[1:3]) != tuple(conv.input.shape[1:3]):
+            raise ValueError(f'Convolution {conv.name} does not follow '
+                             f'{prev.name}, saliency needs a chain of '
+                             f'convolutions')
+    return convs
 
-    def run(self, image):
-        if image is None:
-            return
-        image = self.draw_salient(image)
-        image = image * 255
-        image = image.astype('uint8')
-        return image
 
-    def init_salient(self, model):
-        img_in = Input(shape=(120, 160, 3), name='img_in')
-        x = img_in
-        x = Convolution2D(24, (5,5), strides=(2,2), activation='relu', name='conv1')(x)
-        x = Convolution2D(32, (5,5), strides=(2,2), activation='relu', name='conv2')(x)
-        x = Convolution2D(64, (5,5), strides=(2,2), activation='relu', name='conv3')(x)
-        x = Convolution2D(64, (3,3), strides=(2,2), activation='relu', name='conv4')(x)
-        conv_5 = Convolution2D(64, (3,3), strides=(1,1), activation='relu', name='conv5')(x)
-        self.convolution_part = Model(inputs=[img_in], outputs=[conv_5])
+class VisualBackProp:
+    """
+    Computes the saliency masks of a keras model with a chain of 2d
+    convolutions, like all single frame pilots of the core cnn layers.
+    Layers which change the image before the first convolution, like
+    cropping, are not inverted, the mask is resized to the image instead.
+    """
+    def __init__(self, model: keras.Model) -> None:
+        """
+        :param model:   keras model, its first input is the image
+        """
+        convs = conv_chain(model)
+        self.image_shape = tuple(model.inputs[0].shape[1:])
+        self.features = keras.Model(inputs=model.inputs[0],
+                                    outputs=[c.output for c in convs])
+        # the all ones kernels, strides and padding of the transposed
+        # convolutions and the spatial shapes they upscale to, from the
+        # deepest layer to the first
+        self.kernels = [tf.ones(c.kernel_size + (1, 1)) for c in convs][::-1]
+        self.strides = [(1,) + c.strides + (1,) for c in convs][::-1]
+        self.padding = [c.padding.upper() for c in convs][::-1]
+        self.shapes = [tuple(c.input.shape[1:3]) for c in convs][::-1]
+        self._masks = tf.function(
+            self._compute_masks,
+            input_signature=[tf.TensorSpec((None,) + self.image_shape,
+                                           tf.float32)])
+
+    def _compute_masks(self, images: tf.Tensor) -> tf.Tensor:
+        activations = self.features(images, training=False)
+        if not isinstance(activations, (list, tuple)):
+            activations = [activations]
+        averaged = [tf.reduce_mean(a, axis=-1, keepdims=True)
+                    for a in activations][::-1]
+        batch = tf.shape(images)[0]
+        mask = averaged[0]
+        for i, (kernel, strides, padding, (h, w)) in enumerate(
+                zip(self.kernels, self.strides, self.padding, self.shapes)):
+            mask = tf.nn.conv2d_transpose(
+                mask, kernel, output_shape=tf.stack([batch, h, w, 1]),
+                strides=strides, padding=padding)
+            if i + 1 < len(averaged):
+                mask *= averaged[i + 1]
+        if mask.shape[1:3] != self.image_shape[:2]:
+            mask = tf.image.resize(mask, self.image_shape[:2])
+        mask = mask[..., 0]
+        low = tf.reduce_min(mask, axis=[1, 2], keepdims=True)
+        high = tf.reduce_max(mask, axis=[1, 2], keepdims=True)
+        return tf.math.divide_no_nan(mask - low, high - low)
 
-        for layer_num in ('1', '2', '3', '4', '5'):
-            self.convolution_part.get_layer('conv' + layer_num).set_weights(model.get_layer('conv2d_' + layer_num).get_weights())
-        
-        self.inp = self.convolution_part.input                                           # input placeholder
-        self.outputs = [layer.output for layer in self.convolution_part.layers[1:]]          # all layer outputs
-        self.functor = K.function([self.inp], self.outputs)
+    def masks(self, images: np.ndarray) -> np.ndarray:
+        """
+        :param images:  batch of normalised model input images
+        :return:        (N, H, W) float32 masks scaled to [0, 1] per image
+        """
+        return self._masks(tf.convert_to_tensor(images, tf.float32)).numpy()
 
-        kernel_3x3 = tf.constant(np.array([
-        [[[1]], [[1]], [[1]]], 
-        [[[1]], [[1]], [[1]]], 
-        [[[1]], [[1]], [[1]]]
-        ]), tf.float32)
+    def mask(self, image: np.ndarray) -> np.ndarray:
+        """ :return: mask of a single normalised image """
+        return self.masks(image[np.newaxis])[0]
 
-        kernel_5x5 = tf.constant(np.array([
-                [[[1]], [[1]], [[1]], [[1]], [[1]]], 
-                [[[1]], [[1]], [[1]], [[1]], [[1]]], 
-                [[[1]], [[1]], [[1]], [[1]], [[1]]],
-                [[[1]], [[1]], [[1]], [[1]], [[1]]],
-                [[[1]], [[1]], [[1]], [[1]], [[1]]]
-        ]), tf.float32)
 
-        self.layers_kernels = {5: kernel_3x3, 4: kernel_3x3, 3: kernel_5x5, 2: kernel_5x5, 1: kernel_5x5}
+def overlay(img: np.ndarray, mask: np.ndarray, alpha: float = 0.004) \
+        -> np.ndarray:
+    """
+    Blends the mask in the inferno colour map over the image.
 
-        self.layers_strides = {5: [1, 1, 1, 1], 4: [1, 2, 2, 1], 3: [1, 2, 2, 1], 2: [1, 2, 2, 1], 1: [1, 2, 2, 1]}
+    :param img:     uint8 rgb or grey image
+    :param mask:    saliency mask in [0, 1], resized to the image if the
+                    model input was cropped
+    :param alpha:   weight of the image, the mask gets 1 - alpha, the image
+                    is not scaled down, so the default gives both about the
+                    same weight
+    :return:        uint8 rgb image
+    """
+    if mask.shape != img.shape[:2]:
+        mask = cv2.resize(mask, (img.shape[1], img.shape[0]))
+    heat = cv2.applyColorMap((255 * mask).astype(np.uint8),
+                             cv2.COLORMAP_INFERNO)
+    heat = cv2.cvtColor(heat, cv2.COLOR_BGR2RGB).astype(np.float32) / 255
+    heat = cv2.GaussianBlur(heat, (3, 3), cv2.BORDER_DEFAULT)
+    if img.ndim == 2 or img.shape[2] == 1:
+        img = np.repeat(img.reshape(img.shape[:2] + (1,)), 3, axis=2)
+    blend = cv2.addWeighted(img.astype(np.float32), alpha, heat,
+                            1.0 - alpha, 0)
+    return cv2.normalize(src=blend, dst=None, alpha=0, beta=255,
+                         norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_8U)
 
-        
-    def compute_visualisation_mask(self, img):
-        #from https://github.com/ermolenkodev/keras-salient-object-visualisation
-        
-        activations = self.functor([np.array([img])])
-        activations = [np.reshape(img, (1, img.shape[0], img.shape[1], img.shape[2]))] + activations
-        upscaled_activation = np.ones((3, 6))
-        for layer in [5, 4, 3, 2, 1]:
-            averaged_activation = np.mean(activations[layer], axis=3).squeeze(axis=0) * upscaled_activation
-            output_shape = (activations[layer - 1].shape[1], activations[layer - 1].shape[2])
-            x = tf.constant(
-                np.reshape(averaged_activation, (1,averaged_activation.shape[0],averaged_activation.shape[1],1)),
-                tf.float32
-            )
-            conv = tf.nn.conv2d_transpose(
-                x, self.layers_kernels[layer],
-                output_shape=(1,output_shape[0],output_shape[1], 1), 
-                strides=self.layers_strides[layer], 
-                padding='VALID'
-            )
-            with tf.Session() as session:
-                result = session.run(conv)
-            upscaled_activation = np.reshape(result, output_shape)
-        final_visualisation_mask = upscaled_activation
-        return (final_visualisation_mask - np.min(final_visualisation_mask))/(np.max(final_visualisation_mask) - np.min(final_visualisation_mask))
 
-    def draw_salient(self, img):
-        #from https://github.com/ermolenkodev/keras-salient-object-visualisation
-        alpha = 0.004
-        beta = 1.0 - alpha
+class SalientVis:
+    """
+    Part which draws the saliency mask of a keras pilot over the camera
+    image, the pilot needs to run on the keras interpreter.
+    """
+    def __init__(self, keras_part, alpha: float = 0.004) -> None:
+        """
+        :param keras_part:  keras pilot with a loaded model
+        :param alpha:       weight of the image in the overlay
+        """
+        self.keras_part = keras_part
+        self.alpha = alpha
+        self.backprop = VisualBackProp(keras_part.interpreter.model)
 
-        salient_mask = self.compute_visualisation_mask(img)
-        salient_mask_stacked = np.dstack((salient_mask,salient_mask))
-        salient_mask_stacked = np.dstack((salient_mask_stacked,salient_mask))
-        blend = cv2.addWeighted(img.astype('float32'), alpha, salient_mask_stacked, beta, 0.0)
-        return blend
+    def run(self, image: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        if image is None:
+            return None
+        mask = self.backprop.mask(self.keras_part.normalize(image))
+        return overlay(image, mask, self.alpha)
 
-    def shutdown(self):
+    def shutdown(self) -> None:
         pass
-        
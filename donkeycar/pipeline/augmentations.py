@@ -1,144 +1,350 @@
 import cv2
 import numpy as np
 import logging
+from typing import Dict, List, Optional, Tuple
 from donkeycar.config import Config
 
 
 logger = logging.getLogger(__name__)
 
-#
-# HACK: workaround for imgaug bug; mock our implementation
-# TODO: remove this when https://github.com/autorope/donkeycar/issues/970
-#       is addressed.
-#
-try:
-    import imgaug.augmenters as iaa
-
-    class Augmentations(object):
-        """
-        Some ready to use image augumentations.
-        """
-
-        @classmethod
-        def crop(cls, left, right, top, bottom, keep_size=False):
-            """
-            The image augumentation sequence.
-            Crops based on a region of interest among other things.
-            left, right, top & bottom are the number of pixels to crop.
-            """
-            augmentation = iaa.Crop(px=(top, right, bottom, left),
-                                    keep_size=keep_size)
-            return augmentation
-
-        @classmethod
-        def trapezoidal_mask(cls, lower_left, lower_right, upper_left,
-                             upper_right, min_y, max_y):
-            """
-            Uses a binary mask to generate a trapezoidal region of interest.
-            Especially useful in filtering out uninteresting features from an
-            input image.
-            """
-            def _transform_images(images, random_state, parents, hooks):
-                # Transform a batch of images
-                transformed = []
-                mask = None
-                for image in images:
-                    if mask is None:
-                        mask = np.zeros(image.shape, dtype=np.int32)
-                        # # # # # # # # # # # # #
-                        #       ul     ur          min_y
-                        #
-                        #
-                        #
-                        #    ll             lr     max_y
-                        points = [
-                            [upper_left, min_y],
-                            [upper_right, min_y],
-                            [lower_right, max_y],
-                            [lower_left, max_y]
-                        ]
-                        cv2.fillConvexPoly(mask,
-                                           np.array(points, dtype=np.int32),
-                                           [255, 255, 255])
-                        mask = np.asarray(mask, dtype='bool')
-
-                    masked = np.multiply(image, mask)
-                    transformed.append(masked)
-
-                return transformed
-
-            def _transform_keypoints(keypoints_on_images, random_state,
-                                     parents, hooks):
-                # No-op
-                return keypoints_on_images
-
-            augmentation = iaa.Lambda(func_images=_transform_images,
-                                      func_keypoints=_transform_keypoints)
-            return augmentation
-
-    class ImageAugmentation:
-        def __init__(self, cfg, key):
-            aug_list = getattr(cfg, key, [])
-            augmentations = \
-                [ImageAugmentation.create(a, cfg) for a in aug_list]
-            self.augmentations = iaa.Sequential(augmentations)
-
-        @classmethod
-        def create(cls, aug_type: str, config: Config) -> iaa.meta.Augmenter:
-            """ Augmenatition factory. Cropping and trapezoidal mask are
-                transfomations which should be applied in training, validation
-                and inference. Multiply, Blur and similar are augmentations
-                which should be used only in training. """
-
-            if aug_type == 'CROP':
-                logger.info(f'Creating augmentation {aug_type} with ROI_CROP '
-                            f'L: {config.ROI_CROP_LEFT}, '
-                            f'R: {config.ROI_CROP_RIGHT}, '
-                            f'B: {config.ROI_CROP_BOTTOM}, '
-                            f'T: {config.ROI_CROP_TOP}')
-
-                return Augmentations.crop(left=config.ROI_CROP_LEFT,
-                                          right=config.ROI_CROP_RIGHT,
-                                          bottom=config.ROI_CROP_BOTTOM,
-                                          top=config.ROI_CROP_TOP,
-                                          keep_size=True)
-            elif aug_type == 'TRAPEZE':
-                logger.info(f'Creating augmentation {aug_type}')
-                return Augmentations.trapezoidal_mask(
-                            lower_left=config.ROI_TRAPEZE_LL,
-                            lower_right=config.ROI_TRAPEZE_LR,
-                            upper_left=config.ROI_TRAPEZE_UL,
-                            upper_right=config.ROI_TRAPEZE_UR,
-                            min_y=config.ROI_TRAPEZE_MIN_Y,
-                            max_y=config.ROI_TRAPEZE_MAX_Y)
-
-            elif aug_type == 'MULTIPLY':
-                interval = getattr(config, 'AUG_MULTIPLY_RANGE', (0.5, 1.5))
-                logger.info(f'Creating augmentation {aug_type} {interval}')
-                return iaa.Multiply(interval)
-
-            elif aug_type == 'BLUR':
-                interval = getattr(config, 'AUG_BLUR_RANGE', (0.0, 3.0))
-                logger.info(f'Creating augmentation {aug_type} {interval}')
-                return iaa.GaussianBlur(sigma=interval)
-
-        # Parts interface
-        def run(self, img_arr):
-            aug_img_arr = self.augmentations.augment_image(img_arr)
-            return aug_img_arr
-
-except ImportError:
-
-    #
-    # mock implementation
-    #
-    class ImageAugmentation:
-        def __init__(self, cfg, key):
-            aug_list = getattr(cfg, key, [])
-            for aug in aug_list:
-                logger.warn(
-                    'Augmentation library could not load.  '
-                    f'Augmentation {aug} will be ignored')
-
-        def run(self, img_arr):
-            return img_arr
+
+class Augmenter(object):
+    """
+    Base class of the image augmentations. Augmenters operate on whole uint8
+    batches of shape (N, H, W, C) or (N, H, W) and modify them in place
+    where possible, so no per-image dispatch or dtype conversion is needed.
+    """
+    def augment_batch_(self, images: np.ndarray) -> np.ndarray:
+        """
+        Augments the batch in place.
+
+        :param images:  uint8 batch of images
+        :return:        augmented batch, this is the input array unless the
+                        augmentation changes the image size
+        """
+        raise NotImplementedError('Requires implementation')
+
+    def augment_image(self, image: np.ndarray) -> np.ndarray:
+        """ Augments a single image and returns a new array. """
+        return self.augment_batch_(image[np.newaxis].copy())[0]
+
+    def augment_images(self, images: np.ndarray) -> np.ndarray:
+        """ Augments a batch and returns a new array. """
+        return self.augment_batch_(np.array(images, copy=True))
+
+
+class Crop(Augmenter):
+    """
+    Crops left, right, top & bottom number of pixels. If keep_size is set the
+    cropped images are resized back to the input size with cubic
+    interpolation, like imgaug's Crop(keep_size=True) did.
+    """
+    def __init__(self, left: int, right: int, top: int, bottom: int,
+                 keep_size: bool = False) -> None:
+        self.left = left
+        self.right = right
+        self.top = top
+        self.bottom = bottom
+        self.keep_size = keep_size
+
+    def augment_batch_(self, images: np.ndarray) -> np.ndarray:
+        h, w = images.shape[1:3]
+        cropped = images[:, self.top:h - self.bottom,
+                         self.left:w - self.right]
+        if not self.keep_size or cropped.shape == images.shape:
+            return cropped
+        # source and destination overlap, hence copy the region of interest.
+        # The resize stays per image, cv2 only takes a few channels per call
+        # and stacking the batch into channels is much slower.
+        cropped = cropped.copy()
+        for i, img in enumerate(cropped):
+            resized = cv2.resize(img, (w, h), interpolation=cv2.INTER_CUBIC)
+            images[i] = resized.reshape(images.shape[1:])
+        return images
+
+
+class TrapezoidalMask(Augmenter):
+    """
+    Uses a binary mask to generate a trapezoidal region of interest. The mask
+    is computed once per image shape and then applied to whole batches.
+    """
+    def __init__(self, lower_left: int, lower_right: int, upper_left: int,
+                 upper_right: int, min_y: int, max_y: int) -> None:
+        # # # # # # # # # # # # #
+        #       ul     ur          min_y
+        #
+        #
+        #
+        #    ll             lr     max_y
+        self.points = np.array([[upper_left, min_y],
+                                [upper_right, min_y],
+                                [lower_right, max_y],
+                                [lower_left, max_y]], dtype=np.int32)
+        self.masks: Dict[Tuple[int, ...], np.ndarray] = {}
+
+    def mask(self, shape: Tuple[int, ...]) -> np.ndarray:
+        """
+        Returns the cached 0/1 uint8 mask for a single image shape which
+        broadcasts over the batch dimension.
+        """
+        mask = self.masks.get(shape)
+        if mask is None:
+            mask = np.zeros(shape[:2], dtype=np.uint8)
+            cv2.fillConvexPoly(mask, self.points, 1)
+            if len(shape) == 3:
+                mask = mask[:, :, np.newaxis]
+            self.masks[shape] = mask
+        return mask
+
+    def augment_batch_(self, images: np.ndarray) -> np.ndarray:
+        np.multiply(images, self.mask(images.shape[1:]), out=images)
+        return images
+
+
+class Multiply(Augmenter):
+    """
+    Multiplies each image with a random factor drawn from the given interval,
+    clipping the result to [0, 255] through a per-image lookup table.
+    """
+    def __init__(self, interval: Tuple[float, float]) -> None:
+        self.interval = interval
+        self.rng = np.random.default_rng()
+        self.values = np.arange(256, dtype=np.float32)
+
+    def augment_batch_(self, images: np.ndarray) -> np.ndarray:
+        factors = self.rng.uniform(*self.interval, size=len(images))
+        luts = np.clip(np.rint(np.outer(factors, self.values)), 0, 255) \
+            .astype(np.uint8)
+        # cv2.LUT per image is several times faster than a numpy gather of
+        # the whole batch through the stacked tables
+        for i, (img, lut) in enumerate(zip(images, luts)):
+            images[i] = cv2.LUT(img, lut).reshape(img.shape)
+        return images
+
+
+class GaussianBlur(Augmenter):
+    """
+    Blurs each image with a gaussian kernel, sigma being drawn from the given
+    interval.
+    """
+    eps = 1e-3
+
+    def __init__(self, sigma: Tuple[float, float]) -> None:
+        self.sigma = sigma
+        self.rng = np.random.default_rng()
+
+    @staticmethod
+    def kernel_size(sigma: float) -> int:
+        """ Odd kernel size covering most of the weight of the gaussian. """
+        if sigma < 3.0:
+            ksize = 3.3 * sigma
+        elif sigma < 5.0:
+            ksize = 2.9 * sigma
+        else:
+            ksize = 2.6 * sigma
+        ksize = int(max(ksize, 5))
+        return ksize + 1 if ksize % 2 == 0 else ksize
+
+    def augment_batch_(self, images: np.ndarray) -> np.ndarray:
+        sigmas = self.rng.uniform(*self.sigma, size=len(images))
+        # every image has its own kernel, hence one cv2 call per image
+        for i, (img, sigma) in enumerate(zip(images, sigmas)):
+            if sigma > self.eps:
+                ksize = self.kernel_size(sigma)
+                blurred = cv2.GaussianBlur(img, (ksize, ksize), sigmaX=sigma,
+                                           sigmaY=sigma,
+                                           borderType=cv2.BORDER_REFLECT_101)
+                images[i] = blurred.reshape(img.shape)
+        return images
+
+
+class Augmentations(object):
+    """
+    Some ready to use image augumentations.
+    """
+
+    @classmethod
+    def crop(cls, left, right, top, bottom, keep_size=False):
+        """
+        The image augumentation sequence.
+        Crops based on a region of interest among other things.
+        left, right, top & bottom are the number of pixels to crop.
+        """
+        return Crop(left=left, right=right, top=top, bottom=bottom,
+                    keep_size=keep_size)
+
+    @classmethod
+    def trapezoidal_mask(cls, lower_left, lower_right, upper_left,
+                         upper_right, min_y, max_y):
+        """
+        Uses a binary mask to generate a trapezoidal region of interest.
+        Especially useful in filtering out uninteresting features from an
+        input image.
+        """
+        return TrapezoidalMask(lower_left=lower_left, lower_right=lower_right,
+                               upper_left=upper_left, upper_right=upper_right,
+                               min_y=min_y, max_y=max_y)
+
+
+class ImageTransformation(object):
+    """
+    Inference version of the TRANSFORMATIONS. Crop, trapezoidal mask, an
+    optional resize and the uint8 -> float32 normalisation are compiled into
+    at most one resize and one fused multiply, which writes straight into the
+    given output buffer, e.g. the input tensor of the interpreter. Only the
+    deterministic transformations 'CROP' and 'TRAPEZE' are supported.
+    """
+    def __init__(self, cfg: Config, key: str = 'TRANSFORMATIONS',
+                 output_shape: Optional[Tuple[int, ...]] = None) -> None:
+        """
+        :param cfg:             donkey config
+        :param key:             config key of the transformation list
+        :param output_shape:    (H, W, ...) of the output if no output
+                                buffer is passed into run(), defaults to the
+                                input image shape
+        """
+        self.crop: Optional[Crop] = None
+        self.mask: Optional[TrapezoidalMask] = None
+        # if the mask comes before the crop it has to be applied on the
+        # input image, otherwise it is fused into the normalisation
+        self.mask_first = False
+        for trans in getattr(cfg, key, []):
+            augmentation = ImageAugmentation.create(trans, cfg)
+            if isinstance(augmentation, Crop):
+                self.crop = augmentation
+            elif isinstance(augmentation, TrapezoidalMask):
+                self.mask = augmentation
+                self.mask_first = self.crop is None
+            else:
+                raise ValueError(f'Transformation {trans} cannot be fused '
+                                 f'into the inference path')
+        self.mask_first = self.mask_first and self.crop is not None
+        self.output_shape = output_shape
+        self.scales: Dict[Tuple[int, ...], np.ndarray] = {}
+
+    def scale(self, shape: Tuple[int, ...]) -> np.ndarray:
+        """
+        Returns the cached float32 factor per pixel which combines the
+        trapezoidal mask with the normalisation into [0, 1].
+        """
+        scale = self.scales.get(shape)
+        if scale is None:
+            if self.mask and not self.mask_first:
+                scale = self.mask.mask(shape).astype(np.float32) \
+                    * np.float32(1.0 / 255.0)
+            else:
+                scale = np.float32(1.0 / 255.0)
+            self.scales[shape] = scale
+        return scale
+
+    def run(self, img_arr: np.ndarray, out: Optional[np.ndarray] = None) \
+            -> np.ndarray:
+        """
+        :param img_arr: uint8 [0,255] image
+        :param out:     optional float32 buffer to write the result into,
+                        its shape determines the output size
+        :return:        float32 [0,1] transformed image
+        """
+        if out is not None:
+            shape = out.shape
+        elif self.output_shape is not None:
+            shape = tuple(self.output_shape[:2]) + img_arr.shape[2:]
+        else:
+            shape = img_arr.shape
+        h_in, w_in = img_arr.shape[:2]
+        h, w = shape[:2]
+        src = img_arr
+        if self.mask_first:
+            src = self.mask.augment_image(src)
+        if self.crop:
+            # crop is given in output coordinates, i.e. after resizing
+            # the input to the output size as done in training
+            top = self.crop.top * h_in // h
+            bottom = self.crop.bottom * h_in // h
+            left = self.crop.left * w_in // w
+            right = self.crop.right * w_in // w
+            src = src[top:h_in - bottom, left:w_in - right]
+        if src.shape[:2] != (h, w):
+            # same interpolation as Crop with keep_size in training
+            src = cv2.resize(src, (w, h), interpolation=cv2.INTER_CUBIC)
+        src = src.reshape(shape)
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        np.multiply(src, self.scale(shape), out=out, casting='unsafe')
+        return out
+
+
+class ImageAugmentation:
+    def __init__(self, cfg, key):
+        aug_list = getattr(cfg, key, [])
+        augmentations = \
+            [ImageAugmentation.create(a, cfg) for a in aug_list]
+        self.augmentations: List[Augmenter] = \
+            [a for a in augmentations if a is not None]
+
+    @classmethod
+    def create(cls, aug_type: str, config: Config) -> Optional[Augmenter]:
+        """ Augmenatition factory. Cropping and trapezoidal mask are
+            transfomations which should be applied in training, validation
+            and inference. Multiply, Blur and similar are augmentations
+            which should be used only in training. """
+
+        if aug_type == 'CROP':
+            logger.info(f'Creating augmentation {aug_type} with ROI_CROP '
+                        f'L: {config.ROI_CROP_LEFT}, '
+                        f'R: {config.ROI_CROP_RIGHT}, '
+                        f'B: {config.ROI_CROP_BOTTOM}, '
+                        f'T: {config.ROI_CROP_TOP}')
+
+            return Augmentations.crop(left=config.ROI_CROP_LEFT,
+                                      right=config.ROI_CROP_RIGHT,
+                                      bottom=config.ROI_CROP_BOTTOM,
+                                      top=config.ROI_CROP_TOP,
+                                      keep_size=True)
+        elif aug_type == 'TRAPEZE':
+            logger.info(f'Creating augmentation {aug_type}')
+            return Augmentations.trapezoidal_mask(
+                        lower_left=config.ROI_TRAPEZE_LL,
+                        lower_right=config.ROI_TRAPEZE_LR,
+                        upper_left=config.ROI_TRAPEZE_UL,
+                        upper_right=config.ROI_TRAPEZE_UR,
+                        min_y=config.ROI_TRAPEZE_MIN_Y,
+                        max_y=config.ROI_TRAPEZE_MAX_Y)
+
+        elif aug_type == 'MULTIPLY':
+            interval = getattr(config, 'AUG_MULTIPLY_RANGE', (0.5, 1.5))
+            logger.info(f'Creating augmentation {aug_type} {interval}')
+            return Multiply(interval)
+
+        elif aug_type == 'BLUR':
+            interval = getattr(config, 'AUG_BLUR_RANGE', (0.0, 3.0))
+            logger.info(f'Creating augmentation {aug_type} {interval}')
+            return GaussianBlur(sigma=interval)
+
+        else:
+            logger.warning(f'Unknown augmentation {aug_type} will be ignored')
+            return None
+
+    def augment_batch(self, images: np.ndarray,
+                      in_place: bool = False) -> np.ndarray:
+        """
+        Runs all augmentations over a batch of images.
+
+        :param images:      uint8 array of shape (N, H, W, C) or (N, H, W)
+        :param in_place:    if the input batch may be overwritten, otherwise
+                            or if it is read-only it gets copied first
+        :return:            augmented uint8 batch
+        """
+        assert images.dtype == np.uint8, \
+            f"Augmentation requires uint8 array but not {images.dtype}"
+        if not self.augmentations:
+            return images
+        if not in_place or not images.flags.writeable:
+            images = images.copy()
+        for augmentation in self.augmentations:
+            images = augmentation.augment_batch_(images)
+        return images
+
+    # Parts interface
+    def run(self, img_arr):
+        return self.augment_batch(img_arr[np.newaxis])[0]
@@ -4,7 +4,7 @@ import os
 import time
 import shutil
 import glob
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import pandas as pd
 import logging
 from donkeycar.config import Config
@@ -34,7 +34,12 @@ class PilotDatabase:
             logger.warning(f'No model database found at {self.path}')
             return []
 
-    def generate_model_name(self) -> Tuple[str, int]:
+    def generate_model_name(self, offset: int = 0) -> Tuple[str, int]:
+        """
+        :param offset:  skip this many numbers after the next free model
+                        number, used to name several models at once
+        :return:        tuple of model path and model number
+        """
         if self.entries:
             df = self.to_df()
             # otherwise this will be a numpy int
@@ -42,6 +47,7 @@ class PilotDatabase:
             this_num = last_num + 1
         else:
             this_num = 0
+        this_num += offset
         date = time.strftime('%y-%m-%d')
         name = f'pilot_{date}_{this_num}.h5'
         return os.path.join(self.cfg.MODELS_PATH, name), this_num
@@ -66,6 +72,19 @@ class PilotDatabase:
     def add_entry(self, entry: Dict):
         self.entries.append(entry)
 
+    def get_entry(self, pilot_name: str = None) -> Optional[Dict]:
+        """
+        :param pilot_name:  name of the pilot without extension, if not given
+                            the entry with the highest number is returned
+        :return:            the database entry or None if not found
+        """
+        if pilot_name is None:
+            return max(self.entries, key=lambda e: e['Number'], default=None)
+        for entry in reversed(self.entries):
+            if entry['Name'] == pilot_name:
+                return entry
+        return None
+
     def delete_entry(self, pilot_name):
         to_delete_entry = None
         for entry in self.entries:
@@ -130,7 +149,8 @@ class PilotDatabase:
             pilot_df = self.to_df()
             tub_text = ''
 
-        pilot_df.drop(columns=['History', 'Config'], errors='ignore',
+        pilot_df.drop(columns=['History', 'Config', 'Sessions', 'Int8'],
+                      errors='ignore',
                       inplace=True)
         pilot_text = pilot_df.to_string(formatters=self.formatter())
         pilot_names = pilot_df['Name'].tolist() if not pilot_df.empty else []
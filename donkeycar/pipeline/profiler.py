@@ -0,0 +1,157 @@
+"""
+Instrumentation of the training input pipeline. A PipelineProfiler collects
+the time spent in each stage of the record to batch conversion, like image
+decoding, transformations, augmentations or normalisation, and how long the
+producer of the records sits idle because the consumer is busy. From that it
+reports a stage-by-stage throughput breakdown and whether training is bound
+by the input pipeline or by the model step. Stages which are timed inside
+another stage are indented by two spaces. Setup stages, which run once
+before the first batch, are reported separately and survive a reset.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Iterator, List, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# name of the stages which are not part of the record processing
+IDLE = 'producer idle'
+STEP = 'model step'
+
+
+class PipelineProfiler(object):
+    """
+    Accumulates time and number of calls per pipeline stage. The stages can
+    be timed from the tf.data generator thread and the training thread at
+    the same time, hence all updates are locked.
+    """
+    def __init__(self, name: str = 'pipeline') -> None:
+        self.name = name
+        self.lock = threading.Lock()
+        self.times: Dict[str, float] = OrderedDict()
+        self.counts: Dict[str, int] = OrderedDict()
+        self.records = 0
+        self.start = perf_counter()
+        self.setup_times: Dict[str, float] = OrderedDict()
+        self.setup_counts: Dict[str, int] = OrderedDict()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.times.clear()
+            self.counts.clear()
+            self.records = 0
+            self.start = perf_counter()
+
+    def add(self, stage: str, seconds: float, count: int = 1) -> None:
+        with self.lock:
+            self.times[stage] = self.times.get(stage, 0.0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + count
+
+    def add_setup(self, stage: str, seconds: float, count: int = 1) -> None:
+        """ Adds the time of a stage which runs once when the pipeline is
+            set up and not per record, it is kept by reset(). """
+        with self.lock:
+            self.setup_times[stage] = \
+                self.setup_times.get(stage, 0.0) + seconds
+            self.setup_counts[stage] = \
+                self.setup_counts.get(stage, 0) + count
+
+    @contextmanager
+    def time(self, stage: str, count: int = 1):
+        """ Context manager timing the enclosed block as the given stage,
+            count is the number of records the block processes. """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, perf_counter() - start, count)
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        """ Returns the function timed as the given stage. """
+        def timed(*args, **kwargs):
+            with self.time(stage):
+                return func(*args, **kwargs)
+        return timed
+
+    def iterate(self, iterable: Iterable[T]) -> Iterator[T]:
+        """
+        Passes through the iterable and counts the records. The time between
+        handing out a record and being asked for the next one is the time
+        the producer sits idle, because the consumer, i.e. the prefetch
+        buffer of tf.data or the data loader, is full. Little idle time
+        means the consumer is starved of data.
+        """
+        for item in iterable:
+            with self.lock:
+                self.records += 1
+            with self.time(IDLE):
+                yield item
+
+    def report(self) -> str:
+        """
+        :return:    table of total time, time per record and throughput for
+                    each stage, followed by the bottleneck verdict
+        """
+        with self.lock:
+            times = dict(self.times)
+            counts = dict(self.counts)
+            records = self.records
+            wall = perf_counter() - self.start
+            setup_times = dict(self.setup_times)
+            setup_counts = dict(self.setup_counts)
+        lines = [f'Profile of {self.name}: {records} records in {wall:.2f}s '
+                 f'({records / wall if wall else 0:.1f} records/s)',
+                 f'{"stage":<24}{"calls":>8}{"total s":>10}{"ms/call":>10}'
+                 f'{"calls/s":>12}']
+        def row(stage: str, t: float, n: int) -> str:
+            return f'{stage:<24}{n:>8}{t:>10.3f}{1000 * t / n:>10.3f}' \
+                   f'{n / t if t else float("inf"):>12.1f}'
+
+        for stage, t in times.items():
+            lines.append(row(stage, t, counts[stage]))
+        if setup_times:
+            lines.append('setup, once before the first batch:')
+            for stage, t in setup_times.items():
+                lines.append(row(stage, t, setup_counts[stage]))
+        # nested stages are indented and already part of their parent
+        produce = sum(t for stage, t in times.items()
+                      if stage not in (IDLE, STEP)
+                      and not stage.startswith(' '))
+        idle = times.get(IDLE, 0.0)
+        if produce + idle > 0:
+            share = idle / (produce + idle)
+            verdict = 'input bound, the consumer is waiting for data' \
+                if share < 0.1 else 'the input pipeline keeps up'
+            lines.append(f'Producer idle {100 * share:.1f}% of the time: '
+                         f'{verdict}')
+        return '\n'.join(lines)
+
+
+def profile_batches(batches: Iterable, num_batches: int,
+                    profiler: PipelineProfiler) -> List[float]:
+    """
+    Pulls batches from an iterable without running any model, as the
+    benchmark of the input pipeline.
+
+    :param batches:     iterable of batches, like a tf.data.Dataset or a
+                        torch DataLoader
+    :param num_batches: number of batches to pull
+    :param profiler:    profiler which is reset before the first batch
+    :return:            list of the times in seconds waited for each batch
+    """
+    waits = []
+    profiler.reset()
+    it = iter(batches)
+    for _ in range(num_batches):
+        start = perf_counter()
+        try:
+            next(it)
+        except StopIteration:
+            break
+        waits.append(perf_counter() - start)
+    return waits
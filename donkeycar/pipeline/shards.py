@@ -0,0 +1,191 @@
+"""
+Pre-baked training shards. The deterministic part of the training input
+pipeline, i.e. reading the records, decoding the images, applying the
+TRANSFORMATIONS and extracting the model's x and y values, is run once and
+its output is written into .npz shard files. Training from the shards then
+only applies the random AUGMENTATIONS and the normalisation, so repeated
+trainings on the same data skip the decoding and transformations entirely.
+"""
+import json
+import logging
+import math
+import os
+from copy import copy
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import tensorflow as tf
+
+from donkeycar.config import Config
+from donkeycar.parts.keras import KerasPilot
+from donkeycar.pipeline.augmentations import ImageAugmentation
+from donkeycar.pipeline.types import TubDataset
+from donkeycar.pipeline.split import split_by_config
+from donkeycar.utils import get_model_by_type, normalize_image
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'shards.json'
+# the only model input which is augmented and normalised
+IMG_KEY = 'img_in'
+# config parameters which change the content of the shards
+SHARD_KEYS = ('IMAGE_H', 'IMAGE_W', 'IMAGE_DEPTH', 'TRANSFORMATIONS',
+              'ROI_CROP_TOP', 'ROI_CROP_BOTTOM', 'ROI_CROP_RIGHT',
+              'ROI_CROP_LEFT', 'ROI_TRAPEZE_LL', 'ROI_TRAPEZE_LR',
+              'ROI_TRAPEZE_UL', 'ROI_TRAPEZE_UR', 'ROI_TRAPEZE_MIN_Y',
+              'ROI_TRAPEZE_MAX_Y')
+
+
+def shard_config(cfg: Config) -> Dict[str, Any]:
+    """ The config values the shard content depends on, tuples become lists
+        to compare with the values read back from json. """
+    return {key: json.loads(json.dumps(getattr(cfg, key, None)))
+            for key in SHARD_KEYS}
+
+
+def export_shards(cfg: Config, tub_paths: str, out_dir: str,
+                  model_type: str = None, shard_size: int = 1000,
+                  compress: bool = False) -> Dict[str, Any]:
+    """
+    Writes the transformed images and the x and y values of all records of
+    the tubs into shard files, already split into training and validation
+    records.
+
+    :param cfg:         donkey config
+    :param tub_paths:   comma separated tub paths
+    :param out_dir:     directory for the shards and their manifest
+    :param model_type:  model type, defaults to cfg.DEFAULT_MODEL_TYPE
+    :param shard_size:  number of records per shard
+    :param compress:    if the shards are zip compressed, this makes them
+                        smaller but slower to read
+    :return:            the manifest
+    """
+    if model_type is None:
+        model_type = cfg.DEFAULT_MODEL_TYPE
+    if 'fastai_' in model_type:
+        raise ValueError(f'Shards are not supported for {model_type}')
+    # decoded images are only needed once
+    cfg = copy(cfg)
+    cfg.CACHE_IMAGES = False
+    kl = get_model_by_type(model_type, cfg)
+    all_tub_paths = [os.path.expanduser(tub) for tub in tub_paths.split(',')]
+    dataset = TubDataset(cfg, all_tub_paths, seq_size=kl.seq_size())
+    records = dataset.get_records()
+    sessions = dataset.sessions()
+    train_records, val_records = split_by_config(cfg, records)
+    transformation = ImageAugmentation(cfg, 'TRANSFORMATIONS')
+    save = np.savez_compressed if compress else np.savez
+    os.makedirs(out_dir, exist_ok=True)
+
+    def write(split: str, split_records: List) -> List[Dict[str, Any]]:
+        shards = []
+        for i in range(0, len(split_records), shard_size):
+            chunk = split_records[i:i + shard_size]
+            xs = [kl.x_transform(r, transformation.run) for r in chunk]
+            arrays = {f'x_{k}': np.stack([np.asarray(x[k]) for x in xs])
+                      for k in xs[0]}
+            arrays.update({f'y_{k}': y
+                           for k, y in kl.y_transform_batch(chunk).items()})
+            name = f'{split}_{len(shards):05d}.npz'
+            save(os.path.join(out_dir, name), **arrays)
+            shards.append({'file': name, 'records': len(chunk)})
+            logger.info(f'Written shard {name} with {len(chunk)} records')
+        return shards
+
+    manifest = {
+        'model_type': model_type,
+        'tub_paths': tub_paths,
+        'config': shard_config(cfg),
+        'sessions': sessions,
+        'train': write('train', train_records),
+        'validation': write('val', val_records)
+    }
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f'Exported {len(train_records)} training and '
+                f'{len(val_records)} validation records to {out_dir}')
+    return manifest
+
+
+def load_manifest(shard_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(shard_dir, MANIFEST), 'r') as f:
+        return json.load(f)
+
+
+class ShardSequence(object):
+    """
+    Counterpart of BatchSequence which reads the records from shards. The
+    shards are interleaved in parallel and only the augmentations and the
+    normalisation are applied on the fly.
+    """
+    def __init__(self,
+                 model: KerasPilot,
+                 config: Config,
+                 shard_dir: str,
+                 is_train: bool,
+                 manifest: Optional[Dict[str, Any]] = None) -> None:
+        """
+        :param model:       the model, must match the model type the shards
+                            were exported for
+        :param config:      donkey config
+        :param shard_dir:   directory of the shards
+        :param is_train:    if training or validation shards are read, only
+                            the training shards get augmented and shuffled
+        :param manifest:    the shard manifest, read from the directory if
+                            not given
+        """
+        self.model = model
+        self.config = config
+        self.shard_dir = shard_dir
+        self.manifest = manifest or load_manifest(shard_dir)
+        self.shards = self.manifest['train' if is_train else 'validation']
+        self.num_records = sum(s['records'] for s in self.shards)
+        self.batch_size = config.BATCH_SIZE
+        self.is_train = is_train
+        self.augmentation = ImageAugmentation(config, 'AUGMENTATIONS')
+        changed = [k for k, v in shard_config(config).items()
+                   if v != self.manifest['config'].get(k)]
+        if changed:
+            logger.warning(f'Config values {changed} differ from the ones '
+                           f'the shards in {shard_dir} were exported with')
+
+    def __len__(self) -> int:
+        return math.ceil(self.num_records / self.batch_size)
+
+    def read_shard(self, file_name: bytes):
+        """ Generator over the records of a shard, the images are augmented
+            all at once. """
+        with np.load(os.path.join(self.shard_dir,
+                                  file_name.decode())) as data:
+            arrays = {k: data[k] for k in data.files}
+        num = len(next(iter(arrays.values())))
+        order = np.random.permutation(num) if self.is_train else range(num)
+        images = arrays[f'x_{IMG_KEY}']
+        if self.is_train:
+            # sequence models store several images per record
+            frames = images.reshape((-1,) + images.shape[-3:])
+            self.augmentation.augment_batch(frames, in_place=True)
+        x_keys = [k for k in arrays if k.startswith('x_')]
+        y_keys = [k for k in arrays if k.startswith('y_')]
+        for i in order:
+            x = {k[2:]: arrays[k][i] for k in x_keys}
+            x[IMG_KEY] = normalize_image(x[IMG_KEY])
+            y = {k[2:]: arrays[k][i] for k in y_keys}
+            yield x, y
+
+    def create_tf_data(self) -> tf.data.Dataset:
+        """ Assembles the tf data pipeline """
+        files = tf.data.Dataset.from_tensor_slices(
+            [s['file'] for s in self.shards])
+        if self.is_train and self.shards:
+            files = files.shuffle(len(self.shards))
+        output_types = self.model.output_types()
+        output_shapes = self.model.output_shapes()
+        dataset = files.repeat().interleave(
+            lambda f: tf.data.Dataset.from_generator(
+                self.read_shard, args=(f,), output_types=output_types,
+                output_shapes=output_shapes),
+            cycle_length=max(1, min(len(self.shards), 4)),
+            num_parallel_calls=tf.data.experimental.AUTOTUNE,
+            deterministic=not self.is_train)
+        return dataset.batch(self.batch_size)
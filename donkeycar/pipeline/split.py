@@ -0,0 +1,230 @@
+"""
+Deterministic train / validation split. Records are grouped into blocks of
+consecutive records of a recording session, so nearly identical neighbouring
+frames end up on the same side of the split. The blocks are ranked by a hash
+of their name, which makes the split reproducible, and the assignment is
+stored next to each tub, so later trainings, also of other frameworks, reuse
+it. Records added to a tub later form new blocks which are split on their
+own, the assignment of the earlier records never changes.
+"""
+import logging
+import os
+import random
+import tempfile
+import zipfile
+import zlib
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from donkeycar.config import Config
+from donkeycar.pipeline.types import TubRecord, session_key
+
+logger = logging.getLogger(__name__)
+
+SPLIT_FILE = 'split.npz'
+Record = Union[TubRecord, List[TubRecord]]
+BlockKey = Tuple[str, Optional[str], int]
+# tub path to record index to True for validation and False for training
+Assignments = Dict[str, Dict[int, bool]]
+
+
+def record_index(record: Record) -> int:
+    """ Returns the tub index of the record or of the first record of a
+        sequence """
+    if isinstance(record, list):
+        record = record[0]
+    return int(record.underlying['_index'])
+
+
+def block_key(record: Record, block_size: int) -> BlockKey:
+    """
+    :param record:      record or sequence of records
+    :param block_size:  number of consecutive records per block, 0 makes
+                        every session one block
+    :return:            tub path, session id and block number of the record
+    """
+    tub_path, session_id = session_key(record)
+    block = record_index(record) // block_size if block_size else 0
+    return tub_path, session_id, block
+
+
+def block_rank(key: BlockKey) -> int:
+    """ Hash of the block which does not depend on the location of the tub
+        or on the python hash seed """
+    tub_path, session_id, block = key
+    name = f'{os.path.basename(tub_path)}/{session_id}/{block}'
+    return zlib.crc32(name.encode())
+
+
+def load_split(tub_path: str, block_size: int, test_size: float) \
+        -> Dict[int, bool]:
+    """
+    Reads the stored split of the tub, if it was made with the same
+    parameters. A file which can't be read is treated like a missing one.
+
+    :return:    dictionary of record index to True for validation records
+                and False for training records
+    """
+    path = os.path.join(tub_path, SPLIT_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with np.load(path) as split:
+            if int(split['block_size']) != block_size \
+                    or not np.isclose(float(split['test_size']), test_size):
+                logger.info(f'Split {path} was made with other parameters, '
+                            f'creating a new one')
+                return {}
+            assignment = {int(i): False for i in split['train']}
+            assignment.update({int(i): True for i in split['val']})
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        logger.warning(f'Could not read split {path}, creating a new one: '
+                       f'{e}')
+        return {}
+    return assignment
+
+
+def save_split(tub_path: str, block_size: int, test_size: float,
+               assignment: Dict[int, bool]) -> None:
+    """ Writes the record indexes of the training and validation records
+        into the tub directory. The file is written next to the split file
+        and then replaces it, so readers never see a partly written one. """
+    path = os.path.join(tub_path, SPLIT_FILE)
+    train = sorted(i for i, val in assignment.items() if not val)
+    val = sorted(i for i, val in assignment.items() if val)
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=tub_path, prefix='.split_',
+                                         suffix='.npz', delete=False) as f:
+            tmp_path = f.name
+            np.savez(f, train=np.array(train, dtype=np.int64),
+                     val=np.array(val, dtype=np.int64),
+                     block_size=block_size, test_size=test_size)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f'Could not save split {path}: {e}')
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def split_assignments(records: List[Record], test_size: float = 0.2,
+                      block_size: int = 100, persist: bool = True,
+                      assignments: Optional[Assignments] = None) \
+        -> Assignments:
+    """
+    Assigns the records to training or validation by blocks of consecutive
+    records.
+
+    :param records:     records or record sequences
+    :param test_size:   share of the validation blocks
+    :param block_size:  number of consecutive records per block, 0 makes
+                        every session one block
+    :param persist:     if the split is read from and saved to the tubs
+    :param assignments: assignments made before, like by the parent process
+                        of a sweep. If given, the tubs are neither read nor
+                        written.
+    :return:            assignments of all records
+    """
+    blocks: Dict[BlockKey, List[Record]] = {}
+    for record in records:
+        blocks.setdefault(block_key(record, block_size), []).append(record)
+    tub_paths = {key[0] for key in blocks}
+    if assignments is not None:
+        persist = False
+        assignments = {tub_path: dict(assignments.get(tub_path, {}))
+                       for tub_path in tub_paths}
+    else:
+        assignments = {tub_path: load_split(tub_path, block_size, test_size)
+                       if persist else {} for tub_path in tub_paths}
+
+    # blocks with stored records keep their side
+    is_val: Dict[BlockKey, bool] = {}
+    new_blocks = []
+    for key, block_records in blocks.items():
+        stored = assignments[key[0]]
+        sides = {stored[i] for i in map(record_index, block_records)
+                 if i in stored}
+        if sides:
+            is_val[key] = sides.pop()
+        else:
+            new_blocks.append(key)
+
+    # the new blocks with the lowest hash become validation blocks, so the
+    # share of validation blocks is close to test_size
+    num_val = round(test_size * len(blocks)) - sum(is_val.values())
+    if test_size > 0 and len(blocks) > 1:
+        num_val = max(num_val, 1 - sum(is_val.values()))
+    num_val = min(max(num_val, 0), len(new_blocks))
+    new_blocks.sort(key=block_rank)
+    for i, key in enumerate(new_blocks):
+        is_val[key] = i < num_val
+    if len(blocks) < 2:
+        logger.warning(f'Only {len(blocks)} split blocks, decrease the '
+                       f'block size for a validation set')
+
+    for key, block_records in blocks.items():
+        for record in block_records:
+            assignments[key[0]][record_index(record)] = is_val[key]
+    if persist and new_blocks:
+        for tub_path in {key[0] for key in new_blocks}:
+            save_split(tub_path, block_size, test_size,
+                       assignments[tub_path])
+    return assignments
+
+
+def split_records(records: List[Record], test_size: float = 0.2,
+                  block_size: int = 100, persist: bool = True,
+                  shuffle: bool = True,
+                  assignments: Optional[Assignments] = None) \
+        -> Tuple[List[Record], List[Record]]:
+    """
+    Splits the records into training and validation records by blocks of
+    consecutive records.
+
+    :param records:     records or record sequences
+    :param test_size:   share of the validation blocks
+    :param block_size:  number of consecutive records per block, 0 makes
+                        every session one block
+    :param persist:     if the split is read from and saved to the tubs
+    :param shuffle:     if the training records are shuffled, the
+                        validation records keep their order
+    :param assignments: optional assignments made before, see
+                        split_assignments
+    :return:            training and validation records
+    """
+    assignments = split_assignments(records, test_size, block_size, persist,
+                                    assignments)
+    train, val = [], []
+    for record in records:
+        is_val = assignments[session_key(record)[0]][record_index(record)]
+        (val if is_val else train).append(record)
+    if shuffle:
+        random.shuffle(train)
+    logger.info(f'Split by blocks of {block_size or "session"} records into '
+                f'{len(train)} training and {len(val)} validation records')
+    return train, val
+
+
+def split_by_config(cfg: Config, records: List[Record],
+                    assignments: Optional[Assignments] = None) \
+        -> Tuple[List[Record], List[Record]]:
+    """ Splits the records with the TRAIN_TEST_SPLIT, TRAIN_SPLIT_BLOCK and
+        TRAIN_SPLIT_PERSIST settings of the config, or with the given
+        assignments """
+    return split_records(records,
+                         test_size=1. - cfg.TRAIN_TEST_SPLIT,
+                         block_size=getattr(cfg, 'TRAIN_SPLIT_BLOCK', 100),
+                         persist=getattr(cfg, 'TRAIN_SPLIT_PERSIST', True),
+                         assignments=assignments)
+
+
+def assignments_by_config(cfg: Config, records: List[Record],
+                          persist: bool = True) -> Assignments:
+    """ Assigns the records with the TRAIN_TEST_SPLIT, TRAIN_SPLIT_BLOCK and
+        TRAIN_SPLIT_PERSIST settings of the config, the split is only read
+        from and saved to the tubs if persist is also set """
+    return split_assignments(
+        records, test_size=1. - cfg.TRAIN_TEST_SPLIT,
+        block_size=getattr(cfg, 'TRAIN_SPLIT_BLOCK', 100),
+        persist=persist and getattr(cfg, 'TRAIN_SPLIT_PERSIST', True))
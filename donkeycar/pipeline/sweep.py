@@ -0,0 +1,262 @@
+"""
+Hyperparameter sweeps over several training configurations. The tub data is
+read and decoded only once into a frame cache on disk. Every configuration
+is then trained in its own process which memory-maps the cache read-only,
+so the decoded images are shared through the page cache.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from copy import copy
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from donkeycar.config import Config, load_config
+from donkeycar.parts.tub_v2 import Tub
+from donkeycar.pipeline.database import PilotDatabase
+from donkeycar.pipeline.split import Assignments, assignments_by_config
+from donkeycar.pipeline.types import TubDataset, TubRecord
+
+logger = logging.getLogger(__name__)
+
+FRAMES = 'frames.npy'
+RECORDS = 'records.json'
+# config parameters which change the decoded images and hence cannot be
+# varied within a sweep
+IMAGE_KEYS = ('IMAGE_H', 'IMAGE_W', 'IMAGE_DEPTH')
+
+
+class FrameCache(object):
+    """
+    Decoded uint8 images of all records of the given tubs in a single .npy
+    file, together with the record dictionaries.
+    """
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, RECORDS), 'r') as f:
+            meta = json.load(f)
+        self.tub_paths: List[str] = meta['tub_paths']
+        self.records: List[Dict[str, Any]] = meta['records']
+        self.frames = np.load(os.path.join(cache_dir, FRAMES), mmap_mode='r')
+
+    @classmethod
+    def create(cls, cfg: Config, tub_paths: List[str],
+               cache_dir: str) -> 'FrameCache':
+        """
+        Reads the tubs, decodes all images and writes the cache. A cache
+        already in the directory is reused if it was made from the same
+        tubs, records and image size.
+
+        :param cfg:         donkey config, the image size is taken from here
+        :param tub_paths:   list of tub paths
+        :param cache_dir:   directory for the cache files
+        :return:            the frame cache
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        tubs = [Tub(tub_path, read_only=True) for tub_path in tub_paths]
+        records = []
+        for tub in tubs:
+            for underlying in tub:
+                records.append({'base_path': tub.base_path,
+                                'underlying': underlying})
+        shape = (len(records), cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)
+        meta = {'tub_paths': tub_paths, 'shape': list(shape),
+                'records': records}
+        if cls.matches(cache_dir, meta):
+            logger.info(f'Reusing frame cache {cache_dir}')
+            return cls(cache_dir)
+        # without the records file a partly written cache is never reused
+        records_path = os.path.join(cache_dir, RECORDS)
+        if os.path.exists(records_path):
+            os.remove(records_path)
+        logger.info(f'Decoding {len(records)} images into frame cache '
+                    f'{cache_dir}')
+        frames = np.lib.format.open_memmap(os.path.join(cache_dir, FRAMES),
+                                           mode='w+', dtype=np.uint8,
+                                           shape=shape)
+        for i, rec in enumerate(records):
+            record = TubRecord(cfg, rec['base_path'], rec['underlying'])
+            img = record.load_image()
+            if img is None:
+                raise ValueError(f'Could not load image of record {record}')
+            frames[i] = img.reshape(shape[1:])
+        frames.flush()
+        del frames
+        with open(records_path, 'w') as f:
+            json.dump(meta, f)
+        return cls(cache_dir)
+
+    @staticmethod
+    def matches(cache_dir: str, meta: Dict[str, Any]) -> bool:
+        """
+        :param cache_dir:   directory of the cache
+        :param meta:        tub paths, frame shape and records the cache
+                            needs to hold
+        :return:            if the cache in the directory holds them
+        """
+        try:
+            with open(os.path.join(cache_dir, RECORDS), 'r') as f:
+                cached = json.load(f)
+            frames = np.load(os.path.join(cache_dir, FRAMES), mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        # compare through json, which turns the tuples into lists
+        return list(frames.shape) == meta['shape'] \
+            and cached == json.loads(json.dumps(meta))
+
+
+class CachedTubRecord(TubRecord):
+    """ TubRecord which takes its image from the frame cache. """
+    def __init__(self, config: Config, base_path: str, underlying: Dict,
+                 frame: np.ndarray) -> None:
+        super().__init__(config, base_path, underlying)
+        self.frame = frame
+
+    def load_image(self, as_nparray=True):
+        if as_nparray:
+            return self.frame
+        return Image.fromarray(self.frame.squeeze())
+
+
+class CachedTubDataset(TubDataset):
+    """ TubDataset which reads its records from a frame cache. """
+    def __init__(self, config: Config, frame_cache: FrameCache,
+                 seq_size: int = 0) -> None:
+        self.config = config
+        self.frame_cache = frame_cache
+        self.tub_paths = frame_cache.tub_paths
+        self.tubs = []
+        self.records = list()
+        self.train_filter = getattr(config, 'TRAIN_FILTER', None)
+        self.seq_size = seq_size
+
+    def read_records(self) -> Iterator[TubRecord]:
+        logger.info(f'Loading records from frame cache '
+                    f'{self.frame_cache.cache_dir}')
+        frames = self.frame_cache.frames
+        for rec, frame in zip(self.frame_cache.records, frames):
+            yield CachedTubRecord(self.config, rec['base_path'],
+                                  rec['underlying'], frame)
+
+
+def apply_overrides(cfg: Config, run: Dict[str, Any]) -> Config:
+    """ Sets all upper case entries of the run specification in the
+        config. """
+    for key, value in run.items():
+        if key.isupper():
+            setattr(cfg, key, value)
+    return cfg
+
+
+def _train_run(task: Tuple) -> Optional[Dict]:
+    """ Trains a single sweep configuration, runs in a worker process. """
+    config_path, myconfig, run, cache_dir, tub_paths, model_path, \
+        model_num, comment, split = task
+    from donkeycar.pipeline.training import train_model
+    try:
+        cfg = apply_overrides(load_config(config_path, myconfig), run)
+        dataset = CachedTubDataset(cfg, FrameCache(cache_dir))
+        _, entry = train_model(cfg, tub_paths, model_path, model_num,
+                               run.get('type'), run.get('transfer'),
+                               run.get('comment', comment), dataset=dataset,
+                               split=split)
+        return entry
+    except Exception as e:
+        logger.error(f'Training of {model_path} with {run} failed: {e}')
+        return None
+
+
+def split_runs(cfg: Config, runs: List[Dict[str, Any]],
+               frame_cache: FrameCache) -> List[Assignments]:
+    """
+    Splits the records once for every combination of TRAIN_TEST_SPLIT and
+    TRAIN_SPLIT_BLOCK of the runs, so the worker processes never write the
+    split files of the tubs. Only the split of the sweep's own config is
+    read from and saved to the tubs, the splits of runs which change the
+    parameters are made from the block hashes alone.
+
+    :return:    the assignments of each run
+    """
+    # all records get assigned, so runs with other filters find theirs
+    dataset = CachedTubDataset(cfg, frame_cache)
+    dataset.train_filter = None
+    records = dataset.get_records()
+    keys = ('TRAIN_TEST_SPLIT', 'TRAIN_SPLIT_BLOCK')
+    base = tuple(getattr(cfg, k, None) for k in keys)
+    splits: Dict[Tuple, Assignments] = {}
+    result = []
+    for run in runs:
+        run_cfg = apply_overrides(copy(cfg), run)
+        params = tuple(getattr(run_cfg, k, None) for k in keys)
+        if params not in splits:
+            splits[params] = assignments_by_config(
+                run_cfg, records, persist=params == base)
+        result.append(splits[params])
+    return result
+
+
+def sweep(config_path: str, myconfig: str, tub_paths: str,
+          runs: List[Dict[str, Any]], processes: int = 1,
+          cache_dir: str = None, comment: str = None) -> List[Dict]:
+    """
+    Trains several configurations against a dataset which is read and
+    decoded only once.
+
+    :param config_path: path of config.py
+    :param myconfig:    file name of myconfig.py
+    :param tub_paths:   comma separated tub paths
+    :param runs:        list of run specifications. Each is a dictionary of
+                        config overrides in upper case, like 'ROI_CROP_TOP'
+                        or 'AUGMENTATIONS', and the optional lower case keys
+                        'type', 'transfer' and 'comment'.
+    :param processes:   number of trainings running concurrently, with 1 the
+                        runs are trained back to back. Each run gets its own
+                        process.
+    :param cache_dir:   directory of the frame cache, a cache of the same
+                        tubs and image size in there is reused. If not
+                        given a temporary directory is used and removed
+                        afterwards.
+    :param comment:     comment for the model database if the run does not
+                        have its own
+    :return:            list of the model database entries of the
+                        successful runs
+    """
+    cfg = load_config(config_path, myconfig)
+    for run in runs:
+        changed = [k for k in IMAGE_KEYS if k in run
+                   and run[k] != getattr(cfg, k)]
+        if changed:
+            raise ValueError(f'Sweep run {run} must not change {changed}')
+    all_tub_paths = [os.path.expanduser(tub) for tub in tub_paths.split(',')]
+    tmp_dir = None
+    if cache_dir is None:
+        tmp_dir = cache_dir = tempfile.mkdtemp(prefix='donkey_sweep_')
+    try:
+        frame_cache = FrameCache.create(cfg, all_tub_paths, cache_dir)
+        splits = split_runs(cfg, runs, frame_cache)
+        database = PilotDatabase(cfg)
+        tasks = []
+        for i, (run, split) in enumerate(zip(runs, splits)):
+            model_path, model_num = database.generate_model_name(offset=i)
+            tasks.append((config_path, myconfig, run, cache_dir, tub_paths,
+                          model_path, model_num, comment, split))
+        # use fresh processes so every run has its own tensorflow state
+        ctx = multiprocessing.get_context('spawn')
+        entries = []
+        with ctx.Pool(processes=processes, maxtasksperchild=1) as pool:
+            for entry in pool.imap(_train_run, tasks):
+                if entry is not None:
+                    database.add_entry(entry)
+                    database.write()
+                    entries.append(entry)
+        logger.info(f'Sweep finished, {len(entries)} of {len(runs)} runs '
+                    f'succeeded')
+        return entries
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -1,22 +1,32 @@
+import logging
 import math
 import os
-from time import time
-from typing import List, Dict, Union, Tuple
+import random
+from contextlib import nullcontext
+from itertools import islice
+from time import time, perf_counter
+from typing import Any, List, Dict, Optional, Union, Tuple
 
 from tensorflow.python.keras.models import load_model
 
 from donkeycar.config import Config
 from donkeycar.parts.keras import KerasPilot
-from donkeycar.parts.interpreter import keras_model_to_tflite, \
+from donkeycar.parts.interpreter import keras_model_to_tflite, TfLite, \
     saved_model_to_tensor_rt
 from donkeycar.pipeline.database import PilotDatabase
 from donkeycar.pipeline.sequence import TubRecord, TubSequence, TfmIterator
-from donkeycar.pipeline.types import TubDataset
+from donkeycar.pipeline.types import TubDataset, IncrementalTubDataset
 from donkeycar.pipeline.augmentations import ImageAugmentation
-from donkeycar.utils import get_model_by_type, normalize_image, train_test_split
+from donkeycar.pipeline.profiler import PipelineProfiler, STEP, \
+    profile_batches
+from donkeycar.pipeline.shards import ShardSequence, load_manifest
+from donkeycar.pipeline.split import Assignments, split_by_config
+from donkeycar.utils import get_model_by_type, normalize_image
 import tensorflow as tf
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
 
 class BatchSequence(object):
     """
@@ -28,7 +38,8 @@ class BatchSequence(object):
                  model: KerasPilot,
                  config: Config,
                  records: List[TubRecord],
-                 is_train: bool) -> None:
+                 is_train: bool,
+                 profiler: Optional[PipelineProfiler] = None) -> None:
         self.model = model
         self.config = config
         self.sequence = TubSequence(records)
@@ -36,52 +47,331 @@ class BatchSequence(object):
         self.is_train = is_train
         self.augmentation = ImageAugmentation(config, 'AUGMENTATIONS')
         self.transformation = ImageAugmentation(config, 'TRANSFORMATIONS')
+        self.profiler = profiler
+        self._x_start = 0.0
         self.pipeline = self._create_pipeline()
 
     def __len__(self) -> int:
         return math.ceil(len(self.pipeline) / self.batch_size)
 
+    def _time(self, stage: str, count: int = 1):
+        """ Times the stage if profiling, otherwise does nothing """
+        return self.profiler.time(stage, count) if self.profiler \
+            else nullcontext()
+
     def image_processor(self, img_arr):
-        """ Transforms the image and augments it if in training. We are not
-        calling the normalisation here, because then the normalised images
-        would get cached in the TubRecord, and they are 8 times larger (as
-        they are 64bit floats and not uint8) """
+        """ Only times the decoding. The transformations, augmentations and
+        the normalisation are applied to whole batches in process_images,
+        hence the images get cached in the TubRecord as decoded uint8 arrays
+        and are augmented differently in every epoch. """
         assert img_arr.dtype == np.uint8, \
             f"image_processor requires uint8 array but not {img_arr.dtype}"
-        img_arr = self.transformation.run(img_arr)
-        if self.is_train:
-            img_arr = self.augmentation.run(img_arr)
-
+        # the processor is called right after the image got decoded
+        if self.profiler:
+            self.profiler.add('  decode', perf_counter() - self._x_start)
         return img_arr
 
+    def process_images(self, images: np.ndarray) -> np.ndarray:
+        """
+        Transforms, augments if in training, and normalises a batch of
+        images. Sequence models have several images per record, these are
+        processed as one batch of frames.
+
+        :param images:  uint8 array of shape (N, ..., H, W, C)
+        :return:        float64 [0,1] array of the same shape
+        """
+        frames = images.reshape((-1,) + images.shape[-3:])
+        with self._time('process images', len(images)):
+            with self._time('  transformations', len(images)):
+                transformed = self.transformation.augment_batch(frames)
+            if self.is_train:
+                # the transformations copy the batch, then the augmentations
+                # can work in place
+                with self._time('  augmentations', len(images)):
+                    transformed = self.augmentation.augment_batch(
+                        transformed, in_place=transformed is not frames)
+            with self._time('  normalize', len(images)):
+                return normalize_image(transformed).reshape(images.shape)
+
     def _create_pipeline(self) -> TfmIterator:
         """ This can be overridden if more complicated pipelines are
             required """
         # 1. Initialise TubRecord -> x, y transformations
         def get_x(record: TubRecord) -> Dict[str, Union[float, np.ndarray]]:
             """ Extracting x from record for training"""
-            out_dict = self.model.x_transform(record, self.image_processor)
-            # apply the normalisation here on the fly to go from uint8 -> float
-            out_dict['img_in'] = normalize_image(out_dict['img_in'])
-            return out_dict
-
-        def get_y(record: TubRecord) -> Dict[str, Union[float, np.ndarray]]:
-            """ Extracting y from record for training """
-            y = self.model.y_transform(record)
+            self._x_start = perf_counter()
+            with self._time('x_transform'):
+                return self.model.x_transform(record, self.image_processor)
+
+        def get_y(y: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+            """ The labels don't change between epochs, they are created
+                for all records at once """
             return y
 
-        # 2. Build pipeline using the transformations
-        pipeline = self.sequence.build_pipeline(x_transform=get_x,
-                                                y_transform=get_y)
+        # 2. Build pipeline of the records and their labels using the
+        # transformations
+        records = self.sequence.records
+        labels = [{}] * len(records)
+        if records:
+            start = perf_counter()
+            ys = self.model.y_transform_batch(records)
+            if self.profiler:
+                self.profiler.add_setup('y_transform', perf_counter() - start,
+                                        count=len(records))
+            labels = [dict(zip(ys, values)) for values in zip(*ys.values())]
+        pipeline = TubSequence(list(zip(records, labels))).build_pipeline(
+            x_transform=get_x, y_transform=get_y)
         return pipeline
 
     def create_tf_data(self) -> tf.data.Dataset:
         """ Assembles the tf data pipeline """
+        def generator():
+            if self.profiler:
+                return self.profiler.iterate(self.pipeline)
+            return self.pipeline
+
+        def process(x, y):
+            img = tf.numpy_function(self.process_images, [x['img_in']],
+                                    tf.float64)
+            img.set_shape(x['img_in'].shape)
+            return dict(x, img_in=img), y
+
+        # the generator hands out the decoded uint8 images, they are
+        # transformed, augmented and normalised per batch
+        output_types = self.model.output_types()
+        output_types[0]['img_in'] = tf.uint8
         dataset = tf.data.Dataset.from_generator(
-            generator=lambda: self.pipeline,
-            output_types=self.model.output_types(),
+            generator=generator,
+            output_types=output_types,
             output_shapes=self.model.output_shapes())
-        return dataset.repeat().batch(self.batch_size)
+        return dataset.repeat().batch(self.batch_size).map(process)
+
+
+class ProfilerCallback(tf.keras.callbacks.Callback):
+    """ Times the train steps into the profiler and prints the report at
+        the end of each epoch. """
+    def __init__(self, profiler: PipelineProfiler) -> None:
+        super().__init__()
+        self.profiler = profiler
+        self.batch_start = 0.0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.profiler.reset()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start = perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.profiler.add(STEP, perf_counter() - self.batch_start)
+
+    def on_epoch_end(self, epoch, logs=None):
+        print(f'Epoch {epoch + 1}\n{self.profiler.report()}')
+
+
+def create_pipeline(cfg: Config, kl: KerasPilot, model_type: str,
+                    records: List[TubRecord], is_train: bool,
+                    profiler: Optional[PipelineProfiler] = None) \
+        -> Tuple[Any, int]:
+    """
+    Creates the batched input pipeline of the records for the model.
+
+    :param cfg:         donkey config
+    :param kl:          the model
+    :param model_type:  model type
+    :param records:     training or validation records
+    :param is_train:    if augmentations are applied
+    :param profiler:    optional profiler timing the pipeline stages
+    :return:            tuple of the tf.data.Dataset, or the torch dataset
+                        for fastai models, and the number of steps per epoch
+    """
+    if 'fastai_' in model_type:
+        from donkeycar.parts.pytorch.torch_data \
+            import TorchTubDataset, get_default_transform
+        transform = get_default_transform(resize=False)
+        dataset = TorchTubDataset(cfg, records, transform=transform,
+                                  profiler=profiler)
+        return dataset, len(records)
+    pipe = BatchSequence(kl, cfg, records, is_train=is_train,
+                         profiler=profiler)
+    dataset = pipe.create_tf_data().prefetch(tf.data.experimental.AUTOTUNE)
+    return dataset, len(pipe)
+
+
+def benchmark_pipeline(cfg: Config, tub_paths: str, model_type: str = None,
+                       num_batches: int = 100, is_train: bool = True) \
+        -> Dict[str, Any]:
+    """
+    Runs the training input pipeline without the model and prints the
+    stage-by-stage profile.
+
+    :param cfg:         donkey config
+    :param tub_paths:   comma separated tub paths
+    :param model_type:  model type, defaults to cfg.DEFAULT_MODEL_TYPE
+    :param num_batches: number of batches to pull
+    :param is_train:    if augmentations are applied
+    :return:            dictionary of the benchmark results
+    """
+    if model_type is None:
+        model_type = cfg.DEFAULT_MODEL_TYPE
+    # the model is only needed for the x and y transformations
+    kl = get_model_by_type(model_type, cfg)
+    all_tub_paths = [os.path.expanduser(tub) for tub in tub_paths.split(',')]
+    start = perf_counter()
+    dataset = TubDataset(config=cfg, tub_paths=all_tub_paths,
+                         seq_size=kl.seq_size())
+    records = dataset.get_records()
+    read_time = perf_counter() - start
+    print(f'Read {len(records)} records in {read_time:.2f}s')
+
+    profiler = PipelineProfiler('input pipeline')
+    data, _ = create_pipeline(cfg, kl, model_type, records, is_train,
+                              profiler)
+    if 'fastai_' in model_type:
+        from torch.utils.data import DataLoader
+        from donkeycar.parts.pytorch.torch_data import data_loader_kwargs
+        data = DataLoader(data, batch_size=cfg.BATCH_SIZE,
+                          **data_loader_kwargs(cfg))
+    waits = profile_batches(data, num_batches, profiler)
+    report = profiler.report()
+    print(report)
+    # the first batch includes the start up of the pipeline
+    steady = np.array(waits[1:] or waits)
+    results = {
+        'model_type': model_type,
+        'records': len(records),
+        'read_records_s': read_time,
+        'batches': len(waits),
+        'batch_size': cfg.BATCH_SIZE,
+        'first_batch_s': waits[0] if waits else None,
+        'batch_mean_s': float(steady.mean()) if steady.size else None,
+        'batch_p95_s': float(np.percentile(steady, 95))
+        if steady.size else None,
+        'records_per_s': cfg.BATCH_SIZE / float(steady.mean())
+        if steady.size and steady.mean() > 0 else None,
+        'report': report
+    }
+    print(f'Batch of {cfg.BATCH_SIZE}: first {results["first_batch_s"]:.3f}s'
+          f', mean {results["batch_mean_s"]:.3f}s, '
+          f'p95 {results["batch_p95_s"]:.3f}s, '
+          f'{results["records_per_s"]:.1f} records/s')
+    return results
+
+
+def sample_inputs(cfg: Config, kl: KerasPilot, records: List[TubRecord],
+                  num: int) -> List[Dict[str, np.ndarray]]:
+    """ Runs a random sample of the records through the transformations
+        and the normalisation, but not the augmentations, into model
+        inputs. """
+    sample = random.sample(records, min(num, len(records)))
+    pipe = BatchSequence(kl, cfg, sample, is_train=False)
+    inputs = []
+    for x, _ in pipe.pipeline:
+        x['img_in'] = pipe.process_images(x['img_in'][np.newaxis])[0]
+        inputs.append(x)
+    return inputs
+
+
+def evaluate_outputs(outputs: List[np.ndarray],
+                     labels: List[np.ndarray]) -> List[float]:
+    """
+    :param outputs: model outputs of a batch, one array per output
+    :param labels:  labels of the batch in the same order
+    :return:        per output the accuracy if the label is one hot encoded,
+                    otherwise the mean absolute error
+    """
+    scores = []
+    for out, label in zip(outputs, labels):
+        label = label.reshape(len(label), -1)
+        out = out.reshape(len(out), -1)
+        if label.shape[1] > 1:
+            scores.append(float(np.mean(np.argmax(out, axis=1)
+                                        == np.argmax(label, axis=1))))
+        else:
+            scores.append(float(np.mean(np.abs(out - label))))
+    return scores
+
+
+def create_int8_tflite(cfg: Config, kl: KerasPilot, model_path: str,
+                       tflite_path: str, training_records: List[TubRecord],
+                       validation_records: List[TubRecord]) \
+        -> Optional[Dict[str, Any]]:
+    """
+    Converts the model into a fully int8 quantised tflite model, calibrated
+    on a sample of the training records, and compares the float and the
+    int8 model on the validation records against their labels.
+
+    :param cfg:                 donkey config, TF_LITE_INT8_SAMPLES sets the
+                                size of the calibration sample
+    :param kl:                  the trained model
+    :param model_path:          path of the saved keras model
+    :param tflite_path:         path of the int8 tflite model
+    :param training_records:    records for calibration
+    :param validation_records:  records for the evaluation
+    :return:                    dictionary of the metric of each output,
+                                accuracy for categorical outputs and mean
+                                absolute error otherwise, for the float and
+                                the int8 model and their difference, or None
+                                if the conversion failed
+    """
+    num = getattr(cfg, 'TF_LITE_INT8_SAMPLES', 200)
+    model = tf.keras.models.load_model(model_path, compile=False)
+    input_names = model.input_names
+    calibration = sample_inputs(cfg, kl, training_records, num)
+
+    # samples are keyed by input name, as the converter does not keep the
+    # input order of the keras model
+    def data_gen():
+        for x in calibration:
+            yield {name: np.expand_dims(x[name], 0).astype(np.float32)
+                   for name in input_names}
+
+    try:
+        keras_model_to_tflite(model_path, tflite_path, data_gen)
+    except Exception as e:
+        logger.error(f'Int8 tflite conversion failed because: {e}')
+        return None
+
+    int8 = TfLite()
+    int8.load(tflite_path)
+    pipe = BatchSequence(kl, cfg, validation_records, is_train=False)
+    scores = {'float': [], 'int8': []}
+    sizes = []
+    # the pipeline hands out a new iterator on every iter() call
+    records = (xy for xy in pipe.pipeline)
+    while True:
+        # every validation record once, in batches of the training size
+        chunk = list(islice(records, pipe.batch_size))
+        if not chunk:
+            break
+        xs, ys = zip(*chunk)
+        batch = {k: np.stack([x[k] for x in xs]) for k in input_names}
+        batch['img_in'] = pipe.process_images(batch['img_in'])
+        batch = {k: v.astype(np.float32) for k, v in batch.items()}
+        labels = [np.stack([y[name] for y in ys])
+                  for name in model.output_names]
+        for name, out in (('float', model.predict_on_batch(batch)),
+                          ('int8', int8.predict_batch(batch))):
+            if not isinstance(out, list):
+                out = [out]
+            scores[name].append(evaluate_outputs(out, labels))
+        sizes.append(len(labels[0]))
+    if not sizes:
+        logger.warning('No validation records to evaluate the int8 model')
+        return None
+    # average over the batches weighted by their size
+    result = {'records': int(np.sum(sizes))}
+    for name, batch_scores in scores.items():
+        result[name] = np.average(batch_scores, axis=0,
+                                  weights=sizes).tolist()
+    result['metric'] = ['accuracy' if np.prod(shape[1:]) > 1 else 'mae'
+                        for shape in (o.shape for o in model.outputs)]
+    result['delta'] = [i - f for f, i in zip(result['float'],
+                                             result['int8'])]
+    print(f'Int8 tflite {tflite_path} on {result["records"]} validation '
+          f'records, {result["metric"]} per output {model.output_names}: '
+          f'float {result["float"]}, int8 {result["int8"]}, delta '
+          f'{result["delta"]}')
+    return result
 
 
 def get_model_train_details(database: PilotDatabase, model: str = None) \
@@ -94,16 +384,115 @@ def get_model_train_details(database: PilotDatabase, model: str = None) \
 
 
 def train(cfg: Config, tub_paths: str, model: str = None,
-          model_type: str = None, transfer: str = None, comment: str = None) \
-        -> tf.keras.callbacks.History:
+          model_type: str = None, transfer: str = None, comment: str = None,
+          shards: str = None) -> tf.keras.callbacks.History:
     """
-    Train the model
+    Train the model, either from the tubs or from the shards exported with
+    'donkey tubexport'
     """
     database = PilotDatabase(cfg)
-    if model_type is None:
-        model_type = cfg.DEFAULT_MODEL_TYPE
     model_path, model_num = \
         get_model_train_details(database, model)
+    history, database_entry = train_model(cfg, tub_paths, model_path,
+                                          model_num, model_type, transfer,
+                                          comment, shards=shards)
+    database.add_entry(database_entry)
+    database.write()
+
+    return history
+
+
+def train_incremental(cfg: Config, tub_paths: str, base: str = None,
+                      model: str = None, model_type: str = None,
+                      comment: str = None) \
+        -> Optional[tf.keras.callbacks.History]:
+    """
+    Fine-tune an existing model of the model database only on the records of
+    sessions it has not been trained on yet, plus a replay sample of the
+    known sessions of size cfg.INCREMENTAL_REPLAY_RATIO times the number of
+    new records.
+
+    :param cfg:         donkey config
+    :param tub_paths:   comma separated tub paths
+    :param base:        name or path of the model to start from, defaults to
+                        the latest model in the database
+    :param model:       output model path, generated if not given
+    :param model_type:  model type, defaults to cfg.DEFAULT_MODEL_TYPE
+    :param comment:     optional comment for the model database
+    :return:            training history or None if there are no new sessions
+    """
+    database = PilotDatabase(cfg)
+    base_name = os.path.splitext(os.path.basename(base))[0] if base else None
+    entry = database.get_entry(base_name)
+    if entry is None:
+        raise ValueError(f'Model {base or "to start from"} not found in '
+                         f'database {database.path}')
+    if base and os.path.exists(base):
+        base_path = base
+    else:
+        base_path = os.path.join(cfg.MODELS_PATH, entry['Name'] + '.h5')
+    known_sessions = entry.get('Sessions')
+    if known_sessions is None:
+        logger.warning(f'Model {entry["Name"]} has no session information, '
+                       f'all sessions will be treated as new')
+        known_sessions = {}
+    all_tub_paths = [os.path.expanduser(tub) for tub in tub_paths.split(',')]
+    dataset = IncrementalTubDataset(
+        cfg, all_tub_paths, known_sessions,
+        replay_ratio=getattr(cfg, 'INCREMENTAL_REPLAY_RATIO', 0.5))
+    new_sessions = dataset.new_sessions()
+    if not new_sessions:
+        logger.warning(f'No new sessions found in {tub_paths} since model '
+                       f'{entry["Name"]}, skipping training')
+        return None
+    logger.info(f'Fine-tuning {entry["Name"]} on new sessions '
+                f'{new_sessions}')
+    model_path, model_num = get_model_train_details(database, model)
+    history, database_entry = train_model(
+        cfg, tub_paths, model_path, model_num, model_type, base_path,
+        comment, dataset=dataset)
+    database.add_entry(database_entry)
+    database.write()
+    return history
+
+
+def train_model(cfg: Config, tub_paths: str, model_path: str,
+                model_num: int, model_type: str = None, transfer: str = None,
+                comment: str = None, dataset: Optional[TubDataset] = None,
+                shards: str = None, split: Optional[Assignments] = None) \
+        -> Tuple[tf.keras.callbacks.History, Dict]:
+    """
+    Train the model and return the training history and the model database
+    entry without writing it.
+
+    :param cfg:         donkey config
+    :param tub_paths:   comma separated tub paths
+    :param model_path:  path of the model to be saved
+    :param model_num:   number of the model in the model database
+    :param model_type:  model type, defaults to cfg.DEFAULT_MODEL_TYPE
+    :param transfer:    optional model to initialise the weights from
+    :param comment:     optional comment for the model database
+    :param dataset:     optional dataset, if not given it will be read from
+                        the tub paths. Its sequence size is set from the
+                        model.
+    :param shards:      optional directory of shards exported with
+                        'donkey tubexport' to train from instead of the tubs
+    :param split:       optional train / validation assignments of the
+                        records, if given the split is not read from or
+                        written to the tubs
+    :return:            tuple of training history and database entry
+    """
+    manifest = None
+    if shards:
+        manifest = load_manifest(shards)
+        if model_type is None:
+            model_type = manifest['model_type']
+        elif model_type != manifest['model_type']:
+            raise ValueError(f"Shards in {shards} were exported for model "
+                             f"type {manifest['model_type']} not {model_type}")
+        tub_paths = manifest['tub_paths']
+    if model_type is None:
+        model_type = cfg.DEFAULT_MODEL_TYPE
 
     base_path = os.path.splitext(model_path)[0]
     kl = get_model_by_type(model_type, cfg)
@@ -112,39 +501,55 @@ def train(cfg: Config, tub_paths: str, model: str = None,
     if cfg.PRINT_MODEL_SUMMARY:
         print(kl.interpreter.summary())
 
-    tubs = tub_paths.split(',')
-    all_tub_paths = [os.path.expanduser(tub) for tub in tubs]
-    dataset = TubDataset(config=cfg, tub_paths=all_tub_paths,
-                         seq_size=kl.seq_size())
-    training_records, validation_records \
-        = train_test_split(dataset.get_records(), shuffle=True,
-                           test_size=(1. - cfg.TRAIN_TEST_SPLIT))
-    print(f'Records # Training {len(training_records)}')
-    print(f'Records # Validation {len(validation_records)}')
-
-    # We need augmentation in validation when using crop / trapeze
-
-    if 'fastai_' in model_type:
-        from donkeycar.parts.pytorch.torch_data \
-            import TorchTubDataset, get_default_transform
-        transform = get_default_transform(resize=False)
-        dataset_train = TorchTubDataset(cfg, training_records, transform=transform)
-        dataset_validate = TorchTubDataset(cfg, validation_records, transform=transform)
-        train_size = len(training_records)
-        val_size = len(validation_records)
-    else:
-        training_pipe = BatchSequence(kl, cfg, training_records, is_train=True)
-        validation_pipe = BatchSequence(kl, cfg, validation_records, is_train=False)
+    profiler = None
+    if manifest:
+        training_pipe = ShardSequence(kl, cfg, shards, True, manifest)
+        validation_pipe = ShardSequence(kl, cfg, shards, False, manifest)
+        print(f'Records # Training {training_pipe.num_records}')
+        print(f'Records # Validation {validation_pipe.num_records}')
         tune = tf.data.experimental.AUTOTUNE
         dataset_train = training_pipe.create_tf_data().prefetch(tune)
         dataset_validate = validation_pipe.create_tf_data().prefetch(tune)
-
         train_size = len(training_pipe)
         val_size = len(validation_pipe)
+        sessions = manifest['sessions']
+        training_records = validation_records = None
+    else:
+        if dataset is None:
+            tubs = tub_paths.split(',')
+            all_tub_paths = [os.path.expanduser(tub) for tub in tubs]
+            dataset = TubDataset(config=cfg, tub_paths=all_tub_paths,
+                                 seq_size=kl.seq_size())
+        else:
+            dataset.seq_size = kl.seq_size()
+        sessions = dataset.sessions()
+        training_records, validation_records \
+            = split_by_config(cfg, dataset.get_records(), split)
+        print(f'Records # Training {len(training_records)}')
+        print(f'Records # Validation {len(validation_records)}')
+
+        # We need augmentation in validation when using crop / trapeze
+        profiler = PipelineProfiler('training pipeline') \
+            if getattr(cfg, 'PROFILE_PIPELINE', False) else None
+        dataset_train, train_size = create_pipeline(
+            cfg, kl, model_type, training_records, is_train=True,
+            profiler=profiler)
+        dataset_validate, val_size = create_pipeline(
+            cfg, kl, model_type, validation_records, is_train=False)
 
     assert val_size > 0, "Not enough validation data, decrease the batch " \
                          "size or add more data."
 
+    train_kwargs = {}
+    if 'fastai_' not in model_type:
+        train_kwargs.update(
+            mixed_precision=getattr(cfg, 'MIXED_PRECISION', None),
+            jit_compile=getattr(cfg, 'JIT_COMPILE', False),
+            steps_per_execution=getattr(cfg, 'STEPS_PER_EXECUTION', 1))
+        # the torch datasets print their profile by themselves
+        if profiler:
+            train_kwargs['callbacks'] = [ProfilerCallback(profiler)]
+
     history = kl.train(model_path=model_path,
                        train_data=dataset_train,
                        train_steps=train_size,
@@ -155,12 +560,26 @@ def train(cfg: Config, tub_paths: str, model: str = None,
                        verbose=cfg.VERBOSE_TRAIN,
                        min_delta=cfg.MIN_DELTA,
                        patience=cfg.EARLY_STOP_PATIENCE,
-                       show_plot=cfg.SHOW_PLOT)
+                       show_plot=cfg.SHOW_PLOT,
+                       **train_kwargs)
 
     if getattr(cfg, 'CREATE_TF_LITE', True):
         tf_lite_model_path = f'{base_path}.tflite'
         keras_model_to_tflite(model_path, tf_lite_model_path)
 
+    if 'fastai_' in model_type and getattr(cfg, 'CREATE_TORCH_SCRIPT', True):
+        kl.export_torchscript(f'{base_path}.pt')
+
+    int8_eval = None
+    if getattr(cfg, 'CREATE_TF_LITE_INT8', False):
+        if training_records is None or 'fastai_' in model_type:
+            logger.warning('Int8 tflite conversion requires keras models '
+                           'trained from tubs')
+        else:
+            int8_eval = create_int8_tflite(
+                cfg, kl, model_path, f'{base_path}.int8.tflite',
+                training_records, validation_records)
+
     if getattr(cfg, 'CREATE_TENSOR_RT', False):
         # load h5 (ie. keras) model
         model_rt = load_model(model_path)
@@ -178,9 +597,8 @@ def train(cfg: Config, tub_paths: str, model: str = None,
         'History': history,
         'Transfer': os.path.basename(transfer) if transfer else None,
         'Comment': comment,
-        'Config': str(cfg)
+        'Config': str(cfg),
+        'Sessions': sessions,
+        'Int8': int8_eval
     }
-    database.add_entry(database_entry)
-    database.write()
-
-    return history
\ No newline at end of file
+    return history, database_entry
\ No newline at end of file
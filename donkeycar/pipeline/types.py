@@ -1,8 +1,10 @@
-import copy
 import os
-from typing import Any, List, Optional, TypeVar, Iterator, Iterable
+import random
+from typing import Any, Dict, List, Optional, Set, Tuple, TypeVar, \
+    Iterator, Iterable, Union
 import logging
 import numpy as np
+from PIL import Image
 from donkeycar.config import Config
 from donkeycar.parts.tub_v2 import Tub
 from donkeycar.utils import load_image, load_pil_image
@@ -54,14 +56,7 @@ class TubRecord(object):
         :return:            Image
         """
         if self._image is None:
-            image_path = self.underlying['cam/image_array']
-            full_path = os.path.join(self.base_path, 'images', image_path)
-
-            if as_nparray:
-                _image = load_image(full_path, cfg=self.config)
-            else:
-                # If you just want the raw Image
-                _image = load_pil_image(full_path, cfg=self.config)
+            _image = self.load_image(as_nparray)
             if processor:
                 _image = processor(_image)
             # only cache images if config does not forbid it
@@ -71,6 +66,21 @@ class TubRecord(object):
             _image = self._image
         return _image
 
+    def load_image(self, as_nparray=True) -> Union[np.ndarray, Image.Image]:
+        """
+        Loads the image from disk without processing or caching.
+
+        :param as_nparray:  Whether to return a np array of uint8 or the
+                            result of Image.open()
+        :return:            Image
+        """
+        image_path = self.underlying['cam/image_array']
+        full_path = os.path.join(self.base_path, 'images', image_path)
+        if as_nparray:
+            return load_image(full_path, cfg=self.config)
+        # If you just want the raw Image
+        return load_pil_image(full_path, cfg=self.config)
+
     def __repr__(self) -> str:
         return repr(self.underlying)
 
@@ -90,22 +100,136 @@ class TubDataset(object):
         self.train_filter = getattr(config, 'TRAIN_FILTER', None)
         self.seq_size = seq_size
 
+    def read_records(self) -> Iterator[TubRecord]:
+        """ Reads all records from the tubs, can be overridden to obtain the
+            records from elsewhere. """
+        logger.info(f'Loading tubs from paths {self.tub_paths}')
+        for tub in self.tubs:
+            for underlying in tub:
+                yield TubRecord(self.config, tub.base_path, underlying)
+
     def get_records(self):
         if not self.records:
-            logger.info(f'Loading tubs from paths {self.tub_paths}')
-            for tub in self.tubs:
-                for underlying in tub:
-                    record = TubRecord(self.config, tub.base_path, underlying)
-                    if not self.train_filter or self.train_filter(record):
-                        self.records.append(record)
+            for record in self.read_records():
+                if not self.train_filter or self.train_filter(record):
+                    self.records.append(record)
             if self.seq_size > 0:
                 seq = Collator(self.seq_size, self.records)
                 self.records = list(seq)
         return self.records
 
+    def sessions(self) -> Dict[str, List[Optional[str]]]:
+        """
+        Collects the recording sessions of the loaded records, so a model can
+        remember which data it has been trained on.
+
+        :return:    dictionary of tub path to sorted list of session ids
+        """
+        return sessions_to_dict(session_key(record)
+                                for record in self.get_records())
+
+
+def session_key(record: Union[TubRecord, List[TubRecord]]) \
+        -> Tuple[str, Optional[str]]:
+    """ Returns tub path and session id of the record or of the first
+        record of a sequence. Tubs written before sessions were introduced
+        have no session id. """
+    if isinstance(record, list):
+        record = record[0]
+    return os.path.abspath(record.base_path), \
+        record.underlying.get('_session_id')
+
+
+def sessions_to_dict(keys: Iterable[Tuple[str, Optional[str]]]) \
+        -> Dict[str, List[Optional[str]]]:
+    """ Converts (tub path, session id) pairs into a json serialisable
+        dictionary of tub path to sorted list of session ids. """
+    sessions: Dict[str, Set[Optional[str]]] = {}
+    for tub_path, session_id in keys:
+        sessions.setdefault(tub_path, set()).add(session_id)
+    return {tub_path: sorted(ids, key=lambda i: '' if i is None else i)
+            for tub_path, ids in sessions.items()}
+
+
+class IncrementalTubDataset(TubDataset):
+    """
+    Dataset for fine-tuning an existing model. It only contains the records
+    of sessions the model has not been trained on, plus a random replay
+    sample of records of known sessions, so the model does not forget them.
+    """
+
+    def __init__(self, config: Config, tub_paths: List[str],
+                 known_sessions: Dict[str, List[Optional[str]]],
+                 replay_ratio: float = 0.5, seq_size: int = 0) -> None:
+        """
+        :param config:          donkey config
+        :param tub_paths:       list of tub paths
+        :param known_sessions:  dictionary of tub path to session ids the
+                                model has been trained on
+        :param replay_ratio:    number of records from known sessions per
+                                record from new sessions
+        :param seq_size:        sequence size
+        """
+        super().__init__(config, tub_paths, seq_size)
+        self.known = {(os.path.abspath(tub_path), session_id)
+                      for tub_path, ids in known_sessions.items()
+                      for session_id in ids}
+        self.replay_ratio = replay_ratio
+        self.all_sessions: Dict[str, List[Optional[str]]] = {}
+        self.num_new = 0
+        self.num_replay = 0
+
+    def new_sessions(self) -> Dict[str, List[Optional[str]]]:
+        """
+        Finds the sessions which are unknown to the model from the tub
+        manifests, without reading the records.
+
+        :return:    dictionary of tub path to sorted list of new session ids
+        """
+        keys = []
+        for tub in self.tubs:
+            manifest = tub.manifest
+            sessions = manifest.manifest_metadata.get('sessions', {})
+            # opening the tub creates a new session which has no records
+            ids = [i for i in sessions.get('all_full_ids', [])
+                   if i != manifest.session_id] or [None]
+            tub_path = os.path.abspath(tub.base_path)
+            keys += [(tub_path, i) for i in ids
+                     if (tub_path, i) not in self.known]
+        return sessions_to_dict(keys)
+
+    def get_records(self):
+        if not self.records:
+            records = super().get_records()
+            self.all_sessions = sessions_to_dict(session_key(r)
+                                                 for r in records)
+            new, old = [], []
+            for record in records:
+                (old if session_key(record) in self.known else new)\
+                    .append(record)
+            num_replay = min(len(old), round(self.replay_ratio * len(new)))
+            replay = random.sample(old, num_replay) if new else []
+            self.num_new, self.num_replay = len(new), len(replay)
+            logger.info(f'Incremental dataset with {len(new)} new and '
+                        f'{len(replay)} replayed of {len(old)} known records')
+            self.records = new + replay
+        return self.records
+
+    def sessions(self) -> Dict[str, List[Optional[str]]]:
+        """ The model has seen all sessions it was trained on before and
+            all sessions of the current tubs. """
+        self.get_records()
+        return sessions_to_dict(
+            self.known | {(tub_path, session_id)
+                          for tub_path, ids in self.all_sessions.items()
+                          for session_id in ids})
+
 
 class Collator(Iterable[List[TubRecord]]):
-    """" Builds a sequence of continuous records for RNN and similar models. """
+    """" Builds a sequence of continuous records for RNN and similar models.
+    Sequences are computed as integer index windows into the record list,
+    hence overlapping sequences share the same TubRecord objects and
+    therefore also their cached images. """
     def __init__(self, seq_length: int, records: List[TubRecord]):
         """
         :param seq_length:  length of sequence
@@ -113,6 +237,7 @@ class Collator(Iterable[List[TubRecord]]):
         """
         self.records = records
         self.seq_length = seq_length
+        self._indices: Optional[np.ndarray] = None
 
     @staticmethod
     def is_continuous(rec_1: TubRecord, rec_2: TubRecord) -> bool:
@@ -127,20 +252,44 @@ class Collator(Iterable[List[TubRecord]]):
                 and '__empty__' not in rec_2.underlying
         return it_is
 
-    def __iter__(self) -> Iterator[List[TubRecord]]:
-        """ Iterable interface. Returns a generator as Iterator. """
-        it = iter(self.records)
-        for this_record in it:
-            seq = [this_record]
-            seq_it = copy.copy(it)
-            for next_record in seq_it:
-                if self.is_continuous(this_record, next_record) and \
-                        len(seq) < self.seq_length:
-                    seq.append(next_record)
-                    this_record = next_record
-                else:
-                    break
-            if len(seq) == self.seq_length:
-                yield seq
+    def sequence_indices(self) -> np.ndarray:
+        """
+        Computes all windows of continuous records in one vectorised pass.
+        Two neighbouring records are continuous if their '_index' differs by
+        one and neither of them is flagged as '__empty__'. A window is valid
+        if all its neighbouring pairs are continuous.
 
+        :return:    int array of shape (num_sequences, seq_length) holding
+                    the positions of the records of each sequence
+        """
+        if self._indices is None:
+            num = len(self.records)
+            num_windows = num - self.seq_length + 1
+            if self.seq_length < 1 or num_windows < 1:
+                self._indices = np.empty((0, max(self.seq_length, 0)),
+                                         dtype=np.int64)
+                return self._indices
+            index = np.fromiter((r.underlying['_index'] for r in self.records),
+                                dtype=np.int64, count=num)
+            empty = np.fromiter(('__empty__' in r.underlying
+                                 for r in self.records), dtype=bool, count=num)
+            # break[i] is set if record i is not followed by record i+1
+            breaks = (np.diff(index) != 1) | empty[:-1] | empty[1:]
+            # number of breaks before each position, so a window starting
+            # at i is continuous if no break lies in [i, i + seq_length - 1)
+            num_breaks = np.concatenate(([0], np.cumsum(breaks)))
+            last = self.seq_length - 1
+            starts = np.flatnonzero(num_breaks[last:num_windows + last]
+                                    == num_breaks[:num_windows])
+            self._indices = starts[:, np.newaxis] \
+                + np.arange(self.seq_length)[np.newaxis, :]
+        return self._indices
+
+    def __len__(self) -> int:
+        return len(self.sequence_indices())
 
+    def __iter__(self) -> Iterator[List[TubRecord]]:
+        """ Iterable interface. Returns a generator as Iterator. """
+        records = self.records
+        for window in self.sequence_indices().tolist():
+            yield [records[i] for i in window]
@@ -19,7 +19,8 @@ from donkeycar.parts.tub_v2 import TubWriter, TubWiper
 from donkeycar.parts.datastore import TubHandler
 from donkeycar.parts.controller import LocalWebController, RCReceiver
 from donkeycar.parts.actuator import PCA9685, PWMSteering, PWMThrottle
-from donkeycar.pipeline.augmentations import ImageAugmentation
+from donkeycar.pipeline.augmentations import ImageAugmentation, \
+    ImageTransformation
 
 logger = logging.getLogger()
 logging.basicConfig(level=logging.INFO)
@@ -150,10 +151,14 @@ def drive(cfg, model_path=None, model_type=None):
         inputs = ['cam/image_array']
         # Add image transformations like crop or trapezoidal mask
         if hasattr(cfg, 'TRANSFORMATIONS') and cfg.TRANSFORMATIONS:
-            outputs = ['cam/image_array_trans']
-            car.add(ImageAugmentation(cfg, 'TRANSFORMATIONS'),
-                    inputs=inputs, outputs=outputs)
-            inputs = outputs
+            if hasattr(kl, 'set_image_transformation'):
+                # fused into the normalisation of the pilot's input image
+                kl.set_image_transformation(ImageTransformation(cfg))
+            else:
+                outputs = ['cam/image_array_trans']
+                car.add(ImageAugmentation(cfg, 'TRANSFORMATIONS'),
+                        inputs=inputs, outputs=outputs)
+                inputs = outputs
 
         outputs = ['pilot/angle', 'pilot/throttle']
         car.add(kl, inputs=inputs, outputs=outputs, run_condition='run_pilot')
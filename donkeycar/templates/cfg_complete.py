@@ -395,6 +395,8 @@ DEFAULT_AI_FRAMEWORK = 'tensorflow'
 DEFAULT_MODEL_TYPE = 'linear'
 BATCH_SIZE = 128                #how many records to use when doing one pass of gradient decent. Use a smaller number if your gpu is running out of memory.
 TRAIN_TEST_SPLIT = 0.8          #what percent of records to use for training. the remaining used for validation.
+TRAIN_SPLIT_BLOCK = 100         #number of consecutive records which go together into training or validation, so neighbouring frames don't leak into validation. 0 splits by whole sessions
+TRAIN_SPLIT_PERSIST = True      #store the split as split.npz in each tub and reuse it in later trainings
 MAX_EPOCHS = 100                #how many times to visit all records of your data
 SHOW_PLOT = True                #would you like to see a pop up display of final loss?
 VERBOSE_TRAIN = True            #would you like to see a progress bar with text during training?
@@ -407,7 +409,25 @@ LEARNING_RATE = 0.001           #only used when OPTIMIZER specified
 LEARNING_RATE_DECAY = 0.0       #only used when OPTIMIZER specified
 SEND_BEST_MODEL_TO_PI = False   #change to true to automatically send best model during training
 CREATE_TF_LITE = True           # automatically create tflite model in training
+CREATE_TF_LITE_INT8 = False     # also create a fully int8 quantised <model>.int8.tflite model calibrated on training data and report its validation accuracy against the float model
+TF_LITE_INT8_SAMPLES = 200      # number of records used for the int8 calibration
+TFLITE_NUM_THREADS = None       # number of threads of the tflite interpreter when driving a tflite model, None lets tflite decide
+CORAL_DEVICE = None             # Edge TPU used by coral_ model types, like 'usb' or 'pci:0', None takes the first one. Without Edge TPU runtime the model runs on the cpu
+MODEL_WARM_UP_RUNS = 3          # inferences on a test image right after loading a model for driving, so the slow first inferences don't happen in the drive loop, 0 to disable
+MODEL_HOT_SWAP = True           # when the model file changes while driving, load, warm up and check the new model in the background and swap it in, the old model keeps driving meanwhile
+ENSEMBLE_MODELS = []            # list of (model_type, model_path) of further models run together with the model given on the command line, which shares its input image. In cascade mode the command line model should be the cheapest and the last one the most expensive
+ENSEMBLE_MODE = 'cascade'       # 'average' runs all models and averages their outputs, 'cascade' runs the last model only when the others are not confident
+ENSEMBLE_CONFIDENCE = 'entropy' # 'entropy' of the categorical outputs of the cheap models or 'disagreement' between the outputs of at least two cheap models
+ENSEMBLE_CONFIDENCE_THRESHOLD = 0.5  # confidence between 0 and 1 below which the cascade runs the expensive model
 CREATE_TENSOR_RT = False        # automatically create tensorrt model in training
+CREATE_TORCH_SCRIPT = True      # automatically create a TorchScript .pt model with fused image normalisation when training fastai models
+TORCH_NUM_THREADS = None        # number of threads of torch when driving a fastai model, None lets torch decide
+TORCH_NUM_WORKERS = None        # number of data loader worker processes decoding the records in torch training, None uses up to 4 on Linux and 0 on Mac and Windows
+MIXED_PRECISION = None          # keras dtype policy for training, 'mixed_float16' for GPUs or 'mixed_bfloat16' for CPUs with bfloat16 support. The saved model stays float32
+JIT_COMPILE = False             # compile the training step with XLA
+STEPS_PER_EXECUTION = 1         # number of batches run per call of the compiled training function, larger values reduce python overhead for small models
+PROFILE_PIPELINE = False        # print a stage-by-stage timing of the training input pipeline after each epoch
+INCREMENTAL_REPLAY_RATIO = 0.5  # in 'donkey train --incremental', number of records from already trained sessions replayed per record from new sessions
 
 PRUNE_CNN = False               #This will remove weights from your model. The primary goal is to increase performance.
 PRUNE_PERCENT_TARGET = 75       # The desired percentage of pruning.
@@ -646,8 +666,16 @@ BEHAVIOR_LED_COLORS = [(0, 10, 0), (10, 0, 0)]  #RGB tuples 0-100 per chanel
 #to predict the segement of the course, where the course is divided into NUM_LOCATIONS segments.
 TRAIN_LOCALIZER = False
 NUM_LOCATIONS = 10
+
 BUTTON_PRESS_NEW_TUB = False #when enabled, makes it easier to divide our data into one tub per track length if we make a new tub on each X button press.
 
+#Multi head model
+#The 'multihead' model type runs one CNN backbone per frame with a drive head for steering and throttle
+#and optional heads predicting the behavior and the location, trained jointly from the tub labels.
+#The heads need tubs recorded with these labels.
+MULTI_HEAD_BEHAVIOR = False     # add a head classifying the BEHAVIOR_LIST states from 'behavior/one_hot_state_array', output in 'pilot/behavior'
+MULTI_HEAD_LOCATION = False     # add a head classifying the NUM_LOCATIONS segments from 'localizer/location', output in 'pilot/loc'
+
 #DonkeyGym
 #Only on Ubuntu linux, you can use the simulator as a virtual donkey and
 #issue the same python manage.py drive command as usual, but have them control a virtual car.
@@ -684,6 +712,11 @@ AI_LAUNCH_KEEP_ENABLED = False      # when False ( default) you will need to hit
 #Scale the output of the throttle of the ai pilot for all model types.
 AI_THROTTLE_MULT = 1.0              # this multiplier will scale every throttle value for all output from NN models
 
+#Run the ai pilot on its own thread, so inference overlaps with camera, tub writing and web parts
+ASYNC_PILOT = False                 # when True the pilot runs asynchronously and also outputs 'pilot/timestamp', the time of the frame the command was computed from
+ASYNC_PILOT_POLICY = 'latency'      # 'latency' waits up to ASYNC_PILOT_TIMEOUT for the current frame, 'throughput' never waits and uses the result of the previous frame
+ASYNC_PILOT_TIMEOUT = 0.03          # longest wait in seconds for the current frame with the 'latency' policy
+
 #Path following
 PATH_FILENAME = "donkey_path.pkl"   # the path will be saved to this filename
 PATH_SCALE = 5.0                    # the path display will be scaled by this factor in the web page
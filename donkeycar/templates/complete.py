@@ -274,6 +274,15 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
         print('loading model', model_path)
         kl.load(model_path)
         print('finished loading in %s sec.' % (str(time.time() - start)) )
+        # run the first, slow inferences now and not in the drive loop
+        warm_up_runs = getattr(cfg, 'MODEL_WARM_UP_RUNS', 3)
+        if warm_up_runs and hasattr(kl, 'warm_up'):
+            times = kl.warm_up(warm_up_runs)
+            if times:
+                print('ready to steer %.3f sec. after start of loading, first '
+                      'inference took %.1f ms, last %.1f ms'
+                      % (time.time() - start, 1000 * times[0],
+                         1000 * times[-1]))
 
     def load_weights(kl, weights_path):
         start = time.time()
@@ -303,7 +312,71 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
     #
     if model_path:
         # If we have a model, create an appropriate Keras part
-        kl = dk.utils.get_model_by_type(model_type, cfg)
+        ensemble_models = getattr(cfg, 'ENSEMBLE_MODELS', [])
+        #
+        # run further models on the same preprocessed image, either all
+        # of them or in a cascade of cheap and expensive models. They are
+        # loaded once, a model reload only replaces the first pilot.
+        #
+        ensemble_pilots = []
+        for ensemble_type, ensemble_path in ensemble_models:
+            ensemble_kl = dk.utils.get_model_by_type(ensemble_type, cfg)
+            load_model(ensemble_kl, ensemble_path)
+            ensemble_pilots.append(ensemble_kl)
+
+        def create_kl():
+            new_kl = dk.utils.get_model_by_type(model_type, cfg)
+            if not ensemble_pilots:
+                return new_kl
+            from donkeycar.parts.ensemble import EnsemblePilot
+            return EnsemblePilot(
+                [new_kl] + ensemble_pilots, mode=cfg.ENSEMBLE_MODE,
+                confidence=cfg.ENSEMBLE_CONFIDENCE,
+                threshold=cfg.ENSEMBLE_CONFIDENCE_THRESHOLD)
+
+        kl = create_kl()
+
+        #
+        # optionally load new models in the background and swap them in
+        # between two runs, so a model reload never stalls the drive loop
+        #
+        pilot = kl
+        hot_swap = None
+        if getattr(cfg, 'MODEL_HOT_SWAP', False):
+            from donkeycar.parts.model_swap import HotSwapPilot
+
+            def create_pilot():
+                new_kl = create_kl()
+                if hasattr(new_kl, 'set_image_transformation'):
+                    new_kl.set_image_transformation(kl.transformation)
+                return new_kl
+
+            hot_swap = HotSwapPilot(
+                kl, create_pilot,
+                warm_up_runs=getattr(cfg, 'MODEL_WARM_UP_RUNS', 3))
+            pilot = hot_swap
+
+        #
+        # collect model inference outputs
+        #
+        if hasattr(kl, 'output_channels'):
+            # one output per head of a multi head model
+            outputs = kl.output_channels()
+        else:
+            outputs = ['pilot/angle', 'pilot/throttle']
+            if cfg.TRAIN_LOCALIZER:
+                outputs.append("pilot/loc")
+
+        #
+        # optionally run the inference on its own thread, overlapped with
+        # the other parts of the drive loop
+        #
+        async_pilot = getattr(cfg, 'ASYNC_PILOT', False)
+        if async_pilot:
+            from donkeycar.parts.async_pilot import AsyncPilot
+            pilot = AsyncPilot(pilot, policy=cfg.ASYNC_PILOT_POLICY,
+                               timeout=cfg.ASYNC_PILOT_TIMEOUT,
+                               num_outputs=len(outputs))
 
         #
         # get callback function to reload the model
@@ -317,7 +390,10 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
             load_model(kl, model_path)
 
             def reload_model(filename):
-                load_model(kl, filename)
+                if hot_swap:
+                    hot_swap.request_load(filename)
+                else:
+                    load_model(pilot, filename)
 
             model_reload_cb = reload_model
 
@@ -387,23 +463,28 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None,
             inputs = ['cam/image_array']
 
         #
-        # collect model inference outputs
-        #
-        outputs = ['pilot/angle', 'pilot/throttle']
-
-        if cfg.TRAIN_LOCALIZER:
-            outputs.append("pilot/loc")
-
-        #
-        # Add image transformations like crop or trapezoidal mask
+        # Add image transformations like crop or trapezoidal mask. Keras
+        # pilots fuse them into the normalisation of their input image,
+        # otherwise they run as a separate part.
         #
         if hasattr(cfg, 'TRANSFORMATIONS') and cfg.TRANSFORMATIONS:
-            from donkeycar.pipeline.augmentations import ImageAugmentation
-            V.add(ImageAugmentation(cfg, 'TRANSFORMATIONS'),
-                  inputs=['cam/image_array'], outputs=['cam/image_array_trans'])
-            inputs = ['cam/image_array_trans'] + inputs[1:]
-
-        V.add(kl, inputs=inputs, outputs=outputs, run_condition='run_pilot')
+            if hasattr(kl, 'set_image_transformation'):
+                from donkeycar.pipeline.augmentations import \
+                    ImageTransformation
+                kl.set_image_transformation(ImageTransformation(cfg))
+            else:
+                from donkeycar.pipeline.augmentations import \
+                    ImageAugmentation
+                V.add(ImageAugmentation(cfg, 'TRANSFORMATIONS'),
+                      inputs=['cam/image_array'],
+                      outputs=['cam/image_array_trans'])
+                inputs = ['cam/image_array_trans'] + inputs[1:]
+
+        if async_pilot:
+            # time of the frame the pilot outputs were computed from
+            outputs.append('pilot/timestamp')
+        V.add(pilot, inputs=inputs, outputs=outputs, run_condition='run_pilot',
+              threaded=async_pilot)
 
     #
     # Obstacle avoidance based on depth map
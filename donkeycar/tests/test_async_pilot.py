@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from donkeycar.parts.async_pilot import AsyncPilot, LATENCY, THROUGHPUT
+
+
+class SlowPilot:
+    """ Returns the frame it was given as angle after a delay """
+    def __init__(self, delay):
+        self.delay = delay
+
+    def run(self, frame):
+        time.sleep(self.delay)
+        return float(frame), 0.5
+
+
+@pytest.fixture
+def start():
+    pilots = []
+
+    def start_pilot(pilot):
+        pilots.append(pilot)
+        threading.Thread(target=pilot.update, daemon=True).start()
+        return pilot
+
+    yield start_pilot
+    for pilot in pilots:
+        pilot.shutdown()
+
+
+def test_async_pilot_latency(start):
+    pilot = start(AsyncPilot(SlowPilot(0.01), policy=LATENCY, timeout=1.0))
+    for frame in range(5):
+        before = time.time()
+        angle, throttle, timestamp = pilot.run_threaded(frame)
+        assert angle == frame and throttle == 0.5
+        assert before <= timestamp <= time.time()
+    assert pilot.stale == 0
+
+
+def test_async_pilot_latency_timeout(start):
+    pilot = start(AsyncPilot(SlowPilot(0.2), policy=LATENCY, timeout=0.01))
+    # nothing computed yet
+    assert pilot.run_threaded(0) == (None, None, None)
+    time.sleep(0.3)
+    # the result of the last frame is returned when the current one is late
+    angle, _, _ = pilot.run_threaded(1)
+    assert angle == 0
+    assert pilot.stale == 1
+
+
+def test_async_pilot_throughput(start):
+    pilot = start(AsyncPilot(SlowPilot(0.05), policy=THROUGHPUT))
+    start_time = time.time()
+    assert pilot.run_threaded(0) == (None, None, None)
+    # returns immediately while the inference is running
+    assert time.time() - start_time < 0.04
+    time.sleep(0.1)
+    angle, _, timestamp = pilot.run_threaded(1)
+    assert angle == 0 and timestamp < time.time() - 0.05
+    # frames submitted while busy are replaced by newer ones
+    pilot.run_threaded(2)
+    pilot.run_threaded(3)
+    time.sleep(0.15)
+    angle, _, _ = pilot.run_threaded(4)
+    assert angle == 3
+    assert pilot.dropped >= 1
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from donkeycar.config import Config
+from donkeycar.pipeline.augmentations import ImageAugmentation, \
+    ImageTransformation
+from donkeycar.utils import normalize_image
+
+
+@pytest.fixture
+def config() -> Config:
+    cfg = Config()
+    cfg.ROI_CROP_TOP = 45
+    cfg.ROI_CROP_BOTTOM = 0
+    cfg.ROI_CROP_RIGHT = 0
+    cfg.ROI_CROP_LEFT = 0
+    cfg.ROI_TRAPEZE_LL = 0
+    cfg.ROI_TRAPEZE_LR = 160
+    cfg.ROI_TRAPEZE_UL = 20
+    cfg.ROI_TRAPEZE_UR = 140
+    cfg.ROI_TRAPEZE_MIN_Y = 60
+    cfg.ROI_TRAPEZE_MAX_Y = 120
+    cfg.AUG_MULTIPLY_RANGE = (0.5, 3.0)
+    cfg.AUG_BLUR_RANGE = (0.0, 3.0)
+    return cfg
+
+
+def random_batch(n: int = 8, depth: int = 3) -> np.ndarray:
+    return np.random.randint(0, 256, size=(n, 120, 160, depth),
+                             dtype=np.uint8)
+
+
+@pytest.mark.parametrize('depth', [1, 3])
+@pytest.mark.parametrize('key, augs', [
+    ('TRANSFORMATIONS', ['CROP', 'TRAPEZE']),
+    ('AUGMENTATIONS', ['MULTIPLY', 'BLUR'])])
+def test_batch_matches_single_images(config: Config, depth: int, key: str,
+                                     augs: list) -> None:
+    # fixed ranges make the random augmentations deterministic
+    config.AUG_MULTIPLY_RANGE = (1.7, 1.7)
+    config.AUG_BLUR_RANGE = (1.2, 1.2)
+    setattr(config, key, augs)
+    aug = ImageAugmentation(config, key)
+    batch = random_batch(depth=depth)
+    orig = batch.copy()
+    out = aug.augment_batch(batch)
+    assert out.shape == batch.shape and out.dtype == np.uint8
+    # input must not be touched unless in_place is requested
+    assert (batch == orig).all()
+    # the batch gives the same images as the single image interface
+    singles = np.stack([aug.run(img) for img in batch])
+    assert np.array_equal(out, singles)
+    out_in_place = aug.augment_batch(batch, in_place=True)
+    assert out_in_place is batch
+
+
+def test_transformations(config: Config) -> None:
+    config.TRANSFORMATIONS = ['TRAPEZE']
+    aug = ImageAugmentation(config, 'TRANSFORMATIONS')
+    batch = np.full((4, 120, 160, 3), 255, dtype=np.uint8)
+    out = aug.augment_batch(batch)
+    # everything above the trapeze is masked, the bottom centre is not
+    assert (out[:, :config.ROI_TRAPEZE_MIN_Y] == 0).all()
+    assert (out[:, -1, 80] == 255).all()
+
+    config.TRANSFORMATIONS = ['CROP']
+    aug = ImageAugmentation(config, 'TRANSFORMATIONS')
+    batch = np.zeros((4, 120, 160, 3), dtype=np.uint8)
+    batch[:, config.ROI_CROP_TOP:] = 100
+    out = aug.augment_batch(batch)
+    # cropped region gets resized back to the full image
+    assert out.shape == batch.shape
+    assert (out == 100).all()
+
+
+def test_multiply_clips(config: Config) -> None:
+    config.AUG_MULTIPLY_RANGE = (3.0, 3.0)
+    config.AUGMENTATIONS = ['MULTIPLY']
+    aug = ImageAugmentation(config, 'AUGMENTATIONS')
+    batch = np.array([0, 10, 100, 200], dtype=np.uint8).reshape(1, 2, 2, 1)
+    out = aug.augment_batch(batch)
+    assert out.ravel().tolist() == [0, 30, 255, 255]
+
+
+@pytest.mark.parametrize('depth', [1, 3])
+@pytest.mark.parametrize('transformations', [
+    [], ['CROP'], ['TRAPEZE'], ['CROP', 'TRAPEZE'], ['TRAPEZE', 'CROP']])
+def test_fused_transformation(config: Config, depth: int,
+                              transformations: list) -> None:
+    config.TRANSFORMATIONS = transformations
+    aug = ImageAugmentation(config, 'TRANSFORMATIONS')
+    trans = ImageTransformation(config)
+    img = random_batch(n=1, depth=depth)[0]
+    expected = normalize_image(aug.run(img))
+    out = np.empty(img.shape, dtype=np.float32)
+    res = trans.run(img, out=out)
+    assert res is out
+    assert np.allclose(res, expected, atol=1e-6)
+    assert np.allclose(trans.run(img), expected, atol=1e-6)
+
+
+def test_fused_transformation_rejects_augmentations(config: Config) -> None:
+    config.TRANSFORMATIONS = ['CROP', 'MULTIPLY']
+    with pytest.raises(ValueError):
+        ImageTransformation(config)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from donkeycar.parts.ensemble import EnsemblePilot, normalized_entropy
+from donkeycar.parts.interpreter import KerasInterpreter, TfLite, \
+    keras_to_tflite
+from donkeycar.parts.keras import KerasCategorical, KerasLinear, KerasMemory
+from donkeycar.utils import get_test_img
+
+
+def test_normalized_entropy():
+    assert normalized_entropy(np.ones(15) / 15) == pytest.approx(1.0)
+    certain = np.zeros(15)
+    certain[3] = 1.0
+    assert normalized_entropy(certain) == pytest.approx(0.0, abs=1e-6)
+
+
+def test_average_shares_input():
+    # own interpreters, otherwise both pilots share the default one and
+    # with it the same model
+    linear = KerasLinear(interpreter=KerasInterpreter())
+    other = KerasLinear(interpreter=KerasInterpreter())
+    ensemble = EnsemblePilot([linear, other], mode='average')
+    img = get_test_img(linear)
+    angle, throttle = ensemble.run(img)
+    angles, throttles = zip(linear.run(img), other.run(img))
+    assert angles[0] != angles[1]
+    assert angle == pytest.approx(np.mean(angles), abs=1e-6)
+    assert throttle == pytest.approx(np.mean(throttles), abs=1e-6)
+
+
+@pytest.mark.parametrize('threshold', [0.0, 1.01])
+def test_cascade_entropy(threshold):
+    cheap = KerasCategorical()
+    expensive = KerasLinear()
+    ensemble = EnsemblePilot([cheap, expensive], threshold=threshold)
+    img = get_test_img(cheap)
+    for _ in range(3):
+        outputs = ensemble.run(img)
+    if threshold == 0.0:
+        # always confident, expensive pilot never runs
+        assert ensemble.expensive_runs == 0
+        assert outputs == pytest.approx(cheap.run(img))
+    else:
+        assert ensemble.expensive_runs == 3
+        assert outputs == pytest.approx(expensive.run(img))
+
+
+def test_cascade_disagreement_tflite(tmp_path):
+    img = None
+    pilots = []
+    for i in range(3):
+        kl = KerasLinear()
+        path = str(tmp_path / f'model_{i}.tflite')
+        keras_to_tflite(kl.interpreter.model, path)
+        tflite = KerasLinear(interpreter=TfLite())
+        tflite.load(path)
+        pilots.append(tflite)
+        img = get_test_img(tflite)
+    outputs = [p.run(img) for p in pilots]
+    spread = np.max(np.abs(np.subtract(outputs[0], outputs[1],
+                                       dtype=np.float64)))
+    ensemble = EnsemblePilot(pilots, confidence='disagreement',
+                             threshold=1.0 - spread - 1e-6)
+    assert ensemble.run(img) == pytest.approx(
+        np.mean(outputs[:2], axis=0), abs=1e-6)
+    ensemble.threshold = 1.0 - spread + 1e-6
+    assert ensemble.run(img) == pytest.approx(outputs[2], abs=1e-6)
+    assert ensemble.expensive_runs == 1
+
+
+def test_ensemble_rejects_sequence_pilots():
+    with pytest.raises(AssertionError):
+        EnsemblePilot([KerasMemory(), KerasLinear()], mode='average')
+
+
+def test_reloaded_ensemble_shares_pilots():
+    """ An ensemble for a reloaded model reuses the other pilots, its warm
+        up and test inference only run the new first pilot """
+    # the default interpreter argument is one shared instance
+    shared, first, reloaded = \
+        (KerasLinear(interpreter=KerasInterpreter()) for _ in range(3))
+    old = EnsemblePilot([first, shared], mode='average')
+    new = EnsemblePilot([reloaded, shared], mode='average')
+    calls = []
+    predict_into = shared.interpreter.predict_into
+    shared.interpreter.predict_into = \
+        lambda *args: calls.append(1) or predict_into(*args)
+    assert len(new.warm_up(2)) == 2
+    assert np.all(np.isfinite(new.test_inference()))
+    assert not calls
+    old.run(get_test_img(shared))
+    assert len(calls) == 1
@@ -6,11 +6,12 @@ import pytest
 import os
 
 from donkeycar.parts.interpreter import keras_to_tflite, \
-    saved_model_to_tensor_rt, TfLite, TensorRT
+    saved_model_to_tensor_rt, TfLite, TensorRT, Coral
 from donkeycar.parts.keras import *
 from donkeycar.utils import get_test_img
 
 TOLERANCE = 1e-4
+HAVE_TF_TRT = tf.sysconfig.get_build_info().get('is_tensorrt_build', False)
 
 
 @pytest.fixture
@@ -88,5 +89,300 @@ def test_keras_vs_tflite_and_tensorrt(keras_pilot, tmp_dir):
     print(out1, out2, out3)
 
 
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasCategorical])
+def test_train_mixed_precision(keras_pilot, tmp_dir):
+    """ Training in mixed precision keeps float32 heads and saves a float32
+        model """
+    kl = keras_pilot()
+    float_model = kl.interpreter.model
+    clone = clone_with_policy(float_model, 'mixed_bfloat16')
+    for layer in clone.layers[1:]:
+        expected = 'float32' if layer.name in clone.output_names \
+            else 'mixed_bfloat16'
+        assert layer.dtype_policy.name == expected
+    assert clone.outputs[0].dtype == tf.float32
 
+    x_shapes, y_shapes = kl.output_shapes()
+    data = tf.data.Dataset.from_tensor_slices(
+        tuple({k: np.random.uniform(size=(16,) + tuple(s)).astype(np.float32)
+               for k, s in shapes.items()} for shapes in (x_shapes, y_shapes))
+    ).repeat().batch(8)
+    weights = [w.copy() for w in float_model.get_weights()]
+    model_path = os.path.join(tmp_dir, 'mixed.h5')
+    kl.train(model_path, data, 2, 8, data, 1, epochs=1, verbose=0,
+             mixed_precision='mixed_bfloat16', steps_per_execution=2)
+    assert kl.interpreter.model is float_model
+    assert not all(np.array_equal(w0, w1) for w0, w1
+                   in zip(weights, float_model.get_weights()))
+    assert os.listdir(tmp_dir) == ['mixed.h5']
+    loaded = keras_pilot()
+    loaded.load(model_path)
+    assert all(layer.dtype_policy.name == 'float32'
+               for layer in loaded.interpreter.model.layers)
 
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasIMU])
+def test_keras_vs_tflite_int8(keras_pilot, tmp_dir):
+    """ The int8 quantised tflite model gets float inputs quantised and its
+        outputs dequantised and stays close to the keras model """
+    km = keras_pilot()
+    model = km.interpreter.model
+    img = get_test_img(km)
+    imu = np.random.rand(6)
+    args = (img, imu.tolist()) if keras_pilot is KerasIMU else (img, )
+
+    def data_gen():
+        for _ in range(20):
+            inputs = {'img_in': np.random.rand(1, *img.shape),
+                      'imu_in': np.random.rand(1, 6)}
+            yield {name: inputs[name].astype(np.float32)
+                   for name in model.input_names}
+
+    tflite_path = os.path.join(tmp_dir, 'model.int8.tflite')
+    keras_to_tflite(model, tflite_path, data_gen)
+    kl = keras_pilot(interpreter=TfLite())
+    kl.load(tflite_path)
+    assert kl.interpreter.input_details[0]['dtype'] == np.uint8
+    out_keras = km.run(*args)
+    out_int8 = kl.run(*args)
+    assert out_int8 == approx(out_keras, abs=0.05)
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasIMU])
+def test_coral_cpu_fallback(keras_pilot, tmp_dir):
+    """ Without Edge TPU the coral interpreter runs the int8 model on the
+        cpu like tflite, writing the image quantised into the input tensor """
+    km = keras_pilot()
+    model = km.interpreter.model
+
+    def data_gen():
+        for _ in range(20):
+            inputs = {'img_in': np.random.rand(1, *km.input_shape),
+                      'imu_in': np.random.rand(1, 6)}
+            yield {name: inputs[name].astype(np.float32)
+                   for name in model.input_names}
+
+    tflite_path = os.path.join(tmp_dir, 'model.int8.tflite')
+    keras_to_tflite(model, tflite_path, data_gen)
+    kt = keras_pilot(interpreter=TfLite())
+    kt.load(tflite_path)
+    kc = keras_pilot(interpreter=Coral())
+    kc.load(tflite_path)
+    assert not kc.interpreter.on_edge_tpu
+    assert kc.interpreter.img_buffer is not None
+    for _ in range(3):
+        img = get_test_img(km)
+        imu = np.random.rand(6).tolist()
+        other = imu if keras_pilot is KerasIMU else None
+        out_copy = kc.inference(kc.normalize(img),
+                                np.array(other) if other else None)
+        out_coral = kc.run(img, other)
+        assert out_coral == approx(out_copy, abs=TOLERANCE)
+        assert out_coral == approx(kt.run(img, other), abs=TOLERANCE)
+    with pytest.raises((ValueError, OSError)):
+        Coral(fallback=False).load(tflite_path)
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasIMU])
+def test_tflite_zero_copy(keras_pilot, tmp_dir):
+    """ Writing the image straight into the tflite input tensor gives the
+        same outputs as copying it in, also when run repeatedly """
+    km = keras_pilot()
+    tflite_path = os.path.join(tmp_dir, 'model.tflite')
+    keras_to_tflite(km.interpreter.model, tflite_path)
+    kl = keras_pilot(interpreter=TfLite(num_threads=2))
+    kl.load(tflite_path)
+    assert kl.interpreter.img_tensor is not None
+    for _ in range(3):
+        img = get_test_img(km)
+        imu = np.random.rand(6).tolist()
+        other = imu if keras_pilot is KerasIMU else None
+        out_copy = kl.inference(kl.normalize(img),
+                                np.array(other) if other else None)
+        out_zero_copy = kl.run(img, other)
+        assert out_zero_copy == approx(out_copy, abs=TOLERANCE)
+        assert out_zero_copy == approx(km.run(img, other), abs=TOLERANCE)
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasCategorical,
+                                         KerasIMU, KerasMultiHead])
+def test_tflite_output_order(keras_pilot, tmp_dir):
+    """ The tflite outputs come in the order of the keras model outputs, like
+        angle before throttle, also when all outputs have the same shape """
+    km = keras_pilot(interpreter=KerasInterpreter())
+    model = km.interpreter.model
+    # constant outputs which are different for every output
+    for i, name in enumerate(model.output_names):
+        kernel, bias = model.get_layer(name).get_weights()
+        model.get_layer(name).set_weights(
+            [np.zeros_like(kernel), np.arange(bias.size) + 10.0 * i])
+    tflite_path = os.path.join(tmp_dir, 'model.tflite')
+    keras_to_tflite(model, tflite_path)
+    kl = keras_pilot(interpreter=TfLite())
+    kl.load(tflite_path)
+    input_dict = {'img_in': km.normalize(get_test_img(km))[np.newaxis]}
+    if keras_pilot is KerasIMU:
+        input_dict['imu_in'] = np.random.rand(1, 6)
+    out_keras = km.interpreter.predict_batch(input_dict)
+    out_tflite = kl.interpreter.predict_batch(input_dict)
+    assert len(out_tflite) == len(model.outputs) > 1
+    for k, t in zip(out_keras, out_tflite):
+        assert t.shape == k.shape
+        assert t == approx(k, rel=TOLERANCE, abs=TOLERANCE)
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasCategorical,
+                                         KerasIMU])
+def test_inference_batch(keras_pilot, tmp_dir):
+    """ Batched inference gives the outputs of single frame inference and
+        the tflite interpreter still runs single frames afterwards """
+    km = keras_pilot()
+    tflite_path = os.path.join(tmp_dir, 'model.tflite')
+    keras_to_tflite(km.interpreter.model, tflite_path)
+    kl = keras_pilot(interpreter=TfLite())
+    kl.load(tflite_path)
+    num = 5
+    imgs = [get_test_img(km) for _ in range(num)]
+    imus = np.random.rand(num, 6)
+    input_dict = {'img_in': np.stack([km.normalize(img) for img in imgs])}
+    if keras_pilot is KerasIMU:
+        input_dict['imu_in'] = imus
+    for pilot in (km, kl):
+        outputs = pilot.inference_batch(input_dict)
+        assert len(outputs) == num
+        for img, imu, out in zip(imgs, imus, outputs):
+            other = imu.tolist() if keras_pilot is KerasIMU else None
+            assert out == approx(pilot.run(img, other), abs=TOLERANCE)
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasCategorical])
+def test_y_transform_batch(keras_pilot):
+    """ Batched labels are the stacked labels of the single records """
+    from donkeycar.config import Config
+    from donkeycar.pipeline.types import TubRecord
+    kl = keras_pilot()
+    records = [TubRecord(Config(), '/base',
+                         {'user/angle': a, 'user/throttle': t})
+               for a, t in zip(np.linspace(-1, 1, 9), np.linspace(0, .5, 9))]
+    ys = kl.y_transform_batch(records)
+    for i, record in enumerate(records):
+        y = kl.y_transform(record)
+        assert set(y) == set(ys)
+        for k in y:
+            assert np.array_equal(ys[k][i], y[k])
+
+
+@pytest.mark.skipif(not HAVE_TF_TRT,
+                    reason='Tensorflow is not built with TensorRT')
+def test_tensorrt_persistent_session(tmp_dir):
+    """ The TensorRT interpreter runs the graph in a persistent session
+        which gives the keras outputs on repeated and batched inference. That
+        the memory stays bounded over 100k inferences is checked by
+        scripts/tensorrt_memory.py, which fails if it grows. """
+    img_in = tf.keras.Input(shape=(8, 8, 3), name='img_in')
+    x = tf.keras.layers.Flatten()(img_in)
+    outputs = [tf.keras.layers.Dense(1, name=f'n_outputs{i}')(x)
+               for i in range(2)]
+    model = tf.keras.Model(inputs=img_in, outputs=outputs)
+    savedmodel_path = os.path.join(tmp_dir, 'model.savedmodel')
+    model.save(savedmodel_path)
+    trt = TensorRT()
+    trt.load(savedmodel_path)
+    img = np.random.rand(8, 8, 3).astype(np.float32)
+    expected = np.ravel([out.numpy()
+                         for out in model(img[np.newaxis], training=False)])
+    assert np.ravel(trt.predict(img, None)) == approx(expected, abs=TOLERANCE)
+    batch = trt.predict_batch({'img_in': np.stack([img, img])})
+    assert np.ravel([out[1] for out in batch]) \
+        == approx(expected, abs=TOLERANCE)
+    for _ in range(100):
+        trt.predict(img, None)
+    assert np.ravel(trt.predict(img, None)) == approx(expected, abs=TOLERANCE)
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasIMU, KerasMemory,
+                                         KerasLSTM, Keras3D_CNN])
+def test_warm_up(keras_pilot, tmp_dir):
+    """ Warm-up runs inferences without changing the pilot's frame history
+        and works for keras and tflite """
+    km = keras_pilot()
+    pilots = [km]
+    if keras_pilot is not Keras3D_CNN:
+        tflite_path = os.path.join(tmp_dir, 'model.tflite')
+        keras_to_tflite(km.interpreter.model, tflite_path)
+        kl = keras_pilot(interpreter=TfLite())
+        kl.load(tflite_path)
+        pilots.append(kl)
+    def history(pilot):
+        return [getattr(pilot, name).sequence().copy()
+                for name in ('img_seq', 'mem_seq') if hasattr(pilot, name)]
+
+    for pilot in pilots:
+        before = history(pilot)
+        times = pilot.warm_up(num_runs=2)
+        assert len(times) == 2 and all(t > 0 for t in times)
+        after = history(pilot)
+        assert all(np.array_equal(b, a) for b, a in zip(before, after))
+
+
+def test_frame_history():
+    """ The ring buffer returns the last entries oldest first, the first
+        entry fills the whole history """
+    history = FrameHistory(3, (2, ))
+    assert history.append([1, 1]).tolist() == [[1, 1]] * 3
+    assert history.append([2, 2]).tolist() == [[1, 1], [1, 1], [2, 2]]
+    for i in range(3, 8):
+        seq = history.append([i, i])
+        assert seq.tolist() == [[i - 2] * 2, [i - 1] * 2, [i] * 2]
+        # contiguous view into the buffer, no copy
+        assert seq.base is history.buffer and seq.flags['C_CONTIGUOUS']
+    filled = FrameHistory(2, (2, ), fill=[0, 0.5])
+    assert filled.sequence().tolist() == [[0, 0.5], [0, 0.5]]
+    assert filled.append([1, 1]).tolist() == [[0, 0.5], [1, 1]]
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLSTM, Keras3D_CNN])
+def test_sequence_pilot_history(keras_pilot):
+    """ The sequence pilots feed the model the same frame sequence as a
+        stack of the last normalised frames """
+    km = keras_pilot()
+    imgs = [get_test_img(km) for _ in range(km.seq_length + 2)]
+    norm = [km.normalize(img) for img in imgs]
+    for i, img in enumerate(imgs):
+        out = km.run(img)
+        seq = [norm[max(j, 0)] for j in range(i - km.seq_length + 1, i + 1)]
+        expected = km.inference(np.stack(seq), None)
+        assert out == approx(expected, abs=TOLERANCE)
+
+
+@pytest.mark.parametrize('num_behaviors, num_locations',
+                         [(2, 8), (0, 8), (3, 0)])
+def test_multi_head(num_behaviors, num_locations, tmp_dir):
+    km = KerasMultiHead(num_locations=num_locations,
+                        num_behaviors=num_behaviors)
+    # every head maps to its memory channel
+    assert len(km.output_channels()) == len(km.interpreter.model.outputs)
+    tflite_model_path = os.path.join(tmp_dir, 'model.tflite')
+    keras_to_tflite(km.interpreter.model, tflite_model_path)
+    kl = KerasMultiHead(interpreter=TfLite(), num_locations=num_locations,
+                        num_behaviors=num_behaviors)
+    kl.load(tflite_model_path)
+    img = get_test_img(km)
+    out_keras = km.run(img)
+    out_tflite = kl.run(img)
+    assert len(out_keras) == len(km.output_channels())
+    assert out_keras[:2] == approx(out_tflite[:2], rel=TOLERANCE,
+                                   abs=TOLERANCE)
+    assert out_keras[2:] == out_tflite[2:]
+
+
+def test_multi_head_missing_label():
+    """ A head without its label in the tub gives an error naming it """
+    from donkeycar.config import Config
+    from donkeycar.pipeline.types import TubRecord
+    record = TubRecord(Config(), '/base',
+                       {'user/angle': 0.1, 'user/throttle': 0.2})
+    assert KerasMultiHead(num_locations=0, num_behaviors=0)\
+        .y_transform(record) == {'angle': 0.1, 'throttle': 0.2}
+    with pytest.raises(ValueError, match='localizer/location'):
+        KerasMultiHead(num_locations=3, num_behaviors=0).y_transform(record)
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+
+from donkeycar.parts.keras import KerasLinear
+from donkeycar.parts.model_swap import HotSwapPilot
+from donkeycar.utils import get_test_img
+
+
+class FakePilot:
+    """ Returns the number in the loaded model path as angle """
+    def __init__(self, load_delay=0.0):
+        self.angle = 0.0
+        self.load_delay = load_delay
+
+    def load(self, model_path):
+        time.sleep(self.load_delay)
+        self.angle = float(model_path)
+
+    def test_inference(self):
+        return self.angle, 0.0
+
+    def run(self, img):
+        return self.angle, 0.5
+
+
+def wait_for_swap(pilot, timeout=5.0):
+    start = time.time()
+    while pilot.loader is not None and time.time() - start < timeout:
+        time.sleep(0.01)
+
+
+def test_hot_swap_keeps_driving():
+    loading = threading.Event()
+
+    def create_pilot():
+        loading.set()
+        return FakePilot(load_delay=0.2)
+
+    pilot = HotSwapPilot(FakePilot(), create_pilot)
+    pilot.request_load('1')
+    loading.wait()
+    # the old model drives without waiting for the load
+    start = time.time()
+    assert pilot.run(None) == (0.0, 0.5)
+    assert time.time() - start < 0.1
+    wait_for_swap(pilot)
+    assert pilot.run(None) == (1.0, 0.5)
+
+
+def test_hot_swap_rejects_failing_model():
+    pilot = HotSwapPilot(FakePilot(), FakePilot)
+    # not a number, loading fails
+    pilot.request_load('no model')
+    wait_for_swap(pilot)
+    assert pilot.run(None) == (0.0, 0.5)
+    # non finite outputs fail the validation
+    pilot.request_load('nan')
+    wait_for_swap(pilot)
+    assert pilot.run(None) == (0.0, 0.5)
+    pilot.request_load('2')
+    wait_for_swap(pilot)
+    assert pilot.run(None) == (2.0, 0.5)
+
+
+def test_hot_swap_keras(tmp_path):
+    model_path = os.path.join(tmp_path, 'model.h5')
+    new_model = KerasLinear()
+    new_model.interpreter.model.save(model_path)
+    pilot = HotSwapPilot(KerasLinear(), KerasLinear, warm_up_runs=1)
+    img = get_test_img(new_model)
+    pilot.run(img)
+    pilot.request_load(model_path)
+    wait_for_swap(pilot)
+    pilot.run(img)
+    assert pilot.run(img) == new_model.run(img)
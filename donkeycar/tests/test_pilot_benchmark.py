@@ -0,0 +1,20 @@
+import json
+
+from donkeycar.config import Config
+from donkeycar.management.pilot_benchmark import benchmark_pilots
+import donkeycar.templates.cfg_complete as cfg_complete
+
+
+def test_benchmark_pilots():
+    cfg = Config()
+    cfg.from_object(cfg_complete)
+    results = benchmark_pilots(cfg, ['linear', 'imu'], ['keras', 'tflite'],
+                               iterations=5)
+    # results are json serialisable
+    results = json.loads(json.dumps(results))
+    assert results['setup']['iterations'] == 5
+    assert len(results['results']) == 4
+    for result in results['results']:
+        assert 'error' not in result
+        assert result['latency_p50_ms'] <= result['latency_p99_ms']
+        assert result['throughput_fps'] > 0
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+from pytest import approx
+
+from donkeycar.parts.keras import KerasCategorical, KerasLinear, KerasLSTM
+from donkeycar.parts.salient import SalientVis, VisualBackProp, overlay
+from donkeycar.utils import get_test_img
+
+
+def reference_mask(vbp, img):
+    """ VisualBackProp running the chain layer by layer """
+    activations = [a.numpy() for a in vbp.features(img[np.newaxis])][::-1]
+    upscaled = 1.0
+    for activation, kernel, strides, (h, w) in \
+            zip(activations, vbp.kernels, vbp.strides, vbp.shapes):
+        averaged = activation.mean(axis=3, keepdims=True) * upscaled
+        upscaled = tf.nn.conv2d_transpose(
+            averaged, kernel, output_shape=(1, h, w, 1), strides=strides,
+            padding='VALID').numpy()
+    mask = upscaled[0, :, :, 0]
+    return (mask - mask.min()) / (mask.max() - mask.min())
+
+
+@pytest.mark.parametrize('keras_pilot', [KerasLinear, KerasCategorical])
+def test_visual_backprop(keras_pilot):
+    """ The batched graph function gives the masks of the layer by layer
+        computation for each image """
+    kl = keras_pilot()
+    vbp = VisualBackProp(kl.interpreter.model)
+    assert len(vbp.kernels) == 5
+    imgs = np.stack([kl.normalize(get_test_img(kl)) for _ in range(3)])
+    masks = vbp.masks(imgs)
+    assert masks.shape == (3, 120, 160)
+    assert masks.min() == approx(0) and masks.max() == approx(1)
+    for img, mask in zip(imgs, masks):
+        assert mask == approx(reference_mask(vbp, img), abs=1e-4)
+        assert vbp.mask(img) == approx(mask, abs=1e-5)
+
+
+def test_visual_backprop_needs_conv_chain():
+    with pytest.raises(ValueError):
+        VisualBackProp(KerasLSTM().interpreter.model)
+
+
+def test_salient_vis():
+    kl = KerasLinear()
+    img = get_test_img(kl)
+    out = SalientVis(kl).run(img)
+    assert out.shape == img.shape and out.dtype == np.uint8
+    assert overlay(img[:, :, :1], np.zeros((60, 80))).shape == img.shape
@@ -0,0 +1,85 @@
+import os
+
+from donkeycar.config import Config
+from donkeycar.pipeline.split import SPLIT_FILE, split_assignments, \
+    split_records
+from donkeycar.pipeline.types import TubRecord
+
+
+def make_records(tub_path, start, end, session='s1'):
+    return [TubRecord(Config(), tub_path,
+                      {'_index': i, '_session_id': session})
+            for i in range(start, end)]
+
+
+def indexes(records):
+    return sorted(r.underlying['_index'] for r in records)
+
+
+def test_split_by_blocks(tmpdir):
+    records = make_records(str(tmpdir), 0, 1000)
+    train, val = split_records(records, test_size=0.2, block_size=50,
+                               persist=False)
+    assert len(train) + len(val) == 1000
+    assert len(val) == 200
+    # consecutive records stay together
+    val_blocks = {i // 50 for i in indexes(val)}
+    train_blocks = {i // 50 for i in indexes(train)}
+    assert not val_blocks & train_blocks
+    # split is deterministic
+    train2, val2 = split_records(list(reversed(records)), test_size=0.2,
+                                 block_size=50, persist=False)
+    assert indexes(val2) == indexes(val)
+
+
+def test_split_by_session(tmpdir):
+    records = make_records(str(tmpdir), 0, 100, 's1') \
+        + make_records(str(tmpdir), 100, 200, 's2')
+    train, val = split_records(records, test_size=0.2, block_size=0,
+                               persist=False)
+    sessions = {r.underlying['_session_id'] for r in val}
+    assert len(sessions) == 1 and len(val) == 100
+
+
+def test_split_persisted(tmpdir):
+    tub_path = str(tmpdir)
+    records = make_records(tub_path, 0, 500)
+    train, val = split_records(records, test_size=0.2, block_size=20)
+    assert os.path.exists(os.path.join(tub_path, SPLIT_FILE))
+    # new records form new blocks, the stored ones keep their side
+    more = make_records(tub_path, 0, 800)
+    train2, val2 = split_records(more, test_size=0.2, block_size=20)
+    assert set(indexes(val)) <= set(indexes(val2))
+    assert set(indexes(train)) <= set(indexes(train2))
+    assert len(val2) == 160
+    # other parameters create a new split
+    train3, val3 = split_records(more, test_size=0.5, block_size=20)
+    assert len(val3) == 400
+
+
+def test_split_unreadable_file(tmpdir):
+    """ A partly written split file is treated like a missing one and gets
+        replaced """
+    tub_path = str(tmpdir)
+    with open(os.path.join(tub_path, SPLIT_FILE), 'wb') as f:
+        f.write(b'PK\x03\x04 truncated')
+    records = make_records(tub_path, 0, 500)
+    train, val = split_records(records, test_size=0.2, block_size=20)
+    assert len(val) == 100
+    train2, val2 = split_records(records, test_size=0.2, block_size=20)
+    assert indexes(val2) == indexes(val)
+    assert os.listdir(tub_path) == [SPLIT_FILE]
+
+
+def test_split_given_assignments(tmpdir):
+    """ Given assignments are used as they are and the tub is not touched """
+    tub_path = str(tmpdir)
+    records = make_records(tub_path, 0, 500)
+    assignments = split_assignments(records, test_size=0.2, block_size=20,
+                                    persist=False)
+    train, val = split_records(records, test_size=0.5, block_size=20,
+                               assignments=assignments)
+    assert len(val) == 100
+    assert all(assignments[os.path.abspath(tub_path)][i]
+               for i in indexes(val))
+    assert not os.listdir(tub_path)
@@ -121,3 +121,101 @@ def test_training_pipeline(config: Config, model_type: str, car_dir: str) \
     val_x, val_y = next(iter(data_module.val_dataloader()))
     output = model(val_x)
     assert(output.shape == (config.BATCH_SIZE, 2))
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_dataset_sharded_over_workers(config: Config, car_dir: str,
+                                      num_workers: int) -> None:
+    from donkeycar.parts.pytorch.torch_data import TorchTubDataset, \
+        data_loader_kwargs
+    from donkeycar.pipeline.types import TubDataset
+    tub_dir = os.path.join(car_dir, 'tub')
+    records = TubDataset(config, [tub_dir]).get_records()
+    # identify each record by its angle and throttle
+    dataset = TorchTubDataset(config, records,
+                              transform=lambda img: torch.zeros(1))
+    config.TORCH_NUM_WORKERS = num_workers
+    kwargs = data_loader_kwargs(config)
+    assert kwargs['persistent_workers'] == (num_workers > 0)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=16, **kwargs)
+    # every record is seen exactly once per epoch, also in the second one
+    expected = sorted((r.underlying['user/angle'], r.underlying['user/throttle'])
+                      for r in records)
+    for _ in range(2):
+        ys = torch.cat([y for _, y in loader]) * 2 - 1
+        seen = sorted(map(tuple, ys.tolist()))
+        assert np.allclose(seen, expected, atol=1e-5)
+
+
+class TinyPilot:
+    """ Provides a small torch model to the interpreter """
+    input_shape = (60, 80, 3)
+
+    def create_model(self):
+        return torch.nn.Sequential(
+            torch.nn.Conv2d(3, 8, kernel_size=5, stride=4), torch.nn.ReLU(),
+            torch.nn.Flatten(), torch.nn.Linear(8 * 14 * 19, 2))
+
+
+def test_fastai_interpreter_fused(tmp_path):
+    from donkeycar.parts.interpreter import FastAIInterpreter
+    from donkeycar.parts.pytorch.inference import export_torchscript
+    from donkeycar.parts.pytorch.torch_data import get_default_transform
+    pilot = TinyPilot()
+    interpreter = FastAIInterpreter(num_threads=1)
+    interpreter.set_model(pilot)
+    interpreter.model.eval()
+    img = np.random.randint(0, 255, size=pilot.input_shape, dtype=np.uint8)
+    # torchvision transform on every frame
+    expected = interpreter.predict(
+        get_default_transform(resize=False)(img), None)
+    assert interpreter.predict_image(img) == pytest.approx(expected, abs=1e-5)
+    batch = interpreter.predict_batch({'img_in': np.stack([img, img])})
+    assert batch.shape == (2, 2)
+    assert batch[1] == pytest.approx(expected, abs=1e-5)
+    # loading the TorchScript export with the fused normalisation
+    path = str(tmp_path / 'model.pt')
+    export_torchscript(interpreter.model, pilot.input_shape, path)
+    loaded = FastAIInterpreter()
+    loaded.set_model(pilot)
+    loaded.load(path)
+    assert loaded.predict_image(img) == pytest.approx(expected, abs=1e-5)
+
+
+class TwoHeads(torch.nn.Module):
+    """ Small torch model with separate angle and throttle heads """
+    def __init__(self):
+        super().__init__()
+        self.body = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 8, kernel_size=5, stride=4), torch.nn.ReLU(),
+            torch.nn.Flatten())
+        self.angle = torch.nn.Linear(8 * 14 * 19, 1)
+        self.throttle = torch.nn.Linear(8 * 14 * 19, 1)
+
+    def forward(self, x):
+        x = self.body(x)
+        return self.angle(x), self.throttle(x)
+
+
+class TwoHeadPilot(TinyPilot):
+    def create_model(self):
+        return TwoHeads()
+
+
+def test_fastai_interpreter_batch_heads():
+    """ Batches of models with several heads split into the outputs of the
+        single frames """
+    from donkeycar.parts.interpreter import FastAIInterpreter, split_batch
+    pilot = TwoHeadPilot()
+    interpreter = FastAIInterpreter(num_threads=1)
+    interpreter.set_model(pilot)
+    interpreter.model.eval()
+    imgs = np.random.randint(0, 255, size=(3, *pilot.input_shape),
+                             dtype=np.uint8)
+    batch = interpreter.predict_batch({'img_in': imgs})
+    assert [b.shape for b in batch] == [(3, 1), (3, 1)]
+    for img, frame in zip(imgs, split_batch(batch)):
+        expected = interpreter.predict_image(img)
+        assert len(frame) == len(expected) == 2
+        for out, exp in zip(frame, expected):
+            assert out == pytest.approx(exp, abs=1e-5)
@@ -45,6 +45,8 @@ def base_config() -> Config:
     cfg.SHOW_PLOT = False
     cfg.BEHAVIOR_LIST = ['Left_Lane', "Right_Lane"]
     cfg.NUM_LOCATIONS = 3
+    cfg.MULTI_HEAD_BEHAVIOR = True
+    cfg.MULTI_HEAD_LOCATION = True
     cfg.SEQUENCE_LENGTH = 3
     cfg.CACHE_IMAGES = False
     return cfg
@@ -125,9 +127,10 @@ d12 = Data(type='linear', name='lin2', convergence=0.7, preprocess='aug')
 d13 = Data(type='linear', name='lin3', convergence=0.7, preprocess='trans')
 d14 = Data(type='fastai_linear', name='linfastai1', convergence=0.6,
            tf_lite=False, tensor_rt=False)
+d15 = Data(type='multihead', name='mh1', convergence=0.95)
 
-test_data = [d1, d2, d3, d6, d7, d8, d9, d10, d11, d12, d14]
-full_tub = ['imu', 'behavior', 'localizer']
+test_data = [d1, d2, d3, d6, d7, d8, d9, d10, d11, d12, d14, d15]
+full_tub = ['imu', 'behavior', 'localizer', 'multihead']
 
 
 @pytest.mark.skipif("GITHUB_ACTIONS" in os.environ,
@@ -172,7 +175,7 @@ filters = [lambda r: r.underlying['user/throttle'] > 0.5,
            lambda r: r.underlying['user/throttle'] < 0.6 and
                      r.underlying['user/angle'] > -0.5]
 model_types = ['linear', 'categorical', 'inferred', 'imu', 'behavior',
-               'localizer', 'rnn', '3d']
+               'localizer', 'multihead', 'rnn', '3d']
 
 
 @pytest.mark.parametrize('model_type', model_types)
@@ -232,3 +235,143 @@ def test_training_pipeline(config: Config, model_type: str,
             for k, v in batch.items():
                 assert np.isclose(v, np_dict[k]).all()
 
+
+def test_frame_cache(config: Config, tmpdir) -> None:
+    """ Records from the frame cache must match the records from the tub """
+    from donkeycar.pipeline.sweep import FrameCache, CachedTubDataset, \
+        FRAMES
+    cfg = copy(config)
+    cfg.TRAIN_FILTER = None
+    cache = FrameCache.create(cfg, [cfg.DATA_PATH], str(tmpdir))
+    records = TubDataset(cfg, [cfg.DATA_PATH], seq_size=3).get_records()
+    cached_records = CachedTubDataset(cfg, cache, seq_size=3).get_records()
+    assert len(cached_records) == len(records) > 0
+    for seq, cached_seq in zip(records, cached_records):
+        for r, c in zip(seq, cached_seq):
+            assert r.underlying == c.underlying
+            assert (r.image() == c.image()).all()
+    # the cache is reused for the same tubs and image size only
+    mtime = os.path.getmtime(os.path.join(str(tmpdir), FRAMES))
+    FrameCache.create(cfg, [cfg.DATA_PATH], str(tmpdir))
+    assert os.path.getmtime(os.path.join(str(tmpdir), FRAMES)) == mtime
+    cfg.IMAGE_H, cfg.IMAGE_W = cfg.IMAGE_H // 2, cfg.IMAGE_W // 2
+    small = FrameCache.create(cfg, [cfg.DATA_PATH], str(tmpdir))
+    assert small.frames.shape[1:3] == (cfg.IMAGE_H, cfg.IMAGE_W)
+
+
+def test_incremental_dataset(tmpdir) -> None:
+    """ Only records of new sessions and a replay sample of known sessions
+        are selected """
+    from donkeycar.pipeline.types import IncrementalTubDataset
+    cfg = Config()
+    tub_path = str(tmpdir)
+    for num in (10, 5):
+        tub = Tub(tub_path, inputs=['input'], types=['int'])
+        for i in range(num):
+            tub.write_record({'input': i})
+        tub.close()
+        if num == 10:
+            known = TubDataset(cfg, [tub_path]).sessions()
+    assert len(known[os.path.abspath(tub_path)]) == 1
+    dataset = IncrementalTubDataset(cfg, [tub_path], known, replay_ratio=0.4)
+    new_sessions = dataset.new_sessions()
+    assert list(new_sessions) == [os.path.abspath(tub_path)]
+    new_id = new_sessions[os.path.abspath(tub_path)]
+    assert len(new_id) == 1 and new_id != known[os.path.abspath(tub_path)]
+    records = dataset.get_records()
+    assert dataset.num_new == 5 and dataset.num_replay == 2
+    assert len(records) == 7
+    assert sum(r.underlying['_session_id'] in new_id for r in records) == 5
+    all_sessions = dataset.sessions()
+    assert all_sessions == TubDataset(cfg, [tub_path]).sessions()
+    # nothing new after the model has seen all sessions
+    dataset = IncrementalTubDataset(cfg, [tub_path], all_sessions)
+    assert not dataset.new_sessions()
+
+
+def test_pipeline_profiler(config: Config) -> None:
+    """ All stages of the input pipeline get timed """
+    from donkeycar.pipeline.profiler import PipelineProfiler, IDLE, \
+        profile_batches
+    from donkeycar.pipeline.training import create_pipeline
+    cfg = copy(config)
+    cfg.HAVE_ODOM = False
+    add_transformation_to_config(cfg)
+    add_augmentation_to_config(cfg)
+    kl = get_model_by_type('linear', cfg)
+    records = TubDataset(cfg, [cfg.DATA_PATH]).get_records()
+    profiler = PipelineProfiler()
+    data, steps = create_pipeline(cfg, kl, 'linear', records, is_train=True,
+                                  profiler=profiler)
+    assert steps == len(records) // cfg.BATCH_SIZE + 1
+    waits = profile_batches(data, 3, profiler)
+    assert len(waits) == 3
+    for stage in ('x_transform', '  decode', 'process images',
+                  '  transformations', '  augmentations', '  normalize',
+                  IDLE):
+        assert profiler.counts[stage] >= 3 * cfg.BATCH_SIZE
+    # the labels are created for all records when the pipeline is set up,
+    # and that stays in the report after the reset for each epoch
+    assert profiler.setup_counts['y_transform'] == len(records)
+    assert profiler.records >= 3 * cfg.BATCH_SIZE
+    report = profiler.report()
+    assert 'Producer idle' in report
+    assert 'y_transform' in report
+
+
+@pytest.mark.parametrize('model_type, metric', [('linear', 'mae'),
+                                                ('categorical', 'accuracy')])
+def test_int8_tflite(config: Config, model_type: str, metric: str,
+                     tmpdir) -> None:
+    """ The float and the int8 model are evaluated on every validation
+        record against the labels """
+    from donkeycar.pipeline.training import create_int8_tflite
+    cfg = copy(config)
+    cfg.HAVE_ODOM = False
+    cfg.TF_LITE_INT8_SAMPLES = 20
+    kl = get_model_by_type(model_type, cfg)
+    model_path = str(tmpdir.join('model.h5'))
+    kl.interpreter.model.save(model_path)
+    records = TubDataset(cfg, [cfg.DATA_PATH]).get_records()
+    train_records, val_records = records[:50], records[50:]
+    result = create_int8_tflite(cfg, kl, model_path,
+                                str(tmpdir.join('model.int8.tflite')),
+                                train_records, val_records)
+    assert result['records'] == len(val_records)
+    assert result['metric'] == [metric, metric]
+    assert result['delta'] == pytest.approx(
+        np.subtract(result['int8'], result['float']))
+    if metric == 'mae':
+        assert result['delta'] == pytest.approx([0, 0], abs=0.05)
+
+
+def test_shards(config: Config, tmpdir) -> None:
+    """ Shards contain all records with the transformation applied and are
+        read back in the shapes the model expects """
+    from donkeycar.pipeline.shards import export_shards, ShardSequence
+    cfg = copy(config)
+    cfg.HAVE_ODOM = False
+    cfg.TRAIN_FILTER = None
+    add_transformation_to_config(cfg)
+    add_augmentation_to_config(cfg)
+    shard_dir = str(tmpdir)
+    manifest = export_shards(cfg, cfg.DATA_PATH, shard_dir, 'linear',
+                             shard_size=300)
+    records = TubDataset(cfg, [cfg.DATA_PATH]).get_records()
+    assert sum(s['records'] for s in manifest['train'] + manifest['validation']) \
+        == len(records)
+    kl = get_model_by_type('linear', cfg)
+    angles = []
+    for is_train in (True, False):
+        seq = ShardSequence(kl, cfg, shard_dir, is_train)
+        for shard in seq.shards:
+            for x, y in seq.read_shard(shard['file'].encode()):
+                assert x['img_in'].shape == (cfg.IMAGE_H, cfg.IMAGE_W,
+                                             cfg.IMAGE_DEPTH)
+                assert 0.0 <= x['img_in'].min() <= x['img_in'].max() <= 1.0
+                angles.append(y['n_outputs0'])
+        batch = next(iter(seq.create_tf_data()))
+        assert batch[0]['img_in'].shape[0] == min(cfg.BATCH_SIZE,
+                                                  seq.num_records)
+    record_angles = [r.underlying['user/angle'] for r in records]
+    assert sorted(angles) == sorted(record_angles)
@@ -58,6 +58,24 @@ class TestTub(unittest.TestCase):
                             for rec_1, rec_2 in zip(it1, it2))), \
                     'Non continuous records found'
 
+    def test_sequence_indices(self):
+        cfg = Config()
+        records = [TubRecord(cfg, self.tub.base_path, underlying) for
+                   underlying in self.tub]
+        for seq_len in (1, 2, 3, 4, 5):
+            # brute force all windows of continuous records
+            expected = [list(range(i, i + seq_len))
+                        for i in range(len(records) - seq_len + 1)
+                        if all(Collator.is_continuous(records[j],
+                                                      records[j + 1])
+                               for j in range(i, i + seq_len - 1))]
+            seq = Collator(seq_len, records)
+            self.assertEqual(seq.sequence_indices().tolist(), expected)
+            self.assertEqual(len(seq), len(expected))
+            # overlapping sequences share the record objects
+            for window, l in zip(expected, seq):
+                assert all(records[i] is r for i, r in zip(window, l))
+
     def test_delete_last_n_records(self):
         start_len = len(self.tub)
         self.tub.delete_last_n_records(2)
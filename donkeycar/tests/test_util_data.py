@@ -64,6 +64,35 @@ class TestLinearUnbin(unittest.TestCase):
         assert res == -1.0
 
 
+class TestLinearBinBatch(unittest.TestCase):
+
+    def test_bin_matches_scalar(self):
+        values = np.linspace(-1.2, 1.2, 97)
+        res = linear_bin_batch(values)
+        assert res.shape == (97, 15)
+        for value, row in zip(values, res):
+            assert np.array_equal(row, linear_bin(value))
+
+    def test_bin_throttle_matches_scalar(self):
+        values = np.linspace(-0.1, 0.6, 71)
+        res = linear_bin_batch(values, N=20, offset=0.0, R=0.5)
+        for value, row in zip(values, res):
+            assert np.array_equal(row, linear_bin(value, N=20, offset=0.0,
+                                                  R=0.5))
+
+    def test_unbin_matches_scalar(self):
+        rows = np.random.rand(50, 20)
+        res = linear_unbin_batch(rows, N=20, offset=0.0, R=0.5)
+        assert res.shape == (50, )
+        for row, value in zip(rows, res):
+            assert value == linear_unbin(row, N=20, offset=0.0, R=0.5)
+
+    def test_round_trip(self):
+        values = np.linspace(-1, 1, 15)
+        res = linear_unbin_batch(linear_bin_batch(values))
+        assert res == pytest.approx(values)
+
+
 class TestMapping(unittest.TestCase):
 
     def test_positive(self):
@@ -284,6 +284,28 @@ def linear_unbin(arr, N=15, offset=-1, R=2.0):
     return a
 
 
+def linear_bin_batch(a, N=15, offset=1, R=2.0):
+    '''
+    linear_bin of many values at once, returns a one hot encoded matrix
+    with a row of length N for each value
+    '''
+    a = np.asarray(a, dtype=np.float64).ravel()
+    b = np.rint((a + offset) / (R / (N - offset)))
+    b = np.clip(b, 0, N - 1).astype(np.intp)
+    arr = np.zeros((len(a), N))
+    arr[np.arange(len(a)), b] = 1
+    return arr
+
+
+def linear_unbin_batch(arr, N=15, offset=-1, R=2.0):
+    '''
+    linear_unbin of many one hot encoded rows or distributions at once,
+    returns an array of the values
+    '''
+    b = np.argmax(np.asarray(arr), axis=-1)
+    return b * (R / (N + offset)) + offset
+
+
 def map_range(x, X_min, X_max, Y_min, Y_max):
     '''
     Linear mapping between two ranges of values
@@ -464,22 +486,28 @@ def get_model_by_type(model_type: str, cfg: 'Config') -> Union['KerasPilot', 'Fa
     '''
     from donkeycar.parts.keras import KerasCategorical, KerasLinear, \
         KerasInferred, KerasIMU, KerasMemory, KerasBehavioral, KerasLocalizer, \
-        KerasLSTM, Keras3D_CNN
+        KerasMultiHead, KerasLSTM, Keras3D_CNN
     from donkeycar.parts.interpreter import KerasInterpreter, TfLite, TensorRT, \
-        FastAIInterpreter
+        FastAIInterpreter, Coral
 
     if model_type is None:
         model_type = cfg.DEFAULT_MODEL_TYPE
     logger.info(f'get_model_by_type: model type is: {model_type}')
     input_shape = (cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)
     if 'tflite_' in model_type:
-        interpreter = TfLite()
+        interpreter = TfLite(num_threads=getattr(cfg, 'TFLITE_NUM_THREADS',
+                                                 None))
         used_model_type = model_type.replace('tflite_', '')
+    elif 'coral_' in model_type:
+        interpreter = Coral(num_threads=getattr(cfg, 'TFLITE_NUM_THREADS', None),
+                            device=getattr(cfg, 'CORAL_DEVICE', None))
+        used_model_type = model_type.replace('coral_', '')
     elif 'tensorrt_' in model_type:
         interpreter = TensorRT()
         used_model_type = model_type.replace('tensorrt_', '')
     elif 'fastai_' in model_type:
-        interpreter = FastAIInterpreter()
+        interpreter = FastAIInterpreter(
+            num_threads=getattr(cfg, 'TORCH_NUM_THREADS', None))
         used_model_type = model_type.replace('fastai_', '')
         if used_model_type == "linear":
             from donkeycar.parts.fastai import FastAILinear
@@ -514,6 +542,13 @@ def get_model_by_type(model_type: str, cfg: 'Config') -> Union['KerasPilot', 'Fa
     elif used_model_type == 'localizer':
         kl = KerasLocalizer(interpreter=interpreter, input_shape=input_shape,
                             num_locations=cfg.NUM_LOCATIONS)
+    elif used_model_type == 'multihead':
+        kl = KerasMultiHead(
+            interpreter=interpreter, input_shape=input_shape,
+            num_locations=cfg.NUM_LOCATIONS
+            if getattr(cfg, 'MULTI_HEAD_LOCATION', False) else 0,
+            num_behaviors=len(cfg.BEHAVIOR_LIST)
+            if getattr(cfg, 'MULTI_HEAD_BEHAVIOR', False) else 0)
     elif used_model_type == 'rnn':
         kl = KerasLSTM(interpreter=interpreter, input_shape=input_shape,
                        seq_length=cfg.SEQUENCE_LENGTH)
@@ -521,7 +556,7 @@ def get_model_by_type(model_type: str, cfg: 'Config') -> Union['KerasPilot', 'Fa
         kl = Keras3D_CNN(interpreter=interpreter, input_shape=input_shape,
                          seq_length=cfg.SEQUENCE_LENGTH)
     else:
-        known = [k + u for k in ('', 'tflite_', 'tensorrt_')
+        known = [k + u for k in ('', 'tflite_', 'coral_', 'tensorrt_')
                  for u in used_model_type.mem]
         raise ValueError(f"Unknown model type {model_type}, supported types are"
                          f" { ', '.join(known)}")
@@ -1,5 +1,5 @@
 import argparse
-from donkeycar.parts.coral import InferenceEngine
+from donkeycar.parts.coral import CoralLinearPilot
 from PIL import Image
 from donkeycar.utils import FPSTimer
 import numpy as np
@@ -11,17 +11,18 @@ def main():
   parser.add_argument(
       '--image', help='File path of the image to be recognized.', required=True)
   args = parser.parse_args()
-  # Initialize engine.
-  engine = InferenceEngine(args.model)
+  # Initialize pilot.
+  img = np.array(Image.open(args.image))
+  pilot = CoralLinearPilot(input_shape=img.shape)
+  pilot.load(args.model)
   # Run inference.
-  img = Image.open(args.image)
-  result = engine.Inference(np.array(img))
+  result = pilot.run(img)
   print("inference result", result)
 
   timer = FPSTimer()
   while True:
-    engine.Inference(np.array(img))
+    pilot.run(img)
     timer.on_frame()
 
 if __name__ == '__main__':
-  main()
\ No newline at end of file
+  main()
@@ -0,0 +1,51 @@
+'''
+Runs many inferences of a SavedModel or TensorRT model through the TensorRT
+interpreter and checks that the resident memory stays bounded, as the graph
+runs in a persistent session. Exits with status 1 if the memory grew by
+more than the allowed amount. This is the long running counterpart of
+test_tensorrt_persistent_session in donkeycar/tests/test_keras.py, run it
+on a machine with TF-TRT after changes to the TensorRT interpreter:
+
+    python scripts/tensorrt_memory.py --model=~/mycar/models/pilot.trt
+
+Usage:
+    tensorrt_memory.py --model="mymodel.savedmodel" [--iterations=100000]
+                       [--max-growth=8]
+
+Options:
+    --iterations=<n>    number of measured inferences [default: 100000]
+    --max-growth=<mb>   allowed growth of the resident memory in MB over the
+                        measured inferences [default: 8]
+'''
+import os
+import sys
+
+from docopt import docopt
+import numpy as np
+import psutil
+
+from donkeycar.parts.interpreter import TensorRT
+
+args = docopt(__doc__)
+
+in_model = os.path.expanduser(args['--model'])
+iterations = int(args['--iterations'])
+max_growth = float(args['--max-growth'])
+
+trt = TensorRT()
+trt.load(in_model)
+img = np.random.rand(*trt.input_shapes[0][1:]).astype(np.float32)
+
+process = psutil.Process()
+# warm up, the first inferences allocate the session's buffers
+for _ in range(iterations // 10):
+    trt.predict(img, None)
+rss_start = process.memory_info().rss
+for _ in range(iterations):
+    trt.predict(img, None)
+growth = (process.memory_info().rss - rss_start) / 2 ** 20
+print(f'memory grew by {growth:.2f} MB over {iterations} inferences, '
+      f'{max_growth:.2f} MB allowed')
+if growth > max_growth:
+    print('memory is not bounded, the interpreter leaks per inference')
+    sys.exit(1)